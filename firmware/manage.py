@@ -2,12 +2,23 @@
 
 import os
 import sys
+import json
+import time
+import hashlib
 import argparse
 import subprocess
+import configparser
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 PROJECTS = {"master_firmware": ["RF24Mesh"],
             "node_firmware": ["RF24Mesh", "SipHash"]}
 
+# Files and directories whose content decides if a project has to be rebuilt,
+# .piolibdeps holds the libraries installed by PlatformIO.
+BUILD_INPUTS = ["platformio.ini", "src", "lib", ".piolibdeps"]
+MANIFEST = ".build_manifest.json"
+BUILD_DIR = ".pioenvs"
+
 
 def _proj_path(proj):
     return os.path.join(
@@ -15,6 +26,123 @@ def _proj_path(proj):
         proj)
 
 
+def _environments(proj):
+    """The environments defined in the platformio.ini of a project."""
+    config = configparser.ConfigParser(inline_comment_prefixes=(";",))
+    config.read(os.path.join(_proj_path(proj), "platformio.ini"))
+    return [section[len("env:"):] for section in config.sections()
+            if section.startswith("env:")]
+
+
+def _source_hash(proj):
+    """Hash over the names and contents of all build inputs of a project.
+
+    Symlinks are followed, e.g. the shared Config library of the master is
+    a link into the node firmware.
+    """
+    digest = hashlib.sha256()
+    root = _proj_path(proj)
+    for name in BUILD_INPUTS:
+        path = os.path.join(root, name)
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = []
+            visited = set()
+            for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+                real = os.path.realpath(dirpath)
+                if real in visited:
+                    # A link back into a directory that was already hashed.
+                    dirnames[:] = []
+                    continue
+                visited.add(real)
+                dirnames.sort()
+                files.extend(os.path.join(dirpath, filename)
+                             for filename in sorted(filenames))
+        for filename in files:
+            digest.update(os.path.relpath(filename, root).encode())
+            digest.update(b"\0")
+            with open(filename, "rb") as fp:
+                for chunk in iter(lambda: fp.read(65536), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _load_manifest(proj):
+    try:
+        with open(os.path.join(_proj_path(proj), MANIFEST)) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(proj, manifest):
+    filename = os.path.join(_proj_path(proj), MANIFEST)
+    with open(filename + ".tmp", "w") as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+    os.replace(filename + ".tmp", filename)
+
+
+def _is_built(proj, env):
+    return os.path.isdir(os.path.join(_proj_path(proj), BUILD_DIR, env))
+
+
+def _run(proj, command):
+    """Run a command in a project, returns its exit code, output and duration."""
+    start = time.time()
+    result = subprocess.run(command, cwd=_proj_path(proj),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return result.returncode, result.stdout.decode(errors="replace"), time.time() - start
+
+
+def _build_env(proj, env):
+    return _run(proj, ["platformio", "run", "-e", env])
+
+
+def _install_libs(proj):
+    output = []
+    start = time.time()
+    for lib in PROJECTS[proj]:
+        returncode, lib_output, _ = _run(proj, ["platformio", "lib", "install", lib])
+        output.append(lib_output)
+        if returncode:
+            return returncode, "".join(output), time.time() - start
+    return 0, "".join(output), time.time() - start
+
+
+def _run_parallel(jobs, workers):
+    """Run ``{key: (function, args)}`` in worker processes.
+
+    The output of each job is printed once it finished, returns the exit
+    code and duration of each job.
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(function, *job_args): key
+                   for key, (function, job_args) in jobs.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            returncode, output, duration = future.result()
+            print("\n{} ({:.1f}s, {})".format(
+                " / ".join(key), duration, "failed" if returncode else "ok"))
+            print(output)
+            results[key] = returncode, duration
+    return results
+
+
+def _summary(results, skipped=()):
+    print("\nSummary:")
+    for key in sorted(set(results) | set(skipped)):
+        if key in results:
+            returncode, duration = results[key]
+            status = "failed ({})".format(returncode) if returncode else "ok"
+            print("  {:<40} {:>8.1f}s  {}".format(" / ".join(key), duration, status))
+        else:
+            print("  {:<40} {:>9}  unchanged".format(" / ".join(key), "-"))
+    return 1 if any(returncode for returncode, _ in results.values()) else 0
+
+
 def install(args):
     subprocess.call(["pip", "install", "--upgrade", "platformio"])
 
@@ -24,23 +152,57 @@ def init(args):
 
 
 def libs(args):
+    if args.action == "install":
+        jobs = {(proj,): (_install_libs, (proj,)) for proj in PROJECTS}
+        return _summary(_run_parallel(jobs, args.jobs))
+
     for proj in PROJECTS:
         print("\nProject: {}".format(proj))
-        if args.action == "install":
-            for lib in PROJECTS[proj]:
-                subprocess.call(["platformio", "lib", "install", lib],
-                                cwd=_proj_path(proj))
-        else:
-            subprocess.call(["platformio", "lib", "list"],
-                            cwd=_proj_path(proj))
+        subprocess.call(["platformio", "lib", "list"],
+                        cwd=_proj_path(proj))
         print("\n")
 
 
 def build(args):
-    for proj in PROJECTS:
-        print("\nProject: {}".format(proj))
-        subprocess.call(["platformio", "run"],
-                        cwd=_proj_path(proj))
+    unknown = set(args.projects) - set(PROJECTS)
+    if unknown:
+        parser.error("Unknown projects: {}".format(", ".join(sorted(unknown))))
+
+    jobs = {}
+    skipped = []
+    hashes = {}
+    for proj in args.projects or PROJECTS:
+        hashes[proj] = _source_hash(proj)
+        manifest = _load_manifest(proj)
+        for env in _environments(proj):
+            if args.env and env not in args.env:
+                continue
+            if (not args.force and manifest.get(env) == hashes[proj]
+                    and _is_built(proj, env)):
+                skipped.append((proj, env))
+            else:
+                jobs[(proj, env)] = (_build_env, (proj, env))
+
+    results = _run_parallel(jobs, args.jobs) if jobs else {}
+
+    for proj, source_hash in hashes.items():
+        built = [env for (job_proj, env), (returncode, _) in results.items()
+                 if job_proj == proj and not returncode]
+        if not built:
+            continue
+        manifest = _load_manifest(proj)
+        if _source_hash(proj) == source_hash:
+            manifest.update((env, source_hash) for env in built)
+        else:
+            # The build may have used the old or the new version of a file,
+            # so it does not count as built for either.
+            print("\n{}: sources changed during the build, "
+                  "it is built again next time".format(proj))
+            for env in built:
+                manifest.pop(env, None)
+        _save_manifest(proj, manifest)
+
+    return _summary(results, skipped)
 
 
 def upload(args):
@@ -58,9 +220,19 @@ init_parser.set_defaults(func=init)
 
 libs_parser = subparsers.add_parser("libs", help="Handle embedded libraries")
 libs_parser.add_argument("action", help="What to do", choices=["list", "install"], default="list")
+libs_parser.add_argument("-j", "--jobs", type=int, default=None,
+                         help="Number of parallel installs (default: number of CPUs)")
 libs_parser.set_defaults(func=libs)
 
 build_parser = subparsers.add_parser("build", help="Build firmware")
+build_parser.add_argument("projects", nargs="*", metavar="project",
+                          help="Projects to build: {} (default: all)".format(", ".join(sorted(PROJECTS))))
+build_parser.add_argument("-e", "--env", action="append",
+                          help="Only build this environment, can be given multiple times")
+build_parser.add_argument("-j", "--jobs", type=int, default=None,
+                          help="Number of parallel builds (default: number of CPUs)")
+build_parser.add_argument("-f", "--force", action="store_true",
+                          help="Build even if the sources did not change")
 build_parser.set_defaults(func=build)
 
 upload_parser = subparsers.add_parser("upload", help="Upload firmware to controller")
@@ -68,4 +240,4 @@ upload_parser.set_defaults(func=upload)
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    args.func(args)
+    sys.exit(args.func(args))
@@ -1,8 +1,83 @@
+import functools
+import hashlib
+import logging
+import os
+import pickle
+
+import voluptuous
 import yaml
 
 from . import schema
 
+logger = logging.getLogger(__name__)
+
+# Use the much faster libyaml based loader if it is available.
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@functools.lru_cache(maxsize=None)
+def cache_version() -> str:
+    """Hash of everything that shapes the validated config.
+
+    A cache written with another schema, loader or library version is
+    never used.
+    """
+    digest = hashlib.sha256()
+    for path in (__file__, schema.__file__):
+        with open(path, "rb") as fp:
+            digest.update(fp.read())
+    digest.update(" ".join((Loader.__name__, yaml.__version__, voluptuous.__version__)).encode())
+    return digest.hexdigest()
+
+
+def _read_cache(cache_file: str):
+    try:
+        with open(cache_file, "rb") as fp:
+            cached = pickle.load(fp)
+    except Exception as exc:
+        # The cache is only an optimization, a broken or foreign file is parsed like a missing one.
+        logger.debug("Cannot read config cache %s: %s", cache_file, exc)
+        return None
+    if not isinstance(cached, dict) or cached.get("version") != cache_version():
+        return None
+    return cached
+
+
+def _write_cache(cache_file: str, cached):
+    tmp_file = cache_file + ".tmp"
+    try:
+        with open(tmp_file, "wb") as fp:
+            pickle.dump(cached, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as exc:
+        logger.warning("Cannot write config cache %s: %s", cache_file, exc)
+
+
+def load_config(filename: str, cache_file: str = None):
+    """Load and validate the config.
+
+    If ``cache_file`` is given the validated config is stored there and
+    reused as long as the config file is unchanged. A file with a new
+    modification time is only parsed again if its content changed.
+    """
+    if cache_file is None:
+        with open(filename, "rb") as fp:
+            return schema.validate_config(yaml.load(fp, Loader))
+
+    stat = os.stat(filename)
+    cached = _read_cache(cache_file)
+    if cached is not None and (cached["mtime"], cached["size"]) == (stat.st_mtime_ns, stat.st_size):
+        return cached["config"]
+
+    with open(filename, "rb") as fp:
+        content = fp.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    if cached is not None and cached["digest"] == digest:
+        config = cached["config"]
+    else:
+        config = schema.validate_config(yaml.load(content, Loader))
 
-def load_config(filename: str):
-    with open(filename, "r") as fp:
-        return schema.validate_config(yaml.load(fp, yaml.SafeLoader))
+    _write_cache(cache_file, {"version": cache_version(), "mtime": stat.st_mtime_ns, "size": stat.st_size,
+                              "digest": digest, "config": config})
+    return config
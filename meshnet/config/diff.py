@@ -0,0 +1,52 @@
+from typing import Dict, List, NamedTuple, Set
+
+from . import schema
+
+DeviceDiff = NamedTuple("DeviceDiff", [("added", List[str]), ("removed", List[str]), ("changed", List[str]),
+                                       ("moved", bool)])
+
+ConfigDiff = NamedTuple("ConfigDiff", [("added", Set[int]), ("removed", Set[int]), ("changed", Dict[int, DeviceDiff]),
+                                       ("renamed", Set[int])])
+
+
+def diff_devices(old: List[Dict], new: List[Dict]) -> DeviceDiff:
+    """Compare the device lists of a node by device name.
+
+    ``moved`` is set if the devices that are in both lists are in a
+    different order, the firmware numbers the items in configure order.
+    """
+    old_by_name = {device[schema.CONFIG_NAME]: device for device in old}
+    new_by_name = {device[schema.CONFIG_NAME]: device for device in new}
+
+    added = [name for name in new_by_name if name not in old_by_name]
+    removed = [name for name in old_by_name if name not in new_by_name]
+    changed = [name for name, device in new_by_name.items()
+               if name in old_by_name and old_by_name[name] != device]
+    moved = ([name for name in old_by_name if name in new_by_name] !=
+             [name for name in new_by_name if name in old_by_name])
+    return DeviceDiff(added, removed, changed, moved)
+
+
+def diff_config(old: Dict, new: Dict) -> ConfigDiff:
+    """Compare two validated configs node by node.
+
+    Nodes are ``changed`` if their device list differs in any way, this is
+    what the nodes have to be configured again for. Nodes where only the
+    name differs are ``renamed``, the name is not sent to the node.
+    """
+    old_nodes = old[schema.CONFIG_NODES]
+    new_nodes = new[schema.CONFIG_NODES]
+
+    added = set(new_nodes) - set(old_nodes)
+    removed = set(old_nodes) - set(new_nodes)
+    changed = {}  # type: Dict[int, DeviceDiff]
+    renamed = set()  # type: Set[int]
+
+    for node_id in set(old_nodes) & set(new_nodes):
+        old_node, new_node = old_nodes[node_id], new_nodes[node_id]
+        if old_node[schema.CONFIG_DEVICES] != new_node[schema.CONFIG_DEVICES]:
+            changed[node_id] = diff_devices(old_node[schema.CONFIG_DEVICES], new_node[schema.CONFIG_DEVICES])
+        if old_node[schema.CONFIG_NAME] != new_node[schema.CONFIG_NAME]:
+            renamed.add(node_id)
+
+    return ConfigDiff(added, removed, changed, renamed)
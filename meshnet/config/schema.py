@@ -16,10 +16,28 @@ def dev_schema(typename: str, data_schema: Dict):
                        vol.Required(CONFIG_DATA): vol.Schema(data_schema)})
 
 
+DEVICE_SCHEMAS = {
+    "bin_switch": dev_schema("bin_switch", {"pin": int}),
+    "bin_sensor": dev_schema("bin_sensor", {"pin": int}),
+}
+
+
+def validate_device(device):
+    """Validate a device with the schema of its type.
+
+    This picks the schema by the type field instead of trying every device
+    schema one after another.
+    """
+    if not isinstance(device, dict):
+        raise vol.Invalid("expected a dictionary")
+    device_schema = DEVICE_SCHEMAS.get(device.get(CONFIG_TYPE))
+    if device_schema is None:
+        raise vol.Invalid("unknown device type: {}".format(device.get(CONFIG_TYPE)), [CONFIG_TYPE])
+    return device_schema(device)
+
+
 NODE_SCHEMA = vol.Schema({int: {vol.Required(CONFIG_NAME): str,
-                                vol.Required(CONFIG_DEVICES):
-                                    vol.Any(dev_schema("bin_switch", {"pin": int}),
-                                            dev_schema("bin_sensor", {"pin": int}))}})
+                                vol.Required(CONFIG_DEVICES): [validate_device]}})
 
 CONFIG_SCHEMA = vol.Schema({vol.Required(CONFIG_NODES): NODE_SCHEMA})
 
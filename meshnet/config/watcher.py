@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+from typing import Callable, Dict, Optional, Tuple
+
+import voluptuous as vol
+import yaml
+
+from . import load_config
+
+logger = logging.getLogger(__name__)
+
+ConfigCallback = Callable[[Dict, Dict], None]
+
+
+class ConfigWatcher(object):
+    """Reload the config file when it changes.
+
+    The file is polled every ``interval`` seconds, it is only read again if
+    its modification time or size changed. ``callback`` is called with the
+    old and the new config if the new one is valid and differs from the
+    current one. An invalid file is logged and the current config is kept.
+    """
+
+    def __init__(self, filename: str, callback: ConfigCallback, interval: float = 2.0, cache_file: str = None):
+        self.filename = filename
+        self.callback = callback
+        self.interval = interval
+        self.cache_file = cache_file
+
+        self.config = load_config(filename, cache_file)
+        self._stat = self._file_stat()
+        self._task = None  # type: Optional[asyncio.Task]
+
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self) -> bool:
+        """Reload the config if the file changed, returns if the config changed."""
+        stat = self._file_stat()
+        if stat is None or stat == self._stat:
+            return False
+        self._stat = stat
+
+        try:
+            config = load_config(self.filename, self.cache_file)
+        except (OSError, yaml.YAMLError, vol.Invalid) as exc:
+            logger.error("Keep current config, cannot load %s: %s", self.filename, exc)
+            return False
+
+        if config == self.config:
+            return False
+
+        logger.info("Config %s changed", self.filename)
+        old, self.config = self.config, config
+        self.callback(old, config)
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Cannot apply config %s", self.filename)
@@ -0,0 +1,123 @@
+import logging
+import random
+from typing import Dict, List, Tuple
+
+from meshnet.config import schema
+from meshnet.config.diff import ConfigDiff, diff_config
+from meshnet.devices import config_payload
+from meshnet.node import Node, Registry
+from meshnet.serio.connection import MessageHandler, MessageWriter
+from meshnet.serio.messages import MessageType, SerialMessage
+
+logger = logging.getLogger(__name__)
+
+MASTER_ID = 0
+
+
+class Configurator(MessageHandler):
+    """Configure the devices of the nodes from the config.
+
+    A node can only be configured right after it booted, so it gets its
+    devices as answer to its ``booted`` message followed by ``configured``
+    with a new session. When the config is replaced with :meth:`apply`, only
+    nodes whose device list changed are reset, they are configured again
+    once they are back. Changes of node names need no messages at all.
+
+    Subscribe the configurator to the connection events to repeat pending
+    configuration after a reconnect: nodes that were not heard in their new
+    session yet may have missed part of their configuration. The configure
+    messages cannot simply be sent again, the node would add the devices
+    twice, so these nodes are reset in their boot session and configured
+    again when they boot. Nodes that already switched ignore the reset.
+    """
+
+    def __init__(self, registry: Registry, key: bytes, config: Dict, rng: random.Random = None):
+        self.registry = registry
+        self.key = key
+        self.config = config
+        self._rng = rng or random.SystemRandom()
+        # node id -> boot session and the last counter sent in it, until the node is heard in its new session.
+        self._unconfirmed = {}  # type: Dict[int, Tuple[int, int]]
+
+        registry.add_listener(self.on_node_message)
+
+    def _message(self, node: Node, msg_type: MessageType, payload: bytes = b"") -> SerialMessage:
+        return SerialMessage(MASTER_ID, node.node_id, msg_type, None, node.session, node.next_counter(), payload)
+
+    def configure_messages(self, node: Node) -> List[SerialMessage]:
+        """Build the messages that configure a node and switch it to a new session."""
+        messages = [self._message(node, MessageType.configure, config_payload(device)) for device in node.devices]
+        session = self._rng.randrange(0x10000)
+        messages.append(self._message(node, MessageType.configured, session.to_bytes(2, "big")))
+        self._unconfirmed[node.node_id] = (node.session, messages[-1].counter)
+        node.set_session(session)
+        return messages
+
+    def unconfirmed(self) -> List[int]:
+        """Ids of the nodes that were configured but not heard in their new session yet."""
+        return list(self._unconfirmed)
+
+    def on_node_message(self, node: Node, message: SerialMessage, writer: MessageWriter):
+        if message.msg_type != MessageType.booted:
+            # The registry only accepts messages in the session the node was configured with.
+            self._unconfirmed.pop(node.node_id, None)
+            return
+        logger.info("Configure node %d with %d devices", node.node_id, len(node.devices))
+        writer.put_packets(self.configure_messages(node), self.key)
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        pass
+
+    def on_connect(self, writer: MessageWriter):
+        if not self._unconfirmed:
+            return
+        logger.info("Reset %d nodes that did not confirm their configuration", len(self._unconfirmed))
+        messages = []
+        for node_id, (session, counter) in list(self._unconfirmed.items()):
+            self._unconfirmed[node_id] = (session, counter + 1)
+            messages.append(SerialMessage(MASTER_ID, node_id, MessageType.reset, None, session, counter + 1, b""))
+        writer.put_packets(messages, self.key)
+
+    def on_disconnect(self):
+        pass
+
+    def apply(self, config: Dict, writer: MessageWriter) -> ConfigDiff:
+        """Switch to a new config and reset the nodes whose devices changed."""
+        diff = diff_config(self.config, config)
+        nodes = config[schema.CONFIG_NODES]
+
+        for node_id in diff.removed:
+            logger.info("Node %d removed from config", node_id)
+            self.registry.remove(node_id)
+            self._unconfirmed.pop(node_id, None)
+
+        for node_id in diff.renamed:
+            self.registry.get(node_id).name = nodes[node_id][schema.CONFIG_NAME]
+
+        reset = []
+        for node_id in diff.added:
+            node = self.registry.get(node_id)
+            if node is None:
+                self.registry.add(Node(node_id, nodes[node_id][schema.CONFIG_NAME],
+                                       nodes[node_id][schema.CONFIG_DEVICES]))
+                continue
+            # A learned node that is already running without its devices.
+            node.name = nodes[node_id][schema.CONFIG_NAME]
+            node.devices = list(nodes[node_id][schema.CONFIG_DEVICES])
+            reset.append(node)
+
+        for node_id, devices in diff.changed.items():
+            logger.info("Devices of node %d changed: added %s, removed %s, changed %s%s", node_id, devices.added,
+                        devices.removed, devices.changed, ", reordered" if devices.moved else "")
+            node = self.registry.get(node_id)
+            node.devices = list(nodes[node_id][schema.CONFIG_DEVICES])
+            reset.append(node)
+
+        # Nodes without a session did not boot yet and are configured when they do.
+        messages = [self._message(node, MessageType.reset) for node in reset if node.session is not None]
+        if messages:
+            logger.info("Reset %d nodes to apply the new config", len(messages))
+            writer.put_packets(messages, self.key)
+
+        self.config = config
+        return diff
@@ -1,4 +1,8 @@
+import struct
 from enum import Enum
+from typing import Dict, Tuple
+
+from meshnet.config import schema
 
 
 class DeviceType(Enum):
@@ -9,3 +13,73 @@ class DeviceType(Enum):
     rgb_lamp = 5
     dimmer = 6
     dht_sensor = 7
+
+
+# Fields of the device data in the order the firmware reads them from a
+# configure message, together with their struct format.
+CONFIG_FIELDS = {
+    DeviceType.bin_switch: (("pin", "B"),),
+    DeviceType.bin_sensor: (("pin", "B"),),
+    DeviceType.analog_sensor: (("pin", "B"), ("delta", "H")),
+    DeviceType.one_wire: (("pin", "B"),),
+    DeviceType.rgb_lamp: (("red_pin", "B"), ("green_pin", "B"), ("blue_pin", "B")),
+    DeviceType.dimmer: (("pin", "B"),),
+    DeviceType.dht_sensor: (("pin", "B"), ("temp_delta", "H"), ("humidity_delta", "H")),
+}  # type: Dict[DeviceType, Tuple[Tuple[str, str], ...]]
+
+_CONFIG_STRUCTS = {device_type: struct.Struct(">B" + "".join(fmt for _, fmt in fields))
+                   for device_type, fields in CONFIG_FIELDS.items()}
+
+
+def config_payload(device: Dict) -> bytes:
+    """Encode a device from the config as payload of a configure message."""
+    device_type = DeviceType[device[schema.CONFIG_TYPE]]
+    data = device[schema.CONFIG_DATA]
+    values = [data[name] for name, _ in CONFIG_FIELDS[device_type]]
+    return (_CONFIG_STRUCTS[device_type].pack(device_type.value, *values) +
+            device[schema.CONFIG_NAME].encode() + b"\0")
+
+
+# Encoding of the state of an item in reading and set_state messages. The
+# firmware does not report a state for one_wire and dht_sensor yet.
+STATE_STRUCTS = {
+    DeviceType.bin_switch: struct.Struct(">B"),
+    DeviceType.bin_sensor: struct.Struct(">B"),
+    DeviceType.analog_sensor: struct.Struct(">H"),
+    DeviceType.one_wire: struct.Struct(""),
+    DeviceType.rgb_lamp: struct.Struct(">BBB"),
+    DeviceType.dimmer: struct.Struct(">B"),
+    DeviceType.dht_sensor: struct.Struct(""),
+}  # type: Dict[DeviceType, struct.Struct]
+
+_BOOL_TYPES = (DeviceType.bin_switch, DeviceType.bin_sensor)
+
+
+def state_size(device_type: DeviceType) -> int:
+    return STATE_STRUCTS[device_type].size
+
+
+def encode_state(device_type: DeviceType, value) -> bytes:
+    """Encode the state of an item as the firmware reads and writes it.
+
+    States are bools for switches and sensors, ints for analog sensors and
+    dimmers, tuples of red, green and blue for rgb lamps and None for types
+    without state.
+    """
+    if device_type in _BOOL_TYPES:
+        return b"\xff" if value else b"\x00"
+    if device_type == DeviceType.rgb_lamp:
+        return STATE_STRUCTS[device_type].pack(*value)
+    if STATE_STRUCTS[device_type].size == 0:
+        return b""
+    return STATE_STRUCTS[device_type].pack(value)
+
+
+def decode_state(device_type: DeviceType, data, offset: int = 0):
+    """Decode a state encoded with :func:`encode_state` from ``data`` at ``offset``."""
+    values = STATE_STRUCTS[device_type].unpack_from(data, offset)
+    if device_type in _BOOL_TYPES:
+        return values[0] != 0
+    if device_type == DeviceType.rgb_lamp:
+        return values
+    return values[0] if values else None
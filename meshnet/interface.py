@@ -1,12 +1,17 @@
+import argparse
 import asyncio
 import logging
-import sys
 
 import colorlog
-from serial.aio import create_serial_connection
 
-from meshnet.serio.connection import MessageHandler, MessageWriter, AioSerialConnection
+from meshnet.config.watcher import ConfigWatcher
+from meshnet.configurator import Configurator
+from meshnet.manager import ConnectionManager
+from meshnet.metrics import MetricsRegistry, MetricsServer, SerialMetrics
+from meshnet.node import Registry
+from meshnet.serio.connection import MessageHandler, MessageWriter
 from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.verifier import MessageVerifier
 
 logger = logging.getLogger(__name__)
 
@@ -14,19 +19,16 @@ KEY = b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x0c\r\x0e\x0f'
 
 
 class TestHandler(MessageHandler):
-    def __init__(self, key: bytes):
-        self._cnt = 0
+    def __init__(self, key: bytes, registry: Registry):
         self.key = key
-
-    def next_cnt(self):
-        self._cnt = (self._cnt + 1) % 0xffff
-        return self._cnt
+        self.registry = registry
 
     def on_message(self, message: SerialMessage, writer: MessageWriter):
-        if not message.verify(self.key):
-            logger.warning("cannot verify checksum")
+        # The connection manager only passes on verified messages.
+        node = self.registry.dispatch(message)
+        if node is None:
             return
-        reply = SerialMessage(0, message.sender, MessageType.configure, None, message.session, self.next_cnt(),
+        reply = SerialMessage(0, node.node_id, MessageType.configure, None, node.session, node.next_counter(),
                               b'\x01\x01h\0')
         writer.put_packet(reply, self.key)
 
@@ -34,23 +36,45 @@ class TestHandler(MessageHandler):
         pass
 
     def on_disconnect(self):
-        sys.exit(1)
+        logger.warning("All serial links are down, waiting for reconnect")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Talk to the mesh over the master nodes")
+    parser.add_argument("--config", help="Configure the nodes from this file and reload it on changes")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this local port")
+    parser.add_argument("ports", nargs="+", help="Serial ports of the master nodes")
+    args = parser.parse_args()
+
     handler = colorlog.StreamHandler()
     handler.setFormatter(colorlog.ColoredFormatter(
         '%(log_color)s%(levelname)s:%(name)s:%(message)s'))
 
     logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG, handlers=[handler])
 
-    handler = TestHandler(KEY)
-
-    conn = AioSerialConnection()
-    conn.register_handler(handler)
-
     loop = asyncio.get_event_loop()
-    coro = create_serial_connection(loop, conn, sys.argv[1], baudrate=115200)
-    loop.run_until_complete(coro)
+
+    metrics = None
+    if args.metrics_port is not None:
+        metrics_registry = MetricsRegistry()
+        metrics = SerialMetrics(metrics_registry)
+        loop.run_until_complete(MetricsServer(metrics_registry, port=args.metrics_port).start())
+
+    verifier = MessageVerifier(KEY)
+    verifier.metrics = metrics
+    if args.config is None:
+        manager = ConnectionManager(verifier, metrics=metrics)
+        manager.register_handler(TestHandler(KEY, Registry(verifier, learn=True)))
+    else:
+        watcher = ConfigWatcher(args.config, lambda old, new: configurator.apply(new, manager))
+        registry = Registry.from_config(watcher.config, verifier, learn=True)
+        configurator = Configurator(registry, KEY, watcher.config)
+        manager = ConnectionManager(verifier, registry, metrics)
+        # Only connection events, the configurator gets the messages from the registry.
+        manager.subscribe(configurator, types=())
+        watcher.start()
+
+    for port in args.ports:
+        loop.run_until_complete(manager.open(port, loop=loop))
     loop.run_forever()
     loop.close()
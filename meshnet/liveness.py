@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from meshnet.node import Node, Registry
+from meshnet.serio.connection import MessageWriter
+from meshnet.serio.messages import SerialMessage
+
+logger = logging.getLogger(__name__)
+
+MASTER_ID = 0
+
+LivenessListener = Callable[[Node, bool], None]
+
+
+class TimerWheel(object):
+    """Hashed timer wheel for many timers with a coarse resolution.
+
+    Timers are kept in ``slots`` buckets of ``tick`` seconds each. Adding a
+    timer and advancing the wheel by one tick is O(1) per timer, no matter
+    how many timers there are. Timers further away than one rotation stay
+    in their bucket until their round comes.
+    """
+
+    def __init__(self, tick: float, slots: int, now: float = 0.0):
+        if tick <= 0 or slots < 1:
+            raise ValueError("Tick and slots have to be positive")
+        self.tick = tick
+        self._slots = [dict() for _ in range(slots)]  # type: List[Dict[int, float]]
+        self._timers = {}  # type: Dict[int, Dict[int, float]]
+        self._position = int(now // tick)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key: int):
+        return key in self._timers
+
+    def _slot(self, due: float) -> Dict[int, float]:
+        # Timers in the past are due on the next advance.
+        position = max(self._position, int(due // self.tick))
+        return self._slots[position % len(self._slots)]
+
+    def schedule(self, key: int, due: float):
+        """Set the timer of ``key``, this replaces a timer set before."""
+        self.cancel(key)
+        slot = self._slot(due)
+        slot[key] = due
+        self._timers[key] = slot
+
+    def cancel(self, key: int):
+        slot = self._timers.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def advance(self, now: float) -> List[int]:
+        """Move the wheel to ``now`` and return the keys of all expired timers."""
+        expired = []
+        target = int(now // self.tick)
+        slot_count = len(self._slots)
+        # More than one rotation only has to visit each slot once.
+        start = max(self._position, target - slot_count + 1)
+        for position in range(start, target + 1):
+            slot = self._slots[position % slot_count]
+            for key, due in list(slot.items()):
+                if due <= now:
+                    del slot[key]
+                    del self._timers[key]
+                    expired.append(key)
+        self._position = target
+        return expired
+
+
+class _Liveness(object):
+    __slots__ = ("online", "missed")
+
+    def __init__(self):
+        self.online = None  # type: Optional[bool]
+        self.missed = 0
+
+
+class LivenessMonitor(object):
+    """Ping nodes that went silent and mark them offline if they do not answer.
+
+    Nodes are checked ``silence`` seconds after they were heard last. A node
+    that sent anything in the meantime is not pinged, it is only checked
+    again later. Otherwise it gets a ping with a new session, which the
+    firmware answers with a pong. After ``max_missed`` unanswered pings
+    the node is marked offline and is pinged every ``silence`` seconds
+    until it is back. All pings propose the same session until the node
+    answers in it.
+
+    All checks run on one :class:`TimerWheel` and the checks are jittered,
+    so pings to many nodes are spread out instead of sent in bursts. The
+    pings of one tick are written at once.
+    """
+
+    def __init__(self, registry: Registry, key: bytes, silence: float = 30.0, timeout: float = 5.0,
+                 max_missed: int = 3, tick: float = 0.5, jitter: float = 0.2, rng: random.Random = None):
+        self.registry = registry
+        self.key = key
+        self.silence = silence
+        self.timeout = timeout
+        self.max_missed = max_missed
+        self.jitter = jitter
+        self._rng = rng or random.Random()
+
+        slots = max(1, int((silence * (1 + jitter)) / tick) + 1)
+        self._wheel = TimerWheel(tick, slots, time.monotonic())
+        self._states = {}  # type: Dict[int, _Liveness]
+        self._listeners = []  # type: List[LivenessListener]
+        self._task = None  # type: Optional[asyncio.Task]
+        self.pings = 0
+
+        registry.add_listener(self.on_node_message)
+
+    def add_listener(self, listener: LivenessListener):
+        """Call ``listener`` with the node and its new state when it goes online or offline."""
+        self._listeners.append(listener)
+
+    def is_online(self, node_id: int) -> Optional[bool]:
+        """If the node is online, None if it was not heard or checked yet."""
+        state = self._states.get(node_id)
+        return None if state is None else state.online
+
+    def offline(self) -> Set[int]:
+        return {node_id for node_id, state in self._states.items() if state.online is False}
+
+    def _jittered(self, delay: float) -> float:
+        return delay * self._rng.uniform(1, 1 + self.jitter)
+
+    def _set_online(self, node: Node, state: _Liveness, online: bool):
+        if state.online == online:
+            return
+        state.online = online
+        if online:
+            logger.info("Node %d is online", node.node_id)
+        else:
+            logger.warning("Node %d is offline after %d missed pings", node.node_id, state.missed)
+        for listener in self._listeners:
+            listener(node, online)
+
+    def on_node_message(self, node: Node, message: SerialMessage, writer: MessageWriter):
+        state = self._states.get(node.node_id)
+        if state is None:
+            state = self._states[node.node_id] = _Liveness()
+        state.missed = 0
+        self._set_online(node, state, True)
+        if node.node_id not in self._wheel:
+            self._wheel.schedule(node.node_id, (node.last_seen or time.monotonic()) + self._jittered(self.silence))
+
+    def watch_all(self, now: float = None):
+        """Check all nodes in the registry, spread over the next ``silence`` seconds."""
+        now = time.monotonic() if now is None else now
+        for node in self.registry:
+            if node.node_id not in self._wheel:
+                self._wheel.schedule(node.node_id, now + self._rng.uniform(0, self.silence))
+
+    def check(self, writer: MessageWriter, now: float = None) -> int:
+        """Run the checks that are due, returns the number of sent pings."""
+        now = time.monotonic() if now is None else now
+        pings = []
+        for node_id in self._wheel.advance(now):
+            node = self.registry.get(node_id)
+            if node is None:
+                self._states.pop(node_id, None)
+                continue
+            state = self._states.setdefault(node_id, _Liveness())
+
+            if node.last_seen is not None and now - node.last_seen < self.silence and not state.missed:
+                self._wheel.schedule(node_id, node.last_seen + self._jittered(self.silence))
+                continue
+
+            if state.missed >= self.max_missed:
+                self._set_online(node, state, False)
+
+            if node.session is None:
+                # Never booted, it can only be reached after it announced itself.
+                self._wheel.schedule(node_id, now + self._jittered(self.silence))
+                continue
+
+            pings.append(node.ping(self._rng, MASTER_ID))
+            state.missed += 1
+            delay = self.silence if state.online is False else self.timeout
+            self._wheel.schedule(node_id, now + self._jittered(delay))
+
+        if pings:
+            self.pings += len(pings)
+            writer.put_packets(pings, self.key)
+        return len(pings)
+
+    def start(self, writer: MessageWriter):
+        if self._task is None:
+            self.watch_all()
+            self._task = asyncio.ensure_future(self._run(writer))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, writer: MessageWriter):
+        while True:
+            await asyncio.sleep(self._wheel.tick)
+            self.check(writer)
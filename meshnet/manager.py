@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from meshnet.metrics import SerialMetrics
+from meshnet.node import Registry
+from meshnet.serio.connection import AioSerialConnection, CoroutineHandler, Dispatcher, MessageHandler, \
+    MessageStream, MessageWriter, OverflowPolicy
+from meshnet.serio.messages import MessageType, SerialMessage
+from meshnet.serio.scheduler import WriteScheduler
+from meshnet.serio.supervisor import SupervisedConnection
+from meshnet.serio.verifier import MessageVerifier
+
+logger = logging.getLogger(__name__)
+
+
+class LinkStats(object):
+    def __init__(self):
+        self.started = time.monotonic()
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+
+    def rates(self, now: float = None) -> Dict[str, float]:
+        elapsed = max(1e-9, (time.monotonic() if now is None else now) - self.started)
+        return {"frames_in": self.frames_in / elapsed,
+                "bytes_in": self.bytes_in / elapsed,
+                "frames_out": self.frames_out / elapsed,
+                "bytes_out": self.bytes_out / elapsed}
+
+
+class _Link(MessageHandler):
+    """Handler on a single serial link that reports to the manager."""
+
+    def __init__(self, manager: 'ConnectionManager', name: str, connection: AioSerialConnection):
+        self.manager = manager
+        self.name = name
+        self.connection = connection
+        self.supervisor = None  # type: Optional[SupervisedConnection]
+        self.connected = False
+        self.stats = LinkStats()
+
+    @property
+    def writer(self) -> MessageWriter:
+        return self.connection if self.supervisor is None else self.supervisor
+
+    @property
+    def usable(self) -> bool:
+        # A supervised link queues messages while it reconnects.
+        return self.connected or self.supervisor is not None
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        self.manager._on_message(self, message)
+
+    def on_connect(self, writer: MessageWriter):
+        self.manager._on_connect(self)
+
+    def on_disconnect(self):
+        self.manager._on_disconnect(self)
+
+
+class ConnectionManager(MessageWriter):
+    """Drive several master nodes on one event loop.
+
+    Messages from all links go to the handlers registered at the manager,
+    with the manager as writer. The manager remembers over which link each
+    node was heard last and sends messages to a node only over that link.
+    Messages to nodes that were not heard yet are sent over all links, a
+    master ignores messages to nodes it does not know.
+
+    The manager verifies all messages with ``verifier`` before it looks at
+    them, messages with a wrong hash neither change the routes nor reach
+    the registry or the handlers. The ``registry`` gets the verified
+    messages before the other handlers.
+
+    Links opened with ``reconnect`` are supervised: they are reopened after
+    errors and keep their routes while they are down, messages to them are
+    queued until they are back.
+
+    Each link writes through a :class:`WriteScheduler` that paces the
+    writes to the serial line and holds them back while the transport is
+    busy, unless the connection passed to :meth:`add_link` already has one.
+
+    With ``metrics``, all links count their traffic in the same metrics.
+    """
+
+    def __init__(self, verifier: MessageVerifier, registry: Registry = None, metrics: SerialMetrics = None):
+        self.verifier = verifier
+        self.registry = registry
+        self.metrics = metrics
+        self._links = {}  # type: Dict[str, _Link]
+        self._routes = {}  # type: Dict[int, _Link]
+        self._dispatcher = Dispatcher()
+        self._holders = set()  # type: Set[MessageStream]
+
+    def register_handler(self, handler: MessageHandler):
+        self._dispatcher.subscribe(handler)
+
+    def subscribe(self, handler: MessageHandler, types: Iterable[MessageType] = None, nodes: Iterable[int] = None):
+        """Register a handler that only gets messages of the given types or from the given nodes."""
+        self._dispatcher.subscribe(handler, types, nodes)
+
+    def unsubscribe(self, handler: MessageHandler):
+        self._dispatcher.unsubscribe(handler)
+
+    def messages(self, types: Iterable[MessageType] = None, nodes: Iterable[int] = None, maxsize: int = 256,
+                 policy: OverflowPolicy = OverflowPolicy.drop_oldest) -> MessageStream:
+        """Stream the messages of all links, see :meth:`AioSerialConnection.messages`.
+
+        A blocking stream stops reading on all links while it is full.
+        """
+        stream = MessageStream(self, maxsize, policy)
+        self._dispatcher.subscribe(stream, types, nodes)
+        return stream
+
+    def add_coroutine_handler(self, handler: CoroutineHandler, types: Iterable[MessageType] = None,
+                              nodes: Iterable[int] = None, maxsize: int = 256,
+                              policy: OverflowPolicy = OverflowPolicy.drop_oldest) -> asyncio.Task:
+        """Await ``handler(message, writer)`` for the messages of all links in a task of its own."""
+        return asyncio.ensure_future(self.messages(types, nodes, maxsize, policy).run(handler, self))
+
+    def _hold_reading(self, stream: MessageStream):
+        self._holders.add(stream)
+        for link in self._links.values():
+            link.connection._hold_reading(stream)
+
+    def _release_reading(self, stream: MessageStream):
+        self._holders.discard(stream)
+        for link in self._links.values():
+            link.connection._release_reading(stream)
+
+    def add_link(self, name: str, connection: AioSerialConnection = None) -> AioSerialConnection:
+        if name in self._links:
+            raise ValueError("Link {} already exists".format(name))
+        if connection is None:
+            connection = AioSerialConnection()
+        if self.metrics is not None:
+            connection.metrics = self.metrics
+        if connection.scheduler is None:
+            connection.scheduler = WriteScheduler(connection)
+        link = _Link(self, name, connection)
+        connection.register_handler(link)
+        for stream in self._holders:
+            connection._hold_reading(stream)
+        self._links[name] = link
+        return connection
+
+    async def open(self, port: str, baudrate: int = 115200, loop: asyncio.AbstractEventLoop = None,
+                   reconnect: bool = True):
+        """Open a serial port and add it as link."""
+        try:
+            from serial_asyncio import create_serial_connection
+        except ImportError:
+            from serial.aio import create_serial_connection
+
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        connection = self.add_link(port)
+
+        def connect():
+            return create_serial_connection(loop, connection, port, baudrate=baudrate)
+
+        if not reconnect:
+            await connect()
+            return
+
+        supervisor = SupervisedConnection(connection, connect)
+        self._links[port].supervisor = supervisor
+        supervisor.start()
+
+    def links(self) -> List[str]:
+        return list(self._links)
+
+    def route(self, node_id: int) -> Optional[str]:
+        link = self._routes.get(node_id)
+        return None if link is None else link.name
+
+    def stats(self) -> Dict[str, LinkStats]:
+        return {name: link.stats for name, link in self._links.items()}
+
+    def total_stats(self) -> LinkStats:
+        total = LinkStats()
+        for link in self._links.values():
+            total.started = min(total.started, link.stats.started)
+            total.frames_in += link.stats.frames_in
+            total.bytes_in += link.stats.bytes_in
+            total.frames_out += link.stats.frames_out
+            total.bytes_out += link.stats.bytes_out
+        return total
+
+    def _on_message(self, link: _Link, message: SerialMessage):
+        link.stats.frames_in += 1
+        link.stats.bytes_in += message.frame_len()
+        if not self.verifier.verify(message):
+            return
+        self._routes[message.sender] = link
+        if self.registry is not None:
+            self.registry.on_verified_message(message, self)
+        self._dispatcher.dispatch(message, self)
+
+    def _on_connect(self, link: _Link):
+        link.connected = True
+        if sum(1 for other in self._links.values() if other.connected) == 1:
+            for handler in self._dispatcher.handlers:
+                handler.on_connect(self)
+
+    def _on_disconnect(self, link: _Link):
+        link.connected = False
+        if link.supervisor is None:
+            for node_id in [node_id for node_id, route in self._routes.items() if route is link]:
+                del self._routes[node_id]
+        if not any(other.connected for other in self._links.values()):
+            for handler in self._dispatcher.handlers:
+                handler.on_disconnect()
+
+    def _targets(self, node_id: int) -> Iterable[_Link]:
+        link = self._routes.get(node_id)
+        if link is not None:
+            return (link,)
+        return [link for link in self._links.values() if link.usable]
+
+    def put_packet(self, message: SerialMessage, key: bytes):
+        self.put_packets((message,), key)
+
+    def put_packets(self, messages: Iterable[SerialMessage], key: bytes):
+        by_link = {}  # type: Dict[str, List[SerialMessage]]
+        for message in messages:
+            targets = self._targets(message.receiver)
+            if not targets:
+                logger.warning("No connected link to send message to node %d", message.receiver)
+            for link in targets:
+                by_link.setdefault(link.name, []).append(message)
+
+        for name, link_messages in by_link.items():
+            link = self._links[name]
+            link.stats.frames_out += len(link_messages)
+            link.stats.bytes_out += sum(message.frame_len() for message in link_messages)
+            link.writer.put_packets(link_messages, key)
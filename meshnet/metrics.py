@@ -0,0 +1,247 @@
+import asyncio
+import bisect
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (64, 256, 1024, 4096, 16384, 65536)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape(str(value))) for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter(object):
+    """Monotonic counter, optionally broken down by label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # type: Dict[Labels, float]
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        return ["{}{} {}".format(self.name, _format_labels(self.labels, labels), _format_value(value))
+                for labels, value in sorted(self._values.items())]
+
+
+class Histogram(object):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Counts per bucket and one for values above the last bucket, the sum and the count.
+        self._values = {}  # type: Dict[Labels, List]
+
+    def observe(self, value: float, labels: Labels = ()):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, labels: Labels = ()) -> int:
+        entry = self._values.get(labels)
+        return 0 if entry is None else entry[2]
+
+    def render(self) -> List[str]:
+        lines = []
+        names = self.labels + ("le",)
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append("{}_bucket{} {}".format(self.name, _format_labels(names, labels + (_format_value(bound),)),
+                                                     cumulative))
+            label_text = _format_labels(self.labels, labels)
+            lines.append("{}_sum{} {}".format(self.name, label_text, _format_value(total)))
+            lines.append("{}_count{} {}".format(self.name, label_text, count))
+        return lines
+
+
+Metric = Union[Counter, Histogram]
+
+
+class MetricsRegistry(object):
+    """Collection of metrics that can be exported in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}  # type: Dict[str, Metric]
+
+    def _add(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.labels != metric.labels:
+                raise ValueError("Metric {} already exists with another type or labels".format(metric.name))
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS,
+                  labels: Sequence[str] = ()) -> Histogram:
+        return self._add(Histogram(name, help_text, buckets, labels))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append("# HELP {} {}".format(name, metric.help))
+            lines.append("# TYPE {} {}".format(name, metric.kind))
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def dump(self, filename: str):
+        """Write the metrics to a file, e.g. for the textfile collector of the node exporter."""
+        tmp_file = filename + ".tmp"
+        with open(tmp_file, "w") as fp:
+            fp.write(self.render())
+        os.replace(tmp_file, filename)
+
+
+class MetricsServer(object):
+    """Serve the metrics of a registry over HTTP for Prometheus to scrape."""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9120):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None  # type: Optional[asyncio.AbstractServer]
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def sockets(self):
+        return [] if self._server is None else self._server.sockets
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            # Skip the headers of the request.
+            while (await reader.readline()).strip():
+                pass
+
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1] in (b"/", b"/metrics"):
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write("HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {}\r\n\r\n"
+                         .format(status, len(body)).encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as exc:
+            logger.debug("Metrics request failed: %s", exc)
+        finally:
+            writer.close()
+
+
+class SerialMetrics(object):
+    """Metrics of the serial links, updated by the connections and decoders.
+
+    The connections count the decoded messages by type. Messages are only
+    counted by node once the verifier checked their hash, messages with a
+    wrong hash are counted as rejected frames and as hash failures.
+
+    With ``per_node`` the verified messages and hash failures are also
+    broken down by the sending node. Only nodes that sent a message with a
+    valid hash get a label of their own, all other sender ids are counted
+    as ``unknown``. Otherwise every corrupted sender id would add a series.
+    """
+
+    def __init__(self, registry: MetricsRegistry, per_node: bool = True):
+        self.per_node = per_node
+        self._verified_nodes = set()  # type: Set[int]
+        self.bytes_in = registry.counter("meshnet_serial_received_bytes_total", "Bytes read from the serial links")
+        self.bytes_out = registry.counter("meshnet_serial_sent_bytes_total", "Bytes written to the serial links")
+        self.skipped_bytes = registry.counter("meshnet_serial_skipped_bytes_total",
+                                              "Bytes skipped while searching the next frame")
+        self.rejected_frames = registry.counter("meshnet_serial_rejected_frames_total",
+                                                "Frames that could not be decoded", ("reason",))
+        self.decoded = registry.counter("meshnet_serial_decoded_messages_total", "Decoded messages", ("type",))
+        self.messages = registry.counter("meshnet_serial_messages_total", "Messages with a valid hash",
+                                         ("type", "node") if per_node else ("type",))
+        self.hash_failures = registry.counter("meshnet_serial_hash_failures_total",
+                                              "Messages with an invalid hash", ("node",) if per_node else ())
+        self.paused_buffer = registry.histogram("meshnet_serial_paused_write_buffer_bytes",
+                                                "Size of the write buffer when writing was paused")
+
+    def received(self, size: int):
+        self.bytes_in.inc((), size)
+
+    def sent(self, size: int):
+        self.bytes_out.inc((), size)
+
+    def skipped(self, size: int):
+        self.skipped_bytes.inc((), size)
+
+    def rejected(self, reason: str):
+        self.rejected_frames.inc((reason,))
+
+    def _node_label(self, node: int) -> str:
+        return str(node) if node in self._verified_nodes else "unknown"
+
+    def verified(self, node: int):
+        """Give the node a label of its own, it sent a message with a valid hash."""
+        self._verified_nodes.add(node)
+
+    def decoded_message(self, msg_type: str):
+        self.decoded.inc((msg_type,))
+
+    def message(self, msg_type: str, node: int):
+        """Count a message with a valid hash."""
+        self.messages.inc((msg_type, self._node_label(node)) if self.per_node else (msg_type,))
+
+    def hash_failure(self, node: int):
+        self.rejected("hash")
+        self.hash_failures.inc((self._node_label(node),) if self.per_node else ())
+
+    def paused(self, buffer_size: int):
+        self.paused_buffer.observe(buffer_size)
@@ -1,5 +1,257 @@
+import logging
+import random
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from meshnet.config import schema
+from meshnet.devices import DeviceType
+from meshnet.serio.connection import MessageHandler, MessageWriter
+from meshnet.serio.messages import MessageType, SerialMessage
+from meshnet.serio.payload import ItemState, StatePayload
+from meshnet.serio.verifier import MessageVerifier
+
+logger = logging.getLogger(__name__)
+
+MAX_NODE_ID = 0xffff
+MAX_COUNTER = 0xffff
+# A new session resets both counters, it is proposed well before one of them runs out.
+RENEW_COUNTER = MAX_COUNTER - 0x100
+
+
 class Node(object):
-    pass
+    """Host side state of a node in the mesh.
+
+    Keeps the session negotiated with the node, the counter for messages
+    sent to it and the last counter received from it. Like the firmware, a
+    message is only accepted if it belongs to the current session and its
+    counter is larger than the last one seen. The counters are 16 bit and
+    do not wrap, the node has to get a new session before they run out.
+    """
+
+    def __init__(self, node_id: int, name: str = None, devices: List[Dict] = None):
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError("Invalid node id: {}".format(node_id))
+
+        self.node_id = node_id
+        self.name = name
+        self.devices = devices or []
+
+        self.session = None  # type: Optional[int]
+        self.pending_session = None  # type: Optional[int]
+        self.last_counter = -1
+        self.last_seen = None  # type: Optional[float]
+        self.rejected = 0
+
+        self._counter = 0
+
+    def __repr__(self):
+        return "Node<id={}, name={}, session={}>".format(self.node_id, self.name, self.session)
+
+    @property
+    def devices(self) -> List[Dict]:
+        return self._devices
+
+    @devices.setter
+    def devices(self, devices: List[Dict]):
+        self._devices = list(devices)
+        self._state_payload = None  # type: Optional[StatePayload]
+
+    @property
+    def state_payload(self) -> StatePayload:
+        """Codec for the states of the devices of this node."""
+        if self._state_payload is None:
+            self._state_payload = StatePayload([DeviceType[device[schema.CONFIG_TYPE]] for device in self._devices])
+        return self._state_payload
+
+    def state_messages(self, states: Iterable[ItemState], msg_type: MessageType = MessageType.set_state,
+                       sender: int = 0, batch: bool = False) -> List[SerialMessage]:
+        """Build the messages to send states to the node.
+
+        ``states`` are pairs of item id and state, or only item ids for
+        ``get_state``. Each item gets a frame of its own, unless ``batch``
+        packs them into as few frames as possible for firmware that reads
+        all items of a frame.
+        """
+        payloads = (self.state_payload.encode_request(states, batch) if msg_type == MessageType.get_state
+                    else self.state_payload.encode(states, batch))
+        return [SerialMessage(sender, self.node_id, msg_type, None, self.session, self.next_counter(), payload)
+                for payload in payloads]
+
+    def next_counter(self) -> int:
+        if self._counter >= MAX_COUNTER:
+            # The node rejects this counter, only a new session helps.
+            logger.debug("Counter for node %d ran out", self.node_id)
+            return MAX_COUNTER
+        self._counter += 1
+        if self._counter == MAX_COUNTER:
+            logger.warning("Counter for node %d ran out, messages are rejected until the next session",
+                           self.node_id)
+        return self._counter
+
+    @property
+    def needs_session(self) -> bool:
+        """If one of the counters is about to run out and a new session has to reset them."""
+        return self._counter >= RENEW_COUNTER or self.last_counter >= RENEW_COUNTER
+
+    def set_session(self, session: int):
+        """Switch to a new session, this resets both counters like the firmware does."""
+        self.session = session
+        self.pending_session = None
+        self.last_counter = -1
+        self._counter = 0
+
+    def propose_session(self, session: int):
+        """Remember a session sent to the node with a ping.
+
+        The node switches to it when it gets the ping, so the first message
+        in this session is accepted and switches the host side as well. The
+        proposal stays outstanding until then, pings sent again have to
+        propose the same session.
+        """
+        self.pending_session = session
+
+    def ping(self, rng: random.Random, sender: int = 0) -> SerialMessage:
+        """Build a ping that proposes a new session to the node.
+
+        Until the node answers in the proposed session, every ping proposes
+        the same one: if only the pong was lost, the node already switched
+        to it and its next own pong in that session has to be accepted.
+        """
+        session = self.pending_session
+        if session is None:
+            session = rng.randrange(0x10000)
+            if session == self.session:
+                session = (session + 1) % 0x10000
+            self.propose_session(session)
+        return SerialMessage(sender, self.node_id, MessageType.ping, None, self.session, self.next_counter(),
+                             session.to_bytes(2, "big"))
+
+    def boot(self, message: SerialMessage, now: float = None) -> bool:
+        """Start over with the session of a verified ``booted`` message.
+
+        A ``booted`` message of the current session is a replay, it would
+        reset the counters and let older messages of the session through.
+        """
+        if message.session == self.session:
+            logger.warning("Replayed boot of node %d in session %d", self.node_id, message.session)
+            self.rejected += 1
+            return False
+
+        logger.info("Node %d booted with session %d", self.node_id, message.session)
+        self.set_session(message.session)
+        self.last_counter = message.counter
+        self.last_seen = time.monotonic() if now is None else now
+        return True
+
+    def accept(self, message: SerialMessage, now: float = None) -> bool:
+        """Check the session and counter of a verified message from the node."""
+        if message.session == self.pending_session and message.session != self.session:
+            self.set_session(message.session)
+        elif message.session != self.session:
+            logger.info("Wrong session from node %d: %d != %s", self.node_id, message.session, self.session)
+            self.rejected += 1
+            return False
+        elif message.counter <= self.last_counter:
+            logger.info("Replayed counter from node %d: %d <= %d", self.node_id, message.counter, self.last_counter)
+            self.rejected += 1
+            return False
+
+        self.last_counter = message.counter
+        self.last_seen = time.monotonic() if now is None else now
+        return True
+
+
+NodeListener = Callable[[Node, SerialMessage, MessageWriter], None]
+
+
+class Registry(MessageHandler):
+    """Index of all known nodes by node id.
+
+    Incoming messages are verified, looked up by their sender, checked
+    against the session and counter of the node and passed to the listeners
+    together with the node. Messages with a wrong hash are dropped before
+    they can change any state. If ``learn`` is set, unknown nodes are added
+    when they announce themselves with a ``booted`` message.
+
+    When the counters of a node are about to run out, the registry pings
+    the node with a new session after each of its messages until the node
+    switched to it.
+    """
+
+    def __init__(self, verifier: MessageVerifier, learn: bool = False, rng: random.Random = None):
+        self._nodes = {}  # type: Dict[int, Node]
+        self._listeners = []  # type: List[NodeListener]
+        self.learn = learn
+        self.verifier = verifier
+        self.unknown = 0
+        self._rng = rng or random.SystemRandom()
+
+    @classmethod
+    def from_config(cls, config: Dict, verifier: MessageVerifier, learn: bool = False,
+                    rng: random.Random = None) -> 'Registry':
+        registry = cls(verifier, learn, rng)
+        for node_id, node_config in config[schema.CONFIG_NODES].items():
+            registry.add(Node(node_id, node_config[schema.CONFIG_NAME], node_config[schema.CONFIG_DEVICES]))
+        return registry
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node_id: int):
+        return node_id in self._nodes
+
+    def __iter__(self) -> Iterator[Node]:
+        return iter(list(self._nodes.values()))
+
+    def add(self, node: Node) -> Node:
+        self._nodes[node.node_id] = node
+        return node
+
+    def remove(self, node_id: int) -> Optional[Node]:
+        return self._nodes.pop(node_id, None)
+
+    def get(self, node_id: int) -> Optional[Node]:
+        return self._nodes.get(node_id)
+
+    def add_listener(self, listener: NodeListener):
+        self._listeners.append(listener)
+
+    def dispatch(self, message: SerialMessage) -> Optional[Node]:
+        """Look up the sending node of a verified message and update its state.
+
+        Returns the node if the message was accepted.
+        """
+        node = self._nodes.get(message.sender)
+        if node is None:
+            if not (self.learn and message.msg_type == MessageType.booted):
+                self.unknown += 1
+                logger.debug("Message from unknown node %d", message.sender)
+                return None
+            node = self.add(Node(message.sender))
+
+        if message.msg_type == MessageType.booted:
+            accepted = node.boot(message)
+        else:
+            accepted = node.accept(message)
+        return node if accepted else None
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        if self.verifier.verify(message):
+            self.on_verified_message(message, writer)
+
+    def on_verified_message(self, message: SerialMessage, writer: MessageWriter):
+        """Handle a message that was already verified by the caller."""
+        node = self.dispatch(message)
+        if node is None:
+            return
+        for listener in self._listeners:
+            listener(node, message, writer)
+        if node.needs_session and writer is not None:
+            logger.info("Counters of node %d run out, propose a new session", node.node_id)
+            writer.put_packet(node.ping(self._rng), self.verifier.key_for(node.node_id))
+
+    def on_connect(self, writer: MessageWriter):
+        pass
 
-class Registry(object):
-    pass
\ No newline at end of file
+    def on_disconnect(self):
+        pass
@@ -0,0 +1,244 @@
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from meshnet.serio.trace import TraceDirection
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b"MNCAP\x01"
+# timestamp, direction, length of the data
+_RECORD_HEADER = struct.Struct("<dBI")
+# timestamp and offset of a record
+_INDEX_ENTRY = struct.Struct("<dQ")
+
+_DIRECTIONS = {TraceDirection.received: 0, TraceDirection.sent: 1}
+_DIRECTION_VALUES = {value: direction for direction, value in _DIRECTIONS.items()}
+
+Record = Tuple[float, TraceDirection, memoryview]
+
+
+def index_filename(filename: str) -> str:
+    return filename + ".idx"
+
+
+class CaptureWriter(object):
+    """Append the traffic of a serial link to a capture file.
+
+    Every chunk is stored with its timestamp and direction. The writer has
+    the same :meth:`record` method as :class:`FrameTrace`, so it can be
+    set as ``trace`` of a connection to capture everything it reads and
+    writes. Every ``index_every`` records the offset of the record is
+    written to an index file next to the capture, which lets readers seek
+    by time without scanning the capture.
+    """
+
+    def __init__(self, filename: str, index_every: int = 1024):
+        self.filename = filename
+        self.index_every = index_every
+        exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        self._fp = open(filename, "ab")  # type: BinaryIO
+        self._index = open(index_filename(filename), "ab")  # type: BinaryIO
+        if not exists:
+            self._fp.write(CAPTURE_MAGIC)
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, direction: TraceDirection, data, timestamp: float = None):
+        if timestamp is None:
+            timestamp = time.time()
+        if self._count % self.index_every == 0:
+            self._index.write(_INDEX_ENTRY.pack(timestamp, self._fp.tell()))
+        self._count += 1
+        self._fp.write(_RECORD_HEADER.pack(timestamp, _DIRECTIONS[direction], len(data)))
+        self._fp.write(data)
+
+    def flush(self):
+        self._fp.flush()
+        self._index.flush()
+
+    def close(self):
+        self._fp.close()
+        self._index.close()
+
+
+class CaptureReader(object):
+    """Read a capture file through a memory map.
+
+    Records are returned as views into the map, so even captures larger
+    than the memory can be read without loading them. The views are only
+    valid until the reader is closed.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._fp = open(filename, "rb")
+        self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        if self._map[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            self.close()
+            raise ValueError("Not a capture file: {}".format(filename))
+        self._index_times, self._index_offsets = self._read_index()
+
+    def _read_index(self) -> Tuple[List[float], List[int]]:
+        times, offsets = [], []
+        try:
+            with open(index_filename(self.filename), "rb") as fp:
+                data = fp.read()
+        except OSError:
+            return times, offsets
+        for offset in range(0, len(data) - _INDEX_ENTRY.size + 1, _INDEX_ENTRY.size):
+            timestamp, position = _INDEX_ENTRY.unpack_from(data, offset)
+            times.append(timestamp)
+            offsets.append(position)
+        return times, offsets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # Records are still referenced, the map is closed once they are gone.
+            pass
+        self._fp.close()
+
+    def __len__(self):
+        return len(self._map)
+
+    def records(self, offset: int = None) -> Iterator[Record]:
+        """Iterate over the records from ``offset`` on, a truncated last record is skipped."""
+        pos = len(CAPTURE_MAGIC) if offset is None else offset
+        end = len(self._map)
+        while pos + _RECORD_HEADER.size <= end:
+            timestamp, direction, length = _RECORD_HEADER.unpack_from(self._map, pos)
+            pos += _RECORD_HEADER.size
+            if pos + length > end:
+                logger.warning("Truncated record at the end of %s", self.filename)
+                return
+            yield timestamp, _DIRECTION_VALUES[direction], self._view[pos:pos + length]
+            pos += length
+
+    def __iter__(self) -> Iterator[Record]:
+        return self.records()
+
+    def offset_at(self, timestamp: float) -> int:
+        """Offset of a record at or shortly before ``timestamp`` to start reading from."""
+        index = bisect.bisect_right(self._index_times, timestamp) - 1
+        if index < 0:
+            return len(CAPTURE_MAGIC)
+        return self._index_offsets[index]
+
+    def since(self, timestamp: float) -> Iterator[Record]:
+        """Iterate over the records from ``timestamp`` on."""
+        for record in self.records(self.offset_at(timestamp)):
+            if record[0] >= timestamp:
+                yield record
+
+
+class ReplayTransport(asyncio.Transport):
+    """Feed the received data of a capture into a protocol.
+
+    With a ``speed`` the data is replayed with the original timing, scaled
+    by the speed. Without it, it is replayed as fast as possible, giving
+    control back to the event loop every ``batch`` records. Data written
+    by the protocol is only counted. While reading is paused, the replay
+    waits and the time spent paused is left out of the original timing.
+    """
+
+    def __init__(self, reader: CaptureReader, protocol: asyncio.Protocol, speed: Optional[float] = 1.0,
+                 start: float = None, batch: int = 64):
+        super().__init__()
+        self._reader = reader
+        self._protocol = protocol
+        self._speed = speed
+        self._start = start
+        self._batch = batch
+        self._closing = False
+        self._paused = False
+        self._resume_waiter = None  # type: Optional[asyncio.Future]
+
+        self.replayed = 0
+        self.replayed_bytes = 0
+        self.written = 0
+
+    async def replay(self):
+        """Replay the capture, the protocol is connected before and disconnected after."""
+        loop = asyncio.get_event_loop()
+        self._protocol.connection_made(self)
+        records = self._reader.records() if self._start is None else self._reader.since(self._start)
+
+        first = None
+        started = loop.time()
+        for timestamp, direction, data in records:
+            if self._paused:
+                paused = loop.time()
+                while self._paused and not self._closing:
+                    self._resume_waiter = loop.create_future()
+                    await self._resume_waiter
+                started += loop.time() - paused
+            if self._closing:
+                break
+            if direction != TraceDirection.received:
+                continue
+
+            if self._speed:
+                if first is None:
+                    first = timestamp
+                delay = started + (timestamp - first) / self._speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif self.replayed % self._batch == 0:
+                await asyncio.sleep(0)
+
+            self._protocol.data_received(bytes(data))
+            self.replayed += 1
+            self.replayed_bytes += len(data)
+
+        self.close()
+
+    def pause_reading(self):
+        self._paused = True
+
+    def resume_reading(self):
+        self._paused = False
+        self._wake()
+
+    def is_reading(self):
+        return not self._paused and not self._closing
+
+    def _wake(self):
+        waiter = self._resume_waiter
+        self._resume_waiter = None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def write(self, data):
+        self.written += len(data)
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self._wake()
+            self._protocol.connection_lost(None)
@@ -1,35 +1,114 @@
 import abc
 import asyncio
+import collections
 import logging
-from typing import List
+import queue
+import threading
+from enum import Enum
+from typing import Any, Awaitable, Callable, Deque, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, \
+    Tuple
 
 import serial
 
+from meshnet.metrics import SerialMetrics
+from meshnet.serio.pending import PendingReplies
+from meshnet.serio.trace import FrameTrace, TraceDirection
 from meshnet.serio.util import to_hex
 
-from meshnet.serio.messages import SerialMessageConsumer, SerialMessage
+from meshnet.serio.messages import BulkMessageConsumer, MessageEncoder, MessageType, SerialMessage, MAX_FRAME_LEN
 
 logger = logging.getLogger(__name__)
 
 
 class SerialBuffer(object):
-    def __init__(self):
-        self._buff = bytearray()
+    """Bounded receive buffer that hands out data without copying.
+
+    The storage is allocated once with a fixed capacity. Reading only moves
+    the read offset and returns a memoryview into the storage. The unread
+    data is moved to the front when the free space at the end runs out, so
+    views returned by :meth:`peek` and :meth:`read` are only valid until the
+    next call to :meth:`put`.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        if capacity < MAX_FRAME_LEN:
+            raise ValueError("Capacity must at least hold one frame ({} bytes)".format(MAX_FRAME_LEN))
+        self._buff = bytearray(capacity)
+        self._start = 0
+        self._end = 0
+        self.high_water = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buff)
 
-    def put(self, data):
-        if isinstance(data, (bytes, bytearray)):
-            self._buff.extend(data)
-        else:
-            self._buff.append(data)
+    def put(self, data) -> int:
+        """Append data to the buffer.
 
-    def read(self, max_bytes):
-        ret = self._buff[:max_bytes]
-        self._buff = self._buff[max_bytes:]
+        Returns the number of bytes accepted. This is less than the size of
+        ``data`` if the buffer is full and the caller has to consume data
+        before it can put the rest.
+        """
+        if isinstance(data, int):
+            data = bytes((data,))
 
-        return bytes(ret)
+        size = min(len(data), self.free())
+        if size == 0:
+            return 0
 
-    def available(self):
-        return len(self._buff)
+        if self._end + size > len(self._buff):
+            self._compact()
+
+        with memoryview(data) as view:
+            self._buff[self._end:self._end + size] = view[:size]
+        self._end += size
+        self.high_water = max(self.high_water, self._end - self._start)
+        return size
+
+    def _compact(self):
+        size = self._end - self._start
+        self._buff[:size] = self._buff[self._start:self._end]
+        self._start = 0
+        self._end = size
+
+    def peek(self, max_bytes: int = None) -> memoryview:
+        end = self._end
+        if max_bytes is not None:
+            end = min(end, self._start + max_bytes)
+        return memoryview(self._buff)[self._start:end]
+
+    def consume(self, count: int):
+        self._start = min(self._end, self._start + count)
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def read(self, max_bytes: int) -> memoryview:
+        ret = self.peek(max_bytes)
+        self.consume(len(ret))
+        return ret
+
+    def extract(self, scan: Callable[..., Tuple[Any, int]]):
+        """Run a scanner directly on the unread data.
+
+        ``scan`` is called with the storage and the start and end offset of
+        the unread data and has to return its result together with the
+        offset up to which it consumed the data.
+        """
+        result, consumed = scan(self._buff, self._start, self._end)
+        self.consume(consumed - self._start)
+        return result
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def available(self) -> int:
+        return self._end - self._start
+
+    def free(self) -> int:
+        return len(self._buff) - self.available()
+
+    def is_full(self) -> bool:
+        return self.available() == len(self._buff)
 
 
 class MessageWriter(object, metaclass=abc.ABCMeta):
@@ -37,6 +116,10 @@ class MessageWriter(object, metaclass=abc.ABCMeta):
     def put_packet(self, packet: SerialMessage, key: bytes):
         pass
 
+    def put_packets(self, packets: Iterable[SerialMessage], key: bytes):
+        for packet in packets:
+            self.put_packet(packet, key)
+
 
 class MessageHandler(object, metaclass=abc.ABCMeta):
     @abc.abstractmethod
@@ -52,83 +135,714 @@ class MessageHandler(object, metaclass=abc.ABCMeta):
         pass
 
 
-class AioSerialConnection(asyncio.Protocol, MessageWriter):
+class _Subscription(object):
+    __slots__ = ("handler", "types", "nodes")
+
+    def __init__(self, handler: MessageHandler, types: Optional[FrozenSet[MessageType]],
+                 nodes: Optional[FrozenSet[int]]):
+        self.handler = handler
+        self.types = types
+        self.nodes = nodes
+
+    def matches(self, msg_type: MessageType, node_id: int = None) -> bool:
+        return ((self.types is None or msg_type in self.types) and
+                (self.nodes is None or node_id in self.nodes))
+
+
+def _unique(handlers: Iterable[MessageHandler]) -> Tuple[MessageHandler, ...]:
+    """The handlers without repetitions, in the order they first appear."""
+    seen = set()  # type: Set[int]
+    result = []
+    for handler in handlers:
+        if id(handler) not in seen:
+            seen.add(id(handler))
+            result.append(handler)
+    return tuple(result)
+
+
+class Dispatcher(object):
+    """Pass messages only to the handlers that subscribed to them.
+
+    Handlers subscribe to message types, sending nodes or both, without a
+    filter they get every message. The handlers for each message type are
+    looked up in a table that is rebuilt when the subscriptions change. Only
+    messages from nodes that some handler subscribed to by node id need a
+    second lookup. Handlers are always called in the order they subscribed.
+    """
+
     def __init__(self):
-        self._handlers = []  # type: List[MessageHandler]
+        self._subscriptions = []  # type: List[_Subscription]
+        self._by_type = {}  # type: Dict[MessageType, Tuple[MessageHandler, ...]]
+        self._by_node = {}  # type: Dict[Tuple[MessageType, int], Tuple[MessageHandler, ...]]
+        self._node_ids = frozenset()  # type: FrozenSet[int]
+        self.handlers = ()  # type: Tuple[MessageHandler, ...]
+        self._rebuild()
+
+    def __len__(self):
+        return len(self.handlers)
+
+    def subscribe(self, handler: MessageHandler, types: Iterable[MessageType] = None, nodes: Iterable[int] = None):
+        self._subscriptions.append(_Subscription(handler, None if types is None else frozenset(types),
+                                                 None if nodes is None else frozenset(nodes)))
+        self._rebuild()
+
+    def unsubscribe(self, handler: MessageHandler):
+        self._subscriptions = [sub for sub in self._subscriptions if sub.handler is not handler]
+        self._rebuild()
+
+    def _rebuild(self):
+        subscriptions = self._subscriptions
+        # A handler with several matching subscriptions is called only once.
+        self._by_type = {msg_type: _unique(sub.handler for sub in subscriptions
+                                           if sub.nodes is None and sub.matches(msg_type))
+                         for msg_type in MessageType}
+        self._by_node = {}
+        node_ids = set()  # type: Set[int]
+        for sub in subscriptions:
+            if sub.nodes is not None:
+                node_ids.update(sub.nodes)
+        self._node_ids = frozenset(node_ids)
+
+        self.handlers = _unique(sub.handler for sub in subscriptions)
+
+    def lookup(self, message: SerialMessage) -> Tuple[MessageHandler, ...]:
+        msg_type = message.msg_type
+        if not self._node_ids:
+            return self._by_type[msg_type]
+        sender = message.sender
+        if sender not in self._node_ids:
+            return self._by_type[msg_type]
+
+        key = (msg_type, sender)
+        handlers = self._by_node.get(key)
+        if handlers is None:
+            handlers = self._by_node[key] = _unique(sub.handler for sub in self._subscriptions
+                                                    if sub.matches(msg_type, sender))
+        return handlers
+
+    def dispatch(self, message: SerialMessage, writer: MessageWriter):
+        for handler in self.lookup(message):
+            handler.on_message(message, writer)
+
+
+class OverflowPolicy(Enum):
+    """What a :class:`MessageStream` does with a message when its queue is full."""
+
+    # Queue it anyway and stop reading from the serial port until the consumer caught up.
+    block = "block"
+    # Drop the oldest queued message.
+    drop_oldest = "drop-oldest"
+    # Drop the new message.
+    drop_newest = "drop-newest"
+    # Replace the queued message of the same node and item by the new one, else drop the oldest.
+    coalesce = "coalesce"
+
+
+# Messages that carry the state of an item, the item id is the first byte of the payload.
+_ITEM_MESSAGES = frozenset((MessageType.reading, MessageType.set_state))
+
+CoroutineHandler = Callable[[SerialMessage, MessageWriter], Awaitable]
+
+
+class MessageStream(MessageHandler):
+    """Bounded queue of messages for an asynchronous consumer.
+
+    The stream is a handler of a connection, so messages are queued while
+    the stream is decoded and the consumer takes them at its own pace with
+    ``async for message in stream`` or :meth:`get`. When the queue holds
+    ``maxsize`` messages, the ``policy`` decides what happens with the next
+    one, dropped messages are counted in ``dropped``.
+
+    With :attr:`OverflowPolicy.block` the stream asks its source to stop
+    reading from the serial port until the queue is down to half its size.
+    Messages decoded from data that was already read are still queued.
+
+    The stream stays open when the connection is lost and reconnected, it
+    ends after :meth:`close`. Closing drops the queued messages.
+    """
+
+    def __init__(self, source, maxsize: int = 256, policy: OverflowPolicy = OverflowPolicy.drop_oldest):
+        if maxsize < 1:
+            raise ValueError("Maxsize must be positive")
+        self._source = source
+        self.maxsize = maxsize
+        self.policy = policy
+        # With coalescing the queue holds [key, message] entries and the latest entry of each key is indexed.
+        self._queue = collections.deque()  # type: Deque
+        self._latest = {}  # type: Dict[Tuple, List]
+        self._waiters = []  # type: List[asyncio.Future]
+        self._holding = False
+        self.closed = False
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        if self.closed:
+            return
+        if self.policy is OverflowPolicy.coalesce:
+            key = self._coalesce_key(message)
+            if len(self._queue) >= self.maxsize:
+                entry = self._latest.get(key)
+                if entry is not None:
+                    # The queued message is outdated, the new one takes its place.
+                    entry[1] = message
+                    self.dropped += 1
+                    return
+                self._forget(self._queue.popleft())
+                self.dropped += 1
+            entry = [key, message]
+            self._latest[key] = entry
+            self._queue.append(entry)
+        else:
+            if len(self._queue) >= self.maxsize:
+                if self.policy is OverflowPolicy.drop_newest:
+                    self.dropped += 1
+                    return
+                if self.policy is OverflowPolicy.drop_oldest:
+                    self._queue.popleft()
+                    self.dropped += 1
+                elif not self._holding:
+                    self._holding = True
+                    self._source._hold_reading(self)
+            self._queue.append(message)
+        self._wake()
+
+    def on_connect(self, writer: MessageWriter):
+        pass
 
-        self._consumer = SerialMessageConsumer()
+    def on_disconnect(self):
+        pass
+
+    @staticmethod
+    def _coalesce_key(message: SerialMessage) -> Tuple:
+        if message.msg_type in _ITEM_MESSAGES:
+            return message.sender, message.msg_type, bytes(message.payload[:1])
+        return message.sender, message.msg_type
+
+    def _forget(self, entry: List):
+        if self._latest.get(entry[0]) is entry:
+            del self._latest[entry[0]]
+
+    def _wake(self):
+        waiters = self._waiters
+        self._waiters = []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def get_nowait(self) -> Optional[SerialMessage]:
+        """Take the next queued message, None if there is none."""
+        if not self._queue:
+            return None
+        message = self._queue.popleft()
+        if self.policy is OverflowPolicy.coalesce:
+            self._forget(message)
+            message = message[1]
+        if self._holding and len(self._queue) <= self.maxsize // 2:
+            self._holding = False
+            self._source._release_reading(self)
+        return message
+
+    async def get(self) -> Optional[SerialMessage]:
+        """Wait for the next message, returns None once the stream is closed."""
+        while not self._queue:
+            if self.closed:
+                return None
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        return self.get_nowait()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> SerialMessage:
+        message = await self.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._source.unsubscribe(self)
+        self._queue.clear()
+        self._latest.clear()
+        if self._holding:
+            self._holding = False
+            self._source._release_reading(self)
+        self._wake()
+
+    async def run(self, handler: CoroutineHandler, writer: MessageWriter):
+        """Await ``handler`` for each message until the stream is closed or the task is cancelled."""
+        try:
+            async for message in self:
+                try:
+                    await handler(message, writer)
+                except Exception:
+                    logger.exception("Handler %s failed on %s", handler, message)
+        finally:
+            self.close()
+
+
+class AioSerialConnection(asyncio.Protocol, MessageWriter):
+    def __init__(self, buffer_size: int = 4096):
+        self._dispatcher = Dispatcher()
+
+        self._consumer = BulkMessageConsumer()
         self.transport = None
-        self._buffer = SerialBuffer()
+        self._buffer = SerialBuffer(buffer_size)
+        self._encoder = MessageEncoder()
+        self._pending = PendingReplies()
+        self._writing_paused = False
+        self._drain_waiters = []  # type: List[asyncio.Future]
+        # Frames written while the transport paused writing.
+        self._held = []  # type: List[bytes]
+        # Writes go through the scheduler if one is set, see :class:`meshnet.serio.scheduler.WriteScheduler`.
+        self.scheduler = None
+        self.trace = None  # type: Optional[FrameTrace]
+        self.metrics = None  # type: Optional[SerialMetrics]
+        self._holders = set()  # type: Set[MessageStream]
+        self._reading_paused = False
 
     def __call__(self):
         return self
 
     def register_handler(self, handler: MessageHandler):
-        self._handlers.append(handler)
+        self._dispatcher.subscribe(handler)
+
+    def subscribe(self, handler: MessageHandler, types: Iterable[MessageType] = None, nodes: Iterable[int] = None):
+        """Register a handler that only gets messages of the given types or from the given nodes."""
+        self._dispatcher.subscribe(handler, types, nodes)
+
+    def unsubscribe(self, handler: MessageHandler):
+        self._dispatcher.unsubscribe(handler)
+
+    def messages(self, types: Iterable[MessageType] = None, nodes: Iterable[int] = None, maxsize: int = 256,
+                 policy: OverflowPolicy = OverflowPolicy.drop_oldest) -> MessageStream:
+        """Subscribe a :class:`MessageStream` to the messages of the given types or from the given nodes."""
+        stream = MessageStream(self, maxsize, policy)
+        self._dispatcher.subscribe(stream, types, nodes)
+        return stream
+
+    def add_coroutine_handler(self, handler: CoroutineHandler, types: Iterable[MessageType] = None,
+                              nodes: Iterable[int] = None, maxsize: int = 256,
+                              policy: OverflowPolicy = OverflowPolicy.drop_oldest) -> asyncio.Task:
+        """Await ``handler(message, writer)`` for the messages in a task of its own.
+
+        The messages are passed over a :meth:`messages` stream, so a slow
+        handler neither delays the decoding nor other handlers. Cancel the
+        returned task to remove the handler.
+        """
+        return asyncio.ensure_future(self.messages(types, nodes, maxsize, policy).run(handler, self))
+
+    def _hold_reading(self, stream: MessageStream):
+        self._holders.add(stream)
+        self._update_reading()
+
+    def _release_reading(self, stream: MessageStream):
+        self._holders.discard(stream)
+        self._update_reading()
+
+    def _update_reading(self):
+        paused = bool(self._holders)
+        transport = self.transport
+        if paused == self._reading_paused or transport is None or transport.is_closing():
+            return
+        self._reading_paused = paused
+        if paused:
+            logger.debug("pause reading for %d streams", len(self._holders))
+            transport.pause_reading()
+        else:
+            logger.debug("resume reading")
+            transport.resume_reading()
+
+    @property
+    def reading_paused(self) -> bool:
+        return self._reading_paused
 
     def connection_made(self, transport):
         self.transport = transport
+        self._buffer.clear()
+        self._writing_paused = False
+        self._reading_paused = False
+        self._update_reading()
         logger.info('serial port opened: %s', transport)
-        for handler in self._handlers:
+        self._write_held()
+        for handler in self._dispatcher.handlers:
             handler.on_connect(self)
 
     def data_received(self, data):
-        logger.debug('data received: %s', to_hex(data))
-        self._buffer.put(data)
-        while self._buffer.available() > 0:
-            packet = self._consumer.consume(self._buffer, max_len=self._buffer.available())
-            if packet is not None:
+        if self.trace is not None:
+            self.trace.record(TraceDirection.received, data)
+        if self.metrics is not None:
+            self.metrics.received(len(data))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('data received: %s', to_hex(data))
+        # Bursts larger than the buffer are processed in buffer sized steps.
+        # As the buffer holds at least one frame each scan frees up space.
+        data = memoryview(data)
+        while data:
+            accepted = self._buffer.put(data)
+            data = data[accepted:]
+            for packet in self._buffer.extract(self._scan):
                 self._on_packet(packet)
 
+    def _scan(self, data, start: int, end: int):
+        return self._consumer.scan(data, start, end, self.metrics)
+
     def _on_packet(self, packet):
-        for handler in self._handlers:
-            handler.on_message(packet, self)
+        if self.metrics is not None:
+            self.metrics.decoded_message(packet.msg_type.name)
+        if self._pending:
+            self._pending.resolve(packet)
+        self._dispatcher.dispatch(packet, self)
 
     def put_packet(self, message: SerialMessage, key: bytes):
-        out = message.framed(key)
-        logger.debug("write data: %s", to_hex(out))
+        self.put_packets((message,), key)
+
+    def put_packets(self, messages: Iterable[SerialMessage], key: bytes):
+        if self.scheduler is None:
+            self.write_frames(self._encoder.encode(messages, key))
+            return
+        try:
+            self.scheduler.put_packets(messages, key)
+        except asyncio.QueueFull:
+            logger.warning("Write queue is full, dropping messages")
+
+    async def send(self, message: SerialMessage, key: bytes):
+        """Send a message, waiting until the scheduler or the transport can take it."""
+        if self.scheduler is not None:
+            await self.scheduler.send(message, key)
+        else:
+            await self.drain()
+            self.put_packet(message, key)
+
+    def write_frames(self, out: bytes):
+        """Write already framed messages to the transport.
+
+        While the transport paused writing, the frames are held back and
+        written once it resumes.
+        """
+        if self._writing_paused:
+            self._held.append(out)
+            return
+        self._write(out)
+
+    def _write_held(self):
+        if self._held:
+            out = b"".join(self._held)
+            self._held = []
+            self._write(out)
+
+    def _write(self, out: bytes):
+        if self.trace is not None:
+            self.trace.record(TraceDirection.sent, out)
+        if self.metrics is not None:
+            self.metrics.sent(len(out))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("write data: %s", to_hex(out))
         self.transport.write(out)
 
+    async def request(self, message: SerialMessage, key: bytes, expect: MessageType, timeout: float = 5.0,
+                      session: int = None) -> SerialMessage:
+        """Send a message and wait for the reply of the receiving node.
+
+        The reply has to be of type ``expect`` and carry the session of the
+        request, or ``session`` if the request changes it, and a valid hash
+        for ``key``. Several requests to the same node can be in flight at
+        the same time. Raises
+        :class:`asyncio.TimeoutError` if no reply arrives in time and
+        :class:`ConnectionResetError` if the connection is lost.
+        """
+        if session is None:
+            session = message.session
+        future = self._pending.add(message.receiver, expect, session, key)
+        try:
+            self.put_packet(message, key)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.discard(future)
+
     def connection_lost(self, exc):
         logger.warning("Serial port closed!")
-        for handler in self._handlers:
+        self._pending.fail_all(ConnectionResetError("Serial port closed"))
+        self._wake_drain_waiters(ConnectionResetError("Serial port closed"))
+        for handler in self._dispatcher.handlers:
             handler.on_disconnect()
 
+    @property
+    def writing_paused(self) -> bool:
+        return self._writing_paused
+
+    async def drain(self):
+        """Wait until the transport accepts data again after :meth:`pause_writing`."""
+        if not self._writing_paused:
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def _wake_drain_waiters(self, exc: Exception = None):
+        waiters = self._drain_waiters
+        self._drain_waiters = []
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
+
     def pause_writing(self):
-        logger.debug('pause writing, buffer=%d', self.transport.get_write_buffer_size())
+        buffer_size = self.transport.get_write_buffer_size()
+        logger.debug('pause writing, buffer=%d', buffer_size)
+        if self.metrics is not None:
+            self.metrics.paused(buffer_size)
+        self._writing_paused = True
 
     def resume_writing(self):
         logger.debug('resume writing, buffer=%d', self.transport.get_write_buffer_size())
+        self._writing_paused = False
+        self._write_held()
+        self._wake_drain_waiters()
 
 
 class LegacyConnection(MessageWriter):
+    """Synchronous connection for users without an event loop.
+
+    Either call :meth:`read` in a loop, which passes the messages to the
+    handlers, or call :meth:`start` to run a reader and a writer thread.
+    The reader thread blocks in bulk reads on the serial port and queues
+    the decoded messages, up to ``max_queued``. Take them with :meth:`get`
+    or by iterating over the connection. Messages that arrive while the
+    queue is full are dropped, so a slow caller cannot stall the serial
+    port. In threaded mode writes are queued as well and written by the
+    writer thread, which joins all frames queued in the meantime into one
+    write.
+    """
+
+    # Marks the end of the message and write queues.
+    _STOP = object()
+
     def __init__(self, device):
         self._device = device
         self._conn = None
-        self._consumer = SerialMessageConsumer()
+        self._consumer = BulkMessageConsumer()
+        self._encoder = MessageEncoder()
+        self._encode_lock = threading.Lock()
+        self.trace = None  # type: Optional[FrameTrace]
+
+        self._dispatcher = Dispatcher()
 
-        self._handlers = []  # type: List[MessageHandler]
+        self._messages = None  # type: Optional[queue.Queue]
+        self._writes = None  # type: Optional[queue.Queue]
+        self._threads = []  # type: List[threading.Thread]
+        self._running = False
+        self.dropped = 0
+
+    @property
+    def metrics(self) -> Optional[SerialMetrics]:
+        return self._consumer.metrics
+
+    @metrics.setter
+    def metrics(self, metrics: Optional[SerialMetrics]):
+        self._consumer.metrics = metrics
 
     def register_handler(self, handler):
-        self._handlers.append(handler)
+        self._dispatcher.subscribe(handler)
+
+    def subscribe(self, handler: MessageHandler, types: Iterable[MessageType] = None, nodes: Iterable[int] = None):
+        """Register a handler that only gets messages of the given types or from the given nodes."""
+        self._dispatcher.subscribe(handler, types, nodes)
+
+    def unsubscribe(self, handler: MessageHandler):
+        self._dispatcher.unsubscribe(handler)
 
     def connect(self):
         logger.info("Connect to %s", self._device)
         self._conn = serial.Serial(self._device, 115200, timeout=1)
-        for handler in self._handlers:
+        for handler in self._dispatcher.handlers:
             handler.on_connect(self)
 
+    def _decode(self, data: bytes) -> List[SerialMessage]:
+        if self.trace is not None:
+            self.trace.record(TraceDirection.received, data)
+        metrics = self._consumer.metrics
+        if metrics is not None:
+            metrics.received(len(data))
+        packets = self._consumer.consume(data)
+        if metrics is not None:
+            for pkt in packets:
+                metrics.decoded_message(pkt.msg_type.name)
+        return packets
+
     def read(self) -> bool:
-        if self._conn.in_waiting == 0:
+        """Read and dispatch the waiting messages in the calling thread.
+
+        Raises :class:`RuntimeError` in threaded mode, the reader thread
+        owns the port and the decoder then.
+        """
+        if self._threads:
+            raise RuntimeError("The reader thread is running, use get() or process() instead")
+        waiting = self._conn.in_waiting
+        if waiting == 0:
+            return False
+        packets = self._decode(self._conn.read(waiting))
+        for pkt in packets:
+            self._dispatcher.dispatch(pkt, self)
+        return len(packets) > 0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self, max_queued: int = 1024, max_writes: int = 256):
+        """Start the reader and writer threads on the connected port."""
+        if self._running:
+            return
+        self._running = True
+        self._messages = queue.Queue(max_queued)
+        self._writes = queue.Queue(max_writes)
+        self._threads = [threading.Thread(target=self._read_loop, name="serial-reader", daemon=True),
+                         threading.Thread(target=self._write_loop, name="serial-writer", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop the threads, frames that are already queued are still written."""
+        if not self._threads:
+            return
+        self._running = False
+        self._writes.put(self._STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _queue_message(self, item):
+        try:
+            self._messages.put_nowait(item)
+        except queue.Full:
+            if not self.dropped:
+                logger.warning("Message queue is full, dropping received messages")
+            self.dropped += 1
+
+    def _read_loop(self):
+        conn = self._conn
+        try:
+            while self._running:
+                # Block for the first byte, then take everything that arrived with it.
+                data = conn.read(max(1, conn.in_waiting))
+                if data:
+                    for pkt in self._decode(data):
+                        self._queue_message(pkt)
+        except (serial.SerialException, OSError) as exc:
+            logger.error("Cannot read from serial port: %s", exc)
+            self._running = False
+            for handler in self._dispatcher.handlers:
+                handler.on_disconnect()
+        finally:
+            # Wake up callers waiting for messages, even if the queue is full.
+            while True:
+                try:
+                    self._messages.put_nowait(self._STOP)
+                    break
+                except queue.Full:
+                    self._messages.get_nowait()
+
+    def _write_loop(self):
+        writes = self._writes
+        while True:
+            frames = [writes.get()]
+            # Join everything that queued up while the last write was running.
+            while frames[-1] is not self._STOP:
+                try:
+                    frames.append(writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = frames[-1] is self._STOP
+            if stop:
+                frames.pop()
+            if frames:
+                try:
+                    self._write(b"".join(frames))
+                except (serial.SerialException, OSError) as exc:
+                    logger.error("Cannot write to serial port: %s", exc)
+            if stop:
+                return
+
+    def get(self, timeout: float = None) -> Optional[SerialMessage]:
+        """Take the next received message in threaded mode.
+
+        Returns None if no message arrived within ``timeout`` seconds or the
+        reader thread stopped. Raises :class:`RuntimeError` if the threads
+        were never started.
+        """
+        if self._messages is None:
+            raise RuntimeError("Threaded mode is not started, call start() first")
+        try:
+            item = self._messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item is self._STOP:
+            # Keep the marker for other waiting callers.
+            self._messages.put(self._STOP)
+            return None
+        return item
+
+    def __iter__(self) -> Iterator[SerialMessage]:
+        """Iterate over the received messages until the reader thread stops."""
+        while True:
+            message = self.get()
+            if message is None:
+                return
+            yield message
+
+    def process(self, timeout: float = None) -> bool:
+        """Pass the next received message to the handlers in the calling thread."""
+        message = self.get(timeout)
+        if message is None:
             return False
-        pkt = self._consumer.consume(self._conn, self._conn.in_waiting)
-        if pkt is not None:
-            for handler in self._handlers:
-                handler.on_message(pkt, self)
-            return True
-        return False
+        self._dispatcher.dispatch(message, self)
+        return True
 
     def put_packet(self, message: SerialMessage, key: bytes):
-        out = message.framed(key)
+        self.put_packets((message,), key)
+
+    def put_packets(self, messages: Iterable[SerialMessage], key: bytes):
+        with self._encode_lock:
+            out = self._encoder.encode(messages, key)
+        self.write_frames(out)
+
+    def write_frames(self, out: bytes):
+        """Write already framed messages to the transport.
+
+        In threaded mode the frames are queued for the writer thread, this
+        blocks while the write queue is full.
+        """
+        if self._threads:
+            self._writes.put(out)
+        else:
+            self._write(out)
+
+    def _write(self, out: bytes):
+        if self.trace is not None:
+            self.trace.record(TraceDirection.sent, out)
+        if self.metrics is not None:
+            self.metrics.sent(len(out))
         self._conn.write(out)
         self._conn.flush()
@@ -2,12 +2,36 @@ import logging
 import struct
 from enum import Enum
 from siphashc import siphash
-from typing import Optional
+from typing import Iterable, List, Optional, Tuple
 
-from meshnet.serio.util import to_hex
+from meshnet.metrics import SerialMetrics
+from meshnet.serio.util import LazyHex, to_hex
 
 logger = logging.getLogger(__name__)
 
+FRAME_PREAMBLE = b"\xaf\xaf\x02"
+FRAME_END = 0x03
+MAX_FRAME_LEN = len(FRAME_PREAMBLE) + 1 + 0xff + 1
+
+SERIO_HEADER_LEN = 3
+PROTO_HEADER_LEN = 5
+HASH_LEN = 8
+
+# sender, receiver, type, length, session, counter
+_HASH_HEADER = struct.Struct(">HHBBHH")
+# sender, receiver, type
+_ADDRESS_HEADER = struct.Struct(">HHB")
+# preamble, frame length, address, type, length, session, counter
+_FRAME_HEADER = struct.Struct(">3sBHBBHH")
+_HASH = struct.Struct(">Q")
+_SESSION_COUNTER = struct.Struct(">HH")
+
+_SESSION_OFFSET = SERIO_HEADER_LEN + 1
+_PAYLOAD_OFFSET = SERIO_HEADER_LEN + PROTO_HEADER_LEN
+
+# Marks fields that are not yet decoded from the raw frame.
+_LAZY = object()
+
 
 class MessageType(Enum):
     booted = 70
@@ -21,16 +45,122 @@ class MessageType(Enum):
     reset = 78
 
 
+# Lookup table from the wire value to the message type, this is a lot
+# cheaper than constructing the enum from the value for every frame.
+_MESSAGE_TYPES = [None] * 256  # type: List[Optional[MessageType]]
+for _msg_type in MessageType:
+    _MESSAGE_TYPES[_msg_type.value] = _msg_type
+del _msg_type
+
+
 class SerialMessage(object):
+    """A message to or from the mesh.
+
+    Messages returned by :meth:`parse` keep a reference to the received
+    frame and only decode the sender, session, counter, payload and hash
+    when they are accessed first.
+    """
+
+    __slots__ = ("_raw", "_sender", "receiver", "msg_type", "_hash_sum", "_session", "_counter", "_payload")
+
     def __init__(self, sender: int, receiver: int, msg_type: MessageType, hash_sum: bytes = None, session: int = 0,
                  counter: int = 0, payload=None):
-        self.sender = sender
+        self._raw = None
+        self._sender = sender
         self.receiver = receiver
         self.msg_type = msg_type
-        self.hash_sum = hash_sum
-        self.session = session
-        self.counter = counter
-        self.payload = payload
+        self._hash_sum = hash_sum
+        self._session = session
+        self._counter = counter
+        self._payload = payload
+
+    @classmethod
+    def _from_frame(cls, raw: bytes, msg_type: MessageType) -> 'SerialMessage':
+        message = cls.__new__(cls)
+        message._raw = raw
+        message._sender = _LAZY
+        message.receiver = 0
+        message.msg_type = msg_type
+        message._hash_sum = _LAZY
+        message._session = _LAZY
+        message._counter = _LAZY
+        message._payload = _LAZY
+        return message
+
+    @property
+    def raw(self) -> Optional[bytes]:
+        """The frame this message was parsed from, if it is unchanged."""
+        return self._raw
+
+    def _decode_session(self):
+        self._session, self._counter = _SESSION_COUNTER.unpack_from(self._raw, _SESSION_OFFSET)
+
+    def _detach(self):
+        # Decode everything that is still lazy before the message diverges
+        # from the received frame.
+        if self._raw is not None:
+            self._sender = self.sender
+            self._hash_sum = self.hash_sum
+            self._payload = self.payload
+            if self._session is _LAZY:
+                self._decode_session()
+            self._raw = None
+
+    @property
+    def sender(self) -> int:
+        if self._sender is _LAZY:
+            raw = self._raw
+            self._sender = (raw[0] << 8) | raw[1]
+        return self._sender
+
+    @sender.setter
+    def sender(self, value: int):
+        self._detach()
+        self._sender = value
+
+    @property
+    def hash_sum(self) -> Optional[bytes]:
+        if self._hash_sum is _LAZY:
+            self._hash_sum = self._raw[-HASH_LEN:]
+        return self._hash_sum
+
+    @hash_sum.setter
+    def hash_sum(self, value: Optional[bytes]):
+        self._detach()
+        self._hash_sum = value
+
+    @property
+    def session(self) -> int:
+        if self._session is _LAZY:
+            self._decode_session()
+        return self._session
+
+    @session.setter
+    def session(self, value: int):
+        self._detach()
+        self._session = value
+
+    @property
+    def counter(self) -> int:
+        if self._counter is _LAZY:
+            self._decode_session()
+        return self._counter
+
+    @counter.setter
+    def counter(self, value: int):
+        self._detach()
+        self._counter = value
+
+    @property
+    def payload(self) -> bytes:
+        if self._payload is _LAZY:
+            self._payload = self._raw[_PAYLOAD_OFFSET:-HASH_LEN]
+        return self._payload
+
+    @payload.setter
+    def payload(self, value: bytes):
+        self._detach()
+        self._payload = value
 
     def __repr__(self):
         hash_sum = "<not_calculated>"
@@ -39,66 +169,125 @@ class SerialMessage(object):
         return "SerialMessage<sender:{}, receiver={}, type={}, session={}, counter={}, hash={}, payload={}>".format(
             self.sender, self.receiver, self.msg_type, self.session, self.counter, hash_sum, self.payload)
 
-    def _compute_hash(self, key):
-        packed_data = struct.pack(">HHB", self.sender, self.receiver,
-                                  self.msg_type.value) + self._proto_header() + self.payload
-        return struct.pack(">Q", siphash(key, packed_data))
-
-    def _proto_header(self):
-        return struct.pack(">BHH", len(self.payload) + 5, self.session, self.counter)
+    def _hash_data(self) -> bytes:
+        raw = self._raw
+        if raw is not None:
+            # Hash the received bytes directly instead of packing them again.
+            return _ADDRESS_HEADER.pack(self.sender, self.receiver,
+                                        self.msg_type.value) + raw[SERIO_HEADER_LEN:-HASH_LEN]
+        return _HASH_HEADER.pack(self.sender, self.receiver, self.msg_type.value,
+                                 len(self.payload) + PROTO_HEADER_LEN, self.session,
+                                 self.counter) + self.payload
+
+    def _compute_hash(self, key) -> bytes:
+        return _HASH.pack(siphash(key, self._hash_data()))
+
+    def has_valid_hash(self, key: bytes) -> bool:
+        """Check the hash without logging failures."""
+        return self.hash_sum == self._compute_hash(key)
+
+    def _wire_address(self) -> int:
+        """The node address written into the serial header."""
+        return self.receiver
+
+    def frame_len(self) -> int:
+        return _FRAME_HEADER.size + len(self.payload) + HASH_LEN + 1
+
+    def frame_into(self, buffer: bytearray, offset: int, key: bytes) -> int:
+        """Write the framed message into ``buffer`` at ``offset``.
+
+        The hash is computed once and stored in ``hash_sum``. Returns the
+        offset behind the written frame.
+        """
+        payload = self.payload
+        length = len(payload) + PROTO_HEADER_LEN
+        self.hash_sum = self._compute_hash(key)
 
-    def _serio_header(self):
-        return struct.pack(">HB", self.receiver, self.msg_type.value)
+        _FRAME_HEADER.pack_into(buffer, offset, FRAME_PREAMBLE, SERIO_HEADER_LEN + length + HASH_LEN,
+                                self._wire_address(), self.msg_type.value, length, self.session, self.counter)
+        pos = offset + _FRAME_HEADER.size
+        end = pos + len(payload)
+        buffer[pos:end] = payload
+        buffer[end:end + HASH_LEN] = self.hash_sum
+        end += HASH_LEN
+        buffer[end] = FRAME_END
+        return end + 1
 
     def verify(self, key):
         ref_hash = self._compute_hash(key)
         result = self.hash_sum == ref_hash
         if not result:
-            logger.warning("Invalid hash: %s != %s", to_hex(ref_hash), to_hex(self.hash_sum))
+            logger.warning("Invalid hash: %s != %s", LazyHex(ref_hash), LazyHex(self.hash_sum))
         return result
 
     def serialize(self, key):
-        self.hash_sum = self._compute_hash(key)
-        return (self._serio_header() +
-                self._proto_header() +
-                self.payload +
-                self._compute_hash(key))
+        return self.framed(key)[len(FRAME_PREAMBLE) + 1:-1]
 
     @staticmethod
-    def parse(data: bytes) -> 'Optional[SerialMessage]':
-        logger.debug("parse packet: %s", to_hex(data))
-        if len(data) < 4:
-            logger.info("Not enough data received for serial packet: %d bytes", len(data))
+    def parse(data: bytes, metrics: SerialMetrics = None) -> 'Optional[SerialMessage]':
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("parse packet: %s", to_hex(data))
+        size = len(data)
+        if size < 4:
+            logger.info("Not enough data received for serial packet: %d bytes", size)
+            if metrics is not None:
+                metrics.rejected("short")
             return None
-        serial_header = data[:3]
-        serial_payload = data[3:]
-
-        sender, msg_type = struct.unpack(">HB", serial_header)
 
-        try:
-            msg_type = MessageType(msg_type)
-        except ValueError:
-            logger.warning("Unknown message type: %d", msg_type)
+        msg_type = _MESSAGE_TYPES[data[2]]
+        if msg_type is None:
+            logger.warning("Unknown message type: %d", data[2])
+            if metrics is not None:
+                metrics.rejected("type")
             return None
 
-        logger.debug("Payload: %s", to_hex(serial_payload, True))
+        if debug:
+            logger.debug("Payload: %s", to_hex(data[SERIO_HEADER_LEN:], True))
 
-        if len(serial_payload) < (5 + 8):
-            logger.info("Packet too small to contain length, session, counter and hash: %d bytes", len(serial_payload))
+        payload_size = size - SERIO_HEADER_LEN
+        if payload_size < (PROTO_HEADER_LEN + HASH_LEN):
+            logger.info("Packet too small to contain length, session, counter and hash: %d bytes", payload_size)
+            if metrics is not None:
+                metrics.rejected("short")
             return None
 
-        length, session, counter = struct.unpack(">BHH", serial_payload[:5])
-        if (len(serial_payload) - 8) != length:
+        if (payload_size - HASH_LEN) != data[SERIO_HEADER_LEN]:
             logger.info("Wrong number of bytes from network")
+            if metrics is not None:
+                metrics.rejected("length")
             return None
 
-        hash_sum = serial_payload[-8:]
-
-        return SerialMessage(sender, 0, msg_type, hash_sum, session, counter, serial_payload[5:-8])
+        return SerialMessage._from_frame(bytes(data), msg_type)
 
     def framed(self, key: bytes) -> bytes:
-        content = self.serialize(key)
-        return b"\xaf\xaf\x02" + struct.pack("B", len(content)) + content + b"\x03"
+        buffer = bytearray(self.frame_len())
+        self.frame_into(buffer, 0, key)
+        return bytes(buffer)
+
+
+class MessageEncoder(object):
+    """Encode outgoing messages into one reusable buffer.
+
+    Several messages can be encoded at once into one contiguous block of
+    frames that can be written to the transport with a single call.
+    """
+
+    def __init__(self, size: int = MAX_FRAME_LEN * 8):
+        self._buffer = bytearray(size)
+
+    def encode(self, messages: Iterable[SerialMessage], key: bytes) -> bytes:
+        messages = list(messages)
+        size = sum(message.frame_len() for message in messages)
+        if size > len(self._buffer):
+            self._buffer = bytearray(size)
+
+        pos = 0
+        for message in messages:
+            pos = message.frame_into(self._buffer, pos, key)
+
+        with memoryview(self._buffer) as view:
+            return bytes(view[:pos])
 
 
 class _MessageState(Enum):
@@ -116,6 +305,7 @@ class SerialMessageConsumer(object):
         self._read_bytes = bytearray()
         self._to_read = 0
         self._actual_read = 0
+        self.metrics = None  # type: Optional[SerialMetrics]
 
     def consume(self, source, max_len: int) -> Optional[SerialMessage]:
         assert max_len >= 1
@@ -134,6 +324,8 @@ class SerialMessageConsumer(object):
             else:
                 self._state = _MessageState.preamble
                 self._read_bytes = self._read_bytes[-1:] + read
+                if self.metrics is not None:
+                    self.metrics.skipped(len(FRAME_PREAMBLE) - 1)
 
         elif self._state == _MessageState.length:
             self._to_read = struct.unpack("B", source.read(1))[0]
@@ -153,9 +345,83 @@ class SerialMessageConsumer(object):
             readed = bytes(self._read_bytes)
             self._read_bytes.clear()
             if source.read(1) == b"\x03":
-                return SerialMessage.parse(readed)
+                return SerialMessage.parse(readed, self.metrics)
+            if self.metrics is not None:
+                self.metrics.rejected("end")
 
         else:
             raise IndexError
 
         return
+
+
+class BulkMessageConsumer(object):
+    """Decode whole chunks of the serial stream at once.
+
+    In contrast to :class:`SerialMessageConsumer` this does not advance byte
+    by byte but searches the chunk for frame preambles and slices out every
+    complete frame in one pass. Incomplete frames at the end of a chunk are
+    kept until the next call. Resynchronisation works the same way: garbage
+    before a preamble is skipped and a frame with a wrong end byte is dropped
+    as a whole.
+    """
+
+    def __init__(self):
+        self._pending = bytearray()
+        self.metrics = None  # type: Optional[SerialMetrics]
+
+    @staticmethod
+    def scan(data, start: int = 0, end: int = None,
+             metrics: SerialMetrics = None) -> Tuple[List[SerialMessage], int]:
+        """Parse all complete frames in ``data[start:end]``.
+
+        Returns the parsed messages and the offset up to which the data was
+        consumed. Everything behind that offset may belong to a frame that is
+        not yet complete and has to be passed in again with more data.
+        Skipped garbage and rejected frames are counted in ``metrics``.
+        """
+        if end is None:
+            end = len(data)
+
+        messages = []  # type: List[SerialMessage]
+        pos = start
+        with memoryview(data) as view:
+            while True:
+                frame_start = data.find(FRAME_PREAMBLE, pos, end)
+                if frame_start < 0:
+                    # The end of the chunk may contain a partial preamble.
+                    consumed = max(pos, end - len(FRAME_PREAMBLE) + 1)
+                    if metrics is not None and consumed > pos:
+                        metrics.skipped(consumed - pos)
+                    return messages, consumed
+                if metrics is not None and frame_start > pos:
+                    metrics.skipped(frame_start - pos)
+
+                length_pos = frame_start + len(FRAME_PREAMBLE)
+                if length_pos >= end:
+                    return messages, frame_start
+
+                end_pos = length_pos + 1 + data[length_pos]
+                if end_pos >= end:
+                    return messages, frame_start
+
+                if data[end_pos] == FRAME_END:
+                    message = SerialMessage.parse(bytes(view[length_pos + 1:end_pos]), metrics)
+                    if message is not None:
+                        messages.append(message)
+                elif metrics is not None:
+                    metrics.rejected("end")
+                pos = end_pos + 1
+
+    def consume(self, data) -> List[SerialMessage]:
+        """Feed a chunk of the stream and return all messages completed by it."""
+        pending = self._pending
+        if not pending and isinstance(data, bytes):
+            messages, consumed = self.scan(data, 0, None, self.metrics)
+            pending.extend(data[consumed:])
+            return messages
+
+        pending.extend(data)
+        messages, consumed = self.scan(pending, 0, None, self.metrics)
+        del pending[:consumed]
+        return messages
@@ -0,0 +1,85 @@
+from typing import Any, Iterable, List, Sequence, Tuple
+
+from meshnet.devices import DeviceType, decode_state, encode_state, state_size
+
+# The firmware message buffer has PAYLOAD_LEN + HASH_LEN + 3 = 43 bytes for
+# the length byte, session, counter, payload and hash.
+MAX_PAYLOAD_LEN = 30
+
+ItemState = Tuple[int, Any]
+
+
+class StatePayload(object):
+    """Pack the states of several items of a node into one payload.
+
+    A payload is a sequence of item ids, each followed by the state of the
+    item in the encoding of its device type. A ``reading`` with a single
+    item, as the firmware sends it today, is a batch of one. ``get_state``
+    payloads only hold the item ids.
+
+    The node firmware only handles the first item of a ``set_state`` or
+    ``get_state`` payload, so items are only packed into one payload with
+    ``batch``, for firmware that reads all of them.
+
+    ``item_types`` are the device types of the items of the node in the
+    order they were configured, which is how the firmware numbers them.
+    """
+
+    def __init__(self, item_types: Sequence[DeviceType], max_len: int = MAX_PAYLOAD_LEN):
+        self.item_types = list(item_types)
+        self.max_len = max_len
+        self._sizes = [1 + state_size(item_type) for item_type in self.item_types]
+
+    def _item_type(self, item_id: int) -> DeviceType:
+        if not 0 <= item_id < len(self.item_types):
+            raise ValueError("Invalid item id: {}".format(item_id))
+        return self.item_types[item_id]
+
+    def _pack(self, entries: Iterable[bytes], batch: bool) -> List[bytes]:
+        if not batch:
+            return [bytes(entry) for entry in entries]
+        payloads = []
+        current = bytearray()
+        for entry in entries:
+            if len(current) + len(entry) > self.max_len:
+                payloads.append(bytes(current))
+                current = bytearray()
+            current += entry
+        if current:
+            payloads.append(bytes(current))
+        return payloads
+
+    def encode(self, states: Iterable[ItemState], batch: bool = False) -> List[bytes]:
+        """Encode states for reading or set_state, with ``batch`` in as few payloads as possible."""
+        return self._pack((bytes((item_id,)) + encode_state(self._item_type(item_id), value)
+                           for item_id, value in states), batch)
+
+    def encode_request(self, item_ids: Iterable[int], batch: bool = False) -> List[bytes]:
+        """Encode item ids as get_state payloads."""
+        item_ids = list(item_ids)
+        for item_id in item_ids:
+            self._item_type(item_id)
+        return self._pack((bytes((item_id,)) for item_id in item_ids), batch)
+
+    def decode(self, payload) -> List[ItemState]:
+        """Decode the states in a reading or set_state payload.
+
+        Raises :class:`ValueError` if an item id is unknown or the payload
+        ends in the middle of a state.
+        """
+        states = []
+        offset = 0
+        end = len(payload)
+        while offset < end:
+            item_id = payload[offset]
+            item_type = self._item_type(item_id)
+            if offset + self._sizes[item_id] > end:
+                raise ValueError("Truncated state of item {}".format(item_id))
+            states.append((item_id, decode_state(item_type, payload, offset + 1)))
+            offset += self._sizes[item_id]
+        return states
+
+    def decode_request(self, payload) -> List[int]:
+        for item_id in payload:
+            self._item_type(item_id)
+        return list(payload)
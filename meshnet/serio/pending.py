@@ -0,0 +1,93 @@
+import asyncio
+import collections
+import logging
+from typing import Deque, Dict, Optional, Tuple
+
+from meshnet.serio.messages import MessageType, SerialMessage
+
+logger = logging.getLogger(__name__)
+
+_Key = Tuple[int, MessageType]
+_Entry = Tuple[asyncio.Future, int, bytes]
+
+
+class PendingReplies(object):
+    """Match incoming messages to requests that wait for a reply.
+
+    Requests are keyed by the node they were sent to and the expected reply
+    type. The protocol does not echo the counter of a request in its reply,
+    so several requests waiting for the same reply type from the same node
+    are answered in the order they were sent. A reply only matches a
+    request if it carries the expected session and its hash is valid for
+    the key of the request, so a corrupt or forged frame cannot answer it.
+    """
+
+    def __init__(self):
+        self._pending = {}  # type: Dict[_Key, Deque[_Entry]]
+        self._keys = {}  # type: Dict[asyncio.Future, _Key]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, node_id: int, expect: MessageType, session: int, key: bytes,
+            loop: asyncio.AbstractEventLoop = None) -> asyncio.Future:
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.setdefault((node_id, expect), collections.deque()).append((future, session, key))
+        self._keys[future] = (node_id, expect)
+        return future
+
+    def resolve(self, message: SerialMessage) -> bool:
+        """Hand the message to the oldest matching request.
+
+        Returns True if a request was waiting for the message.
+        """
+        key = (message.sender, message.msg_type)
+        entries = self._pending.get(key)
+        if not entries:
+            return False
+
+        matched = None  # type: Optional[_Entry]
+        for entry in entries:
+            future, session, hash_key = entry
+            if not future.done() and session == message.session:
+                if not message.has_valid_hash(hash_key):
+                    logger.warning("Ignoring reply with an invalid hash from node %d", message.sender)
+                    return False
+                matched = entry
+                break
+
+        if matched is None:
+            return False
+
+        self._remove(key, matched)
+        matched[0].set_result(message)
+        return True
+
+    def _remove(self, key: _Key, entry: _Entry):
+        entries = self._pending[key]
+        entries.remove(entry)
+        if not entries:
+            del self._pending[key]
+        del self._keys[entry[0]]
+
+    def discard(self, future: asyncio.Future):
+        """Forget a request, e.g. after it timed out."""
+        key = self._keys.get(future)
+        if key is None:
+            return
+        for entry in self._pending[key]:
+            if entry[0] is future:
+                self._remove(key, entry)
+                return
+
+    def fail_all(self, exc: Exception):
+        """Fail all waiting requests with ``exc``, e.g. when the connection is lost."""
+        pending = self._pending
+        self._pending = {}
+        self._keys = {}
+        for entries in pending.values():
+            for future, _, _ in entries:
+                if not future.done():
+                    future.set_exception(exc)
@@ -0,0 +1,201 @@
+import asyncio
+import collections
+import logging
+from typing import Deque, Dict, List, Optional, Tuple
+
+from meshnet.serio.connection import AioSerialConnection, MessageHandler, MessageWriter
+from meshnet.serio.messages import MessageType, SerialMessage
+
+logger = logging.getLogger(__name__)
+
+# 8N1 needs 10 bits on the line for every byte.
+SERIAL_RATE = 115200 // 10
+
+# Lower values are sent first.
+DEFAULT_PRIORITIES = {
+    MessageType.reset: 0,
+    MessageType.set_state: 0,
+    MessageType.get_state: 1,
+    MessageType.ping: 1,
+    MessageType.pong: 1,
+    MessageType.configured: 2,
+    MessageType.configure: 3,
+}
+DEFAULT_PRIORITY = 2
+
+
+class WriteScheduler(MessageHandler, MessageWriter):
+    """Queue outgoing messages and write them paced to the serial link.
+
+    The frames to one node are always sent in the order they were queued,
+    their counters and the session changes of the node depend on it. The
+    priority only decides which node is served next: the nodes are ordered
+    by the priority of their oldest frame and served round robin within one
+    priority, so a bulk transfer to one node does not delay the others.
+    Pending frames are coalesced into writes of up to
+    ``max_write`` bytes. After each write the scheduler waits as long as it
+    takes to transfer the data at ``rate`` bytes per second, so the master
+    can keep up with reading. While the transport paused writing nothing is
+    written and once ``max_queued`` messages are waiting :meth:`send` blocks
+    until there is space again or the scheduler is stopped.
+
+    Set the scheduler as ``connection.scheduler`` to send everything that
+    is put to the connection through it. The scheduler starts writing when
+    the connection is made and stops when it is lost, the queued frames and
+    the waiting senders are kept for the next connection.
+    """
+
+    def __init__(self, connection: AioSerialConnection, rate: float = SERIAL_RATE, max_write: int = 64,
+                 max_queued: int = 1024, priorities: Dict[MessageType, int] = None):
+        self._connection = connection
+        self._rate = rate
+        self._max_write = max_write
+        self._max_queued = max_queued
+        self._priorities = dict(DEFAULT_PRIORITIES if priorities is None else priorities)
+
+        # node id -> priority and frame of each queued message, in the order they were queued.
+        self._frames = {}  # type: Dict[int, Deque[Tuple[int, bytes]]]
+        # priority of the oldest frame -> node ids, the node order is the round robin order.
+        self._queues = {}  # type: Dict[int, collections.OrderedDict]
+        self._queued = 0
+
+        self._data_waiter = None  # type: Optional[asyncio.Future]
+        self._space_waiters = collections.deque()  # type: Deque[asyncio.Future]
+        self._task = None  # type: Optional[asyncio.Task]
+
+        self.bytes_written = 0
+        self.writes = 0
+
+        # Only connection events are of interest, no messages.
+        connection.subscribe(self, types=())
+
+    def __len__(self):
+        return self._queued
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        self._stop_writing()
+        self._cancel_senders()
+
+    def _stop_writing(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _cancel_senders(self):
+        waiters = self._space_waiters
+        self._space_waiters = collections.deque()
+        for waiter in waiters:
+            waiter.cancel()
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        pass
+
+    def on_connect(self, writer: MessageWriter):
+        self.start()
+
+    def on_disconnect(self):
+        self._stop_writing()
+
+    def priority(self, message: SerialMessage) -> int:
+        return self._priorities.get(message.msg_type, DEFAULT_PRIORITY)
+
+    def put_packet(self, message: SerialMessage, key: bytes, priority: int = None):
+        """Queue a message without waiting.
+
+        Raises :class:`asyncio.QueueFull` if the queue is full.
+        """
+        if self._queued >= self._max_queued:
+            raise asyncio.QueueFull()
+
+        if priority is None:
+            priority = self.priority(message)
+
+        node_id = message.receiver
+        frames = self._frames.get(node_id)
+        if frames is None:
+            frames = self._frames[node_id] = collections.deque()
+            self._enqueue_node(node_id, priority)
+        frames.append((priority, message.framed(key)))
+        self._queued += 1
+
+        if self._data_waiter is not None and not self._data_waiter.done():
+            self._data_waiter.set_result(None)
+
+    def _enqueue_node(self, node_id: int, priority: int):
+        nodes = self._queues.get(priority)
+        if nodes is None:
+            nodes = self._queues[priority] = collections.OrderedDict()
+        nodes[node_id] = None
+
+    async def send(self, message: SerialMessage, key: bytes, priority: int = None):
+        """Queue a message, waiting for space in the queue if necessary.
+
+        Raises :class:`asyncio.CancelledError` if the scheduler is stopped
+        while waiting.
+        """
+        while self._queued >= self._max_queued:
+            waiter = asyncio.get_event_loop().create_future()
+            self._space_waiters.append(waiter)
+            await waiter
+        self.put_packet(message, key, priority)
+
+    def _take(self) -> List[bytes]:
+        batch = []  # type: List[bytes]
+        size = 0
+        while self._queues:
+            priority = min(self._queues)
+            nodes = self._queues[priority]
+            node_id = next(iter(nodes))
+            frames = self._frames[node_id]
+            frame = frames[0][1]
+            if batch and size + len(frame) > self._max_write:
+                return batch
+
+            frames.popleft()
+            batch.append(frame)
+            size += len(frame)
+            self._queued -= 1
+
+            del nodes[node_id]
+            if not nodes:
+                del self._queues[priority]
+            if frames:
+                # The node moves to the end of the queue of its next frame's priority.
+                self._enqueue_node(node_id, frames[0][0])
+            else:
+                del self._frames[node_id]
+        return batch
+
+    def _wake_senders(self):
+        free = self._max_queued - self._queued
+        while free > 0 and self._space_waiters:
+            waiter = self._space_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    async def _run(self):
+        try:
+            while True:
+                if not self._queued:
+                    self._data_waiter = asyncio.get_event_loop().create_future()
+                    await self._data_waiter
+                    self._data_waiter = None
+
+                await self._connection.drain()
+
+                out = b"".join(self._take())
+                self._connection.write_frames(out)
+                self.bytes_written += len(out)
+                self.writes += 1
+                self._wake_senders()
+
+                await asyncio.sleep(len(out) / self._rate)
+        except ConnectionError as exc:
+            logger.warning("Stop writing queued messages: %s", exc)
+            self._task = None
+            self._cancel_senders()
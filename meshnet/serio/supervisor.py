@@ -0,0 +1,130 @@
+import asyncio
+import collections
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Deque, Iterable, Optional, Tuple
+
+from meshnet.serio.connection import AioSerialConnection, MessageHandler, MessageWriter
+from meshnet.serio.messages import SerialMessage
+
+logger = logging.getLogger(__name__)
+
+_Queued = Tuple[float, SerialMessage, bytes]
+
+
+class SupervisedConnection(MessageHandler, MessageWriter):
+    """Keep a serial connection up instead of giving up on the first error.
+
+    ``connect`` is called to establish the transport for ``connection``. If
+    this fails or the connection is lost later, it is retried with an
+    exponential backoff between ``min_delay`` and ``max_delay`` seconds.
+
+    Messages put while the link is down are queued and sent once it is back,
+    unless they are older than their time to live. The queue keeps at most
+    ``max_queued`` messages and drops the oldest ones first. The handlers of
+    the connection get ``on_connect`` again after a reconnect, so they can
+    send configuration that is still pending.
+    """
+
+    def __init__(self, connection: AioSerialConnection, connect: Callable[[], Awaitable],
+                 min_delay: float = 0.5, max_delay: float = 30.0, ttl: float = 30.0, max_queued: int = 1024):
+        self.connection = connection
+        self._connect = connect
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._ttl = ttl
+
+        self._queue = collections.deque(maxlen=max_queued)  # type: Deque[_Queued]
+        self._connected = False
+        self._lost = None  # type: Optional[asyncio.Future]
+        self._task = None  # type: Optional[asyncio.Task]
+
+        self.reconnects = 0
+        self.expired = 0
+        self.dropped = 0
+
+        # Only connection events are of interest, no messages.
+        connection.subscribe(self, types=())
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    def __len__(self):
+        return len(self._queue)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        delay = self._min_delay
+        while True:
+            self._lost = asyncio.get_event_loop().create_future()
+            try:
+                await self._connect()
+            except OSError as exc:
+                wait = random.uniform(delay / 2, delay)
+                logger.warning("Cannot connect serial port, retry in %.1fs: %s", wait, exc)
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, self._max_delay)
+                continue
+
+            delay = self._min_delay
+            await self._lost
+            self.reconnects += 1
+
+    def put_packet(self, message: SerialMessage, key: bytes, ttl: float = None):
+        if self._connected:
+            self.connection.put_packet(message, key)
+            return
+
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        deadline = time.monotonic() + (self._ttl if ttl is None else ttl)
+        self._queue.append((deadline, message, key))
+
+    def put_packets(self, messages: Iterable[SerialMessage], key: bytes):
+        if self._connected:
+            self.connection.put_packets(messages, key)
+            return
+        for message in messages:
+            self.put_packet(message, key)
+
+    def _flush(self):
+        now = time.monotonic()
+        batch = []
+        batch_key = None
+        while self._queue:
+            deadline, message, key = self._queue.popleft()
+            if deadline < now:
+                self.expired += 1
+                continue
+            if batch and key != batch_key:
+                self.connection.put_packets(batch, batch_key)
+                batch = []
+            batch.append(message)
+            batch_key = key
+
+        if batch:
+            self.connection.put_packets(batch, batch_key)
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        pass
+
+    def on_connect(self, writer: MessageWriter):
+        self._connected = True
+        if self._queue:
+            logger.info("Send %d queued messages after reconnect", len(self._queue))
+            self._flush()
+
+    def on_disconnect(self):
+        self._connected = False
+        if self._lost is not None and not self._lost.done():
+            self._lost.set_result(None)
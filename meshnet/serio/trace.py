@@ -0,0 +1,45 @@
+import collections
+import time
+from enum import Enum
+from typing import Deque, Iterator, TextIO, Tuple
+
+from meshnet.serio.util import to_hex
+
+
+class TraceDirection(Enum):
+    received = "<"
+    sent = ">"
+
+
+class FrameTrace(object):
+    """Record the raw data on the serial link for later inspection.
+
+    Only the last ``size`` chunks are kept together with their timestamp and
+    direction. Recording just stores a reference to the data, formatting
+    happens when the trace is dumped. A disarmed trace ignores all data.
+    """
+
+    def __init__(self, size: int = 1024, armed: bool = True):
+        self._entries = collections.deque(maxlen=size)  # type: Deque[Tuple[float, TraceDirection, bytes]]
+        self.armed = armed
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Tuple[float, TraceDirection, bytes]]:
+        return iter(list(self._entries))
+
+    def record(self, direction: TraceDirection, data):
+        if self.armed:
+            self._entries.append((time.time(), direction, bytes(data)))
+
+    def clear(self):
+        self._entries.clear()
+
+    def format(self) -> str:
+        return "\n".join("{:.6f} {} {}".format(timestamp, direction.value, to_hex(data))
+                         for timestamp, direction, data in self)
+
+    def dump(self, fp: TextIO):
+        for timestamp, direction, data in self:
+            fp.write("{:.6f} {} {}\n".format(timestamp, direction.value, to_hex(data)))
@@ -4,3 +4,20 @@ def to_hex(hh: bytes, for_c=False):
         return "{" + ", ".join("0x{}".format(x) for x in hex_values) + "}"
     else:
         return " ".join(hex_values)
+
+
+class LazyHex(object):
+    """Format data as hex only when it is converted to a string.
+
+    Meant to be passed as logging argument so the formatting is skipped if
+    the record is not emitted.
+    """
+
+    __slots__ = ("_data", "_for_c")
+
+    def __init__(self, data: bytes, for_c=False):
+        self._data = data
+        self._for_c = for_c
+
+    def __str__(self):
+        return to_hex(self._data, self._for_c)
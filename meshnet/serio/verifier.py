@@ -0,0 +1,88 @@
+import collections
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+from meshnet.metrics import SerialMetrics
+from meshnet.serio.messages import SerialMessage
+
+logger = logging.getLogger(__name__)
+
+
+class MessageVerifier(object):
+    """Verify the hashes of received messages.
+
+    The key is looked up per sending node with a fallback to a default key.
+    Failures are counted per node and only logged once per ``log_interval``
+    seconds together with the number of failures since the last log entry,
+    so a flood of corrupted frames does not flood the log as well.
+    """
+
+    def __init__(self, key: bytes = None, node_keys: Dict[int, bytes] = None, log_interval: float = 10.0):
+        self.key = key
+        self.node_keys = dict(node_keys or {})
+
+        self.verified = 0
+        self.failures = collections.Counter()  # type: Dict[int, int]
+        self.metrics = None  # type: Optional[SerialMetrics]
+
+        self._log_interval = log_interval
+        self._last_log = None  # type: Optional[float]
+        self._unlogged = 0
+
+    def key_for(self, node_id: int) -> Optional[bytes]:
+        return self.node_keys.get(node_id, self.key)
+
+    def set_key(self, node_id: int, key: bytes):
+        self.node_keys[node_id] = key
+
+    def verify(self, message: SerialMessage) -> bool:
+        key = self.node_keys.get(message.sender, self.key)
+        if key is not None and message.has_valid_hash(key):
+            self.verified += 1
+            if self.metrics is not None:
+                self.metrics.verified(message.sender)
+                self.metrics.message(message.msg_type.name, message.sender)
+            return True
+
+        self._failed(message, key is None)
+        return False
+
+    def verify_batch(self, messages: Iterable[SerialMessage]) -> List[SerialMessage]:
+        """Verify several messages at once and return the valid ones."""
+        node_keys = self.node_keys
+        default_key = self.key
+
+        valid = []
+        for message in messages:
+            key = node_keys.get(message.sender, default_key)
+            if key is not None and message.has_valid_hash(key):
+                valid.append(message)
+            else:
+                self._failed(message, key is None)
+
+        self.verified += len(valid)
+        if self.metrics is not None:
+            for message in valid:
+                self.metrics.verified(message.sender)
+                self.metrics.message(message.msg_type.name, message.sender)
+        return valid
+
+    def _failed(self, message: SerialMessage, no_key: bool):
+        self.failures[message.sender] += 1
+        self._unlogged += 1
+        if self.metrics is not None:
+            self.metrics.hash_failure(message.sender)
+
+        now = time.monotonic()
+        if self._last_log is not None and now - self._last_log < self._log_interval:
+            return
+
+        if no_key:
+            logger.warning("No key to verify message from node %d (%d failures since last report)",
+                           message.sender, self._unlogged)
+        else:
+            logger.warning("Invalid hash in message from node %d (%d failures since last report)",
+                           message.sender, self._unlogged)
+        self._last_log = now
+        self._unlogged = 0
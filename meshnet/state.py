@@ -0,0 +1,156 @@
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from meshnet.config import schema
+from meshnet.node import Node, Registry
+from meshnet.serio.connection import MessageWriter
+from meshnet.serio.messages import MessageType, SerialMessage
+
+logger = logging.getLogger(__name__)
+
+Item = Union[int, str]
+
+
+class ItemState(object):
+    __slots__ = ("value", "updated", "confirmed")
+
+    def __init__(self, value: Any, updated: float, confirmed: bool):
+        self.value = value
+        self.updated = updated
+        self.confirmed = confirmed
+
+    def age(self, now: float) -> float:
+        return now - self.updated
+
+
+class StateCache(object):
+    """Last known state of the devices of all nodes.
+
+    The cache is a listener of the node registry and updated from the
+    readings of the nodes. States sent with :meth:`set_state` are kept as
+    unconfirmed until the node reports them. A state is stale when it is
+    older than ``max_age`` seconds, the states of a node are dropped when it
+    boots again.
+
+    :meth:`set_state` does not send states that equal the known state,
+    unless the known state is stale or ``force`` is set. A state that was
+    sent but not confirmed by the node yet only suppresses the same state
+    for ``resend`` seconds, so a lost frame is sent again on the next call.
+    """
+
+    def __init__(self, registry: Registry, key: bytes, max_age: float = 300.0, resend: float = 5.0):
+        self.registry = registry
+        self.key = key
+        self.max_age = max_age
+        self.resend = resend
+        self._states = {}  # type: Dict[int, Dict[int, ItemState]]
+        self.suppressed = 0
+
+        registry.add_listener(self.on_node_message)
+
+    def on_node_message(self, node: Node, message: SerialMessage, writer: MessageWriter):
+        if message.msg_type == MessageType.booted:
+            self._states.pop(node.node_id, None)
+            return
+        if message.msg_type != MessageType.reading:
+            return
+
+        try:
+            states = node.state_payload.decode(message.payload)
+        except ValueError as exc:
+            logger.warning("Invalid reading from node %d: %s", node.node_id, exc)
+            return
+
+        now = time.monotonic()
+        node_states = self._states.setdefault(node.node_id, {})
+        for item_id, value in states:
+            node_states[item_id] = ItemState(value, now, True)
+
+    def _node(self, node_id: int) -> Node:
+        node = self.registry.get(node_id)
+        if node is None:
+            raise KeyError("Unknown node: {}".format(node_id))
+        return node
+
+    @staticmethod
+    def _item_id(node: Node, item: Item) -> int:
+        if isinstance(item, int):
+            return item
+        for item_id, device in enumerate(node.devices):
+            if device[schema.CONFIG_NAME] == item:
+                return item_id
+        raise KeyError("Node {} has no device {}".format(node.node_id, item))
+
+    def item(self, node_id: int, item: Item) -> Optional[ItemState]:
+        """The cached state of an item given by its id or device name."""
+        node_states = self._states.get(node_id)
+        if node_states is None:
+            return None
+        return node_states.get(self._item_id(self._node(node_id), item))
+
+    def get(self, node_id: int, item: Item, default=None):
+        state = self.item(node_id, item)
+        return default if state is None else state.value
+
+    def _is_stale(self, state: Optional[ItemState], now: float = None) -> bool:
+        if state is None:
+            return True
+        return state.age(time.monotonic() if now is None else now) > self.max_age
+
+    def _is_known(self, state: Optional[ItemState], value: Any, now: float) -> bool:
+        if state is None or state.value != value:
+            return False
+        return state.age(now) <= (self.max_age if state.confirmed else self.resend)
+
+    def stale(self, now: float = None) -> List[Tuple[int, int]]:
+        """Node and item ids of all items without a state or with a stale one."""
+        now = time.monotonic() if now is None else now
+        result = []
+        for node in self.registry:
+            node_states = self._states.get(node.node_id, {})
+            for item_id in range(len(node.devices)):
+                if self._is_stale(node_states.get(item_id), now):
+                    result.append((node.node_id, item_id))
+        return result
+
+    def set_state(self, node_id: int, states: Iterable[Tuple[Item, Any]], writer: MessageWriter,
+                  force: bool = False) -> int:
+        """Send states to a node, returns the number of sent frames."""
+        node = self._node(node_id)
+        if node.session is None:
+            raise ValueError("Node {} did not boot yet".format(node_id))
+
+        now = time.monotonic()
+        node_states = self._states.setdefault(node_id, {})
+        changed = []
+        for item, value in states:
+            item_id = self._item_id(node, item)
+            if not force and self._is_known(node_states.get(item_id), value, now):
+                self.suppressed += 1
+                continue
+            changed.append((item_id, value))
+
+        if not changed:
+            return 0
+
+        messages = node.state_messages(changed)
+        writer.put_packets(messages, self.key)
+        for item_id, value in changed:
+            node_states[item_id] = ItemState(value, now, False)
+        return len(messages)
+
+    def refresh(self, writer: MessageWriter, now: float = None) -> int:
+        """Request the state of all stale items of booted nodes, returns the number of sent frames."""
+        by_node = {}  # type: Dict[int, List[int]]
+        for node_id, item_id in self.stale(now):
+            by_node.setdefault(node_id, []).append(item_id)
+
+        messages = []
+        for node_id, item_ids in by_node.items():
+            node = self.registry.get(node_id)
+            if node.session is not None:
+                messages.extend(node.state_messages(item_ids, MessageType.get_state))
+        if messages:
+            writer.put_packets(messages, self.key)
+        return len(messages)
@@ -0,0 +1,335 @@
+import array
+import asyncio
+import logging
+import struct
+import sys
+import time
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from meshnet.config import schema
+from meshnet.node import Node
+from meshnet.serio.connection import MessageWriter
+from meshnet.serio.messages import MessageType, SerialMessage
+
+logger = logging.getLogger(__name__)
+
+SeriesKey = Tuple[int, str]
+
+Aggregate = NamedTuple("Aggregate", [("min", float), ("max", float), ("mean", float), ("count", int)])
+
+# node id, length of the device name, number of samples
+_SPILL_HEADER = struct.Struct("<HHH")
+_MAX_SPILL_NAME = 0xffff
+_MAX_SPILL_SAMPLES = 0xffff
+
+
+class Ring(object):
+    """Fixed size ring buffer of rows stored column wise in arrays.
+
+    Each column is an :class:`array.array` of the given type code, so a row
+    costs only its raw size instead of a Python object per value.
+    """
+
+    def __init__(self, typecodes: str, capacity: int):
+        if capacity < 1:
+            raise ValueError("Capacity must be positive")
+        self.capacity = capacity
+        self._columns = [array.array(typecode, [0]) * capacity for typecode in typecodes]
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, *row) -> Optional[tuple]:
+        """Append a row, returns the oldest row if it had to be dropped for it."""
+        if self._len < self.capacity:
+            pos = (self._start + self._len) % self.capacity
+            evicted = None
+            self._len += 1
+        else:
+            pos = self._start
+            evicted = self.row(0)
+            self._start = (self._start + 1) % self.capacity
+
+        for column, value in zip(self._columns, row):
+            column[pos] = value
+        return evicted
+
+    def popleft(self) -> tuple:
+        """Remove and return the oldest row."""
+        if not self._len:
+            raise IndexError("Pop from an empty ring")
+        row = self.row(0)
+        self._start = (self._start + 1) % self.capacity
+        self._len -= 1
+        return row
+
+    def row(self, index: int) -> tuple:
+        pos = (self._start + index) % self.capacity
+        return tuple(column[pos] for column in self._columns)
+
+    def column(self, column: int, lo: int = 0, hi: int = None) -> array.array:
+        """Copy the rows from ``lo`` to ``hi`` of a column."""
+        hi = self._len if hi is None else min(hi, self._len)
+        if lo >= hi:
+            return self._columns[column][:0]
+        data = self._columns[column]
+        first = (self._start + lo) % self.capacity
+        last = first + hi - lo
+        if last <= self.capacity:
+            return data[first:last]
+        return data[first:] + data[:last - self.capacity]
+
+    def bisect(self, column: int, value: float) -> int:
+        """Index of the first row with at least ``value`` in a sorted column."""
+        data = self._columns[column]
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if data[(self._start + mid) % self.capacity] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class Series(object):
+    """Readings of one device.
+
+    Samples of the last ``max_age`` seconds are kept as they are, up to
+    ``capacity`` of them. Older samples are merged into buckets of
+    ``resolution`` seconds with their minimum, maximum and mean, of which
+    the latest ``history`` are kept. Samples have to be added in the order
+    of their timestamps.
+    """
+
+    def __init__(self, capacity: int = 3600, resolution: float = 60.0, history: int = 1440,
+                 max_age: float = 3600.0):
+        self.resolution = resolution
+        self.max_age = max_age
+        self.total = 0
+        self._samples = Ring("dd", capacity)
+        # start, min, max, sum, count
+        self._buckets = Ring("ddddL", history)
+        self._bucket = None  # type: Optional[List]
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, timestamp: float, value: float):
+        self.total += 1
+        samples = self._samples
+        evicted = samples.append(timestamp, value)
+        if evicted is not None:
+            self._merge(*evicted)
+        oldest = timestamp - self.max_age
+        while samples.row(0)[0] < oldest:
+            self._merge(*samples.popleft())
+
+    def _merge(self, timestamp: float, value: float):
+        start = timestamp - timestamp % self.resolution
+        bucket = self._bucket
+        if bucket is not None and bucket[0] == start:
+            bucket[1] = min(bucket[1], value)
+            bucket[2] = max(bucket[2], value)
+            bucket[3] += value
+            bucket[4] += 1
+            return
+        if bucket is not None:
+            self._buckets.append(*bucket)
+        self._bucket = [start, value, value, value, 1]
+
+    def latest(self) -> Optional[Tuple[float, float]]:
+        if not self._samples:
+            return None
+        return self._samples.row(len(self._samples) - 1)
+
+    def samples(self, start: float = None, end: float = None) -> Tuple[array.array, array.array]:
+        """Timestamps and values of the samples in ``[start, end)`` that are not downsampled yet."""
+        lo = 0 if start is None else self._samples.bisect(0, start)
+        hi = None if end is None else self._samples.bisect(0, end)
+        return self._samples.column(0, lo, hi), self._samples.column(1, lo, hi)
+
+    def last_samples(self, count: int) -> Tuple[array.array, array.array]:
+        lo = max(0, len(self._samples) - count)
+        return self._samples.column(0, lo), self._samples.column(1, lo)
+
+    def _bucket_rows(self, start: float = None, end: float = None) -> Iterator[tuple]:
+        lo = 0 if start is None else self._buckets.bisect(0, start)
+        hi = len(self._buckets) if end is None else self._buckets.bisect(0, end)
+        for index in range(lo, hi):
+            yield self._buckets.row(index)
+        bucket = self._bucket
+        if bucket is not None and (start is None or bucket[0] >= start) and (end is None or bucket[0] < end):
+            yield tuple(bucket)
+
+    def downsampled(self, start: float = None, end: float = None) -> List[Tuple[float, Aggregate]]:
+        """Buckets of downsampled samples that start in ``[start, end)``."""
+        return [(row[0], Aggregate(row[1], row[2], row[3] / row[4], row[4]))
+                for row in self._bucket_rows(start, end)]
+
+    def aggregate(self, start: float = None, end: float = None) -> Optional[Aggregate]:
+        """Minimum, maximum and mean of all samples in ``[start, end)``.
+
+        Downsampled samples count if the start of their bucket is in range.
+        """
+        _, values = self.samples(start, end)
+        count = len(values)
+        if count:
+            low, high, total = min(values), max(values), sum(values)
+        else:
+            low, high, total = float("inf"), float("-inf"), 0.0
+
+        for _, bucket_min, bucket_max, bucket_sum, bucket_count in self._bucket_rows(start, end):
+            low = min(low, bucket_min)
+            high = max(high, bucket_max)
+            total += bucket_sum
+            count += bucket_count
+
+        if not count:
+            return None
+        return Aggregate(low, high, total / count, count)
+
+
+def state_value(state) -> Optional[float]:
+    """Convert a device state to a sample, rgb colors are packed into one number."""
+    if state is None:
+        return None
+    if isinstance(state, tuple):
+        red, green, blue = state
+        return float((red << 16) | (green << 8) | blue)
+    return float(state)
+
+
+class ReadingStore(object):
+    """Keep the readings of all devices by node id and device name.
+
+    Use :meth:`on_node_message` as listener of the node registry to store
+    all accepted readings. With :meth:`start_spill` new samples are
+    appended to a file periodically, see :func:`read_spill` for the format.
+    """
+
+    def __init__(self, capacity: int = 3600, resolution: float = 60.0, history: int = 1440,
+                 max_age: float = 3600.0):
+        self.capacity = capacity
+        self.resolution = resolution
+        self.history = history
+        self.max_age = max_age
+        self._series = {}  # type: Dict[SeriesKey, Series]
+        self._spilled = {}  # type: Dict[SeriesKey, int]
+        self._task = None  # type: Optional[asyncio.Task]
+        self.lost = 0
+
+    def __len__(self):
+        return len(self._series)
+
+    def __iter__(self) -> Iterator[SeriesKey]:
+        return iter(list(self._series))
+
+    def get(self, node_id: int, name: str) -> Optional[Series]:
+        return self._series.get((node_id, name))
+
+    def add(self, node_id: int, name: str, value: float, timestamp: float = None):
+        key = (node_id, name)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = Series(self.capacity, self.resolution, self.history, self.max_age)
+        series.add(time.time() if timestamp is None else timestamp, value)
+
+    def on_node_message(self, node: Node, message: SerialMessage, writer: MessageWriter):
+        if message.msg_type != MessageType.reading:
+            return
+        try:
+            states = node.state_payload.decode(message.payload)
+        except ValueError as exc:
+            logger.warning("Invalid reading from node %d: %s", node.node_id, exc)
+            return
+
+        now = time.time()
+        for item_id, state in states:
+            value = state_value(state)
+            if value is not None:
+                self.add(node.node_id, node.devices[item_id][schema.CONFIG_NAME], value, now)
+
+    def spill(self, fp: BinaryIO) -> int:
+        """Append the samples that were not spilled yet to ``fp``.
+
+        Samples that were already downsampled before they could be spilled
+        are counted in ``lost``, as are the samples of devices with names
+        too long for the file format. If writing fails, the samples that
+        were not written are spilled with the next call. Returns the number
+        of spilled samples.
+        """
+        written = 0
+        for key, series in self._series.items():
+            pending = series.total - self._spilled.get(key, 0)
+            if pending > len(series):
+                self.lost += pending - len(series)
+                pending = len(series)
+            self._spilled[key] = series.total - pending
+            if not pending:
+                continue
+
+            name = key[1].encode()
+            if len(name) > _MAX_SPILL_NAME:
+                logger.error("Cannot spill readings of node %d, the device name is too long", key[0])
+                self.lost += pending
+                self._spilled[key] = series.total
+                continue
+
+            times, values = series.last_samples(pending)
+            for offset in range(0, pending, _MAX_SPILL_SAMPLES):
+                chunk_times = times[offset:offset + _MAX_SPILL_SAMPLES]
+                chunk_values = values[offset:offset + _MAX_SPILL_SAMPLES]
+                if sys.byteorder != "little":
+                    chunk_times.byteswap()
+                    chunk_values.byteswap()
+                # One write per record, so a failed write does not leave half a record behind.
+                fp.write(b"".join((_SPILL_HEADER.pack(key[0], len(name), len(chunk_times)), name,
+                                   chunk_times.tobytes(), chunk_values.tobytes())))
+                self._spilled[key] += len(chunk_times)
+                written += len(chunk_times)
+        return written
+
+    def start_spill(self, filename: str, interval: float = 60.0):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run_spill(filename, interval))
+
+    def stop_spill(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run_spill(self, filename: str, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                with open(filename, "ab") as fp:
+                    written = self.spill(fp)
+            except OSError as exc:
+                logger.error("Cannot spill readings to %s: %s", filename, exc)
+                continue
+            logger.debug("Spilled %d readings to %s", written, filename)
+
+
+def read_spill(fp: BinaryIO) -> Iterator[Tuple[int, str, array.array, array.array]]:
+    """Read the records written by :meth:`ReadingStore.spill`.
+
+    Each record holds the node id, the device name and the timestamps and
+    values of consecutive samples as little endian doubles.
+    """
+    while True:
+        header = fp.read(_SPILL_HEADER.size)
+        if len(header) < _SPILL_HEADER.size:
+            return
+        node_id, name_len, count = _SPILL_HEADER.unpack(header)
+        name = fp.read(name_len).decode()
+        times = array.array("d")
+        values = array.array("d")
+        times.frombytes(fp.read(8 * count))
+        values.frombytes(fp.read(8 * count))
+        if sys.byteorder != "little":
+            times.byteswap()
+            values.byteswap()
+        yield node_id, name, times, values
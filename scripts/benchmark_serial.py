@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+"""Benchmarks for the serial protocol stack.
+
+Every benchmark reports the throughput in frames per second and the p50 and
+p99 latency of a single operation. Run with ``--filter`` to only run the
+benchmarks whose name contains the given string.
+"""
+import argparse
+import time
+from io import BytesIO
+from typing import Callable, List, Sequence
+
+from meshnet.serio.connection import AioSerialConnection, Dispatcher, MessageHandler, MessageWriter, SerialBuffer
+from meshnet.serio.messages import BulkMessageConsumer, MessageEncoder, MessageType, SerialMessage, \
+    SerialMessageConsumer
+
+KEY = b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x0c\r\x0e\x0f'
+
+
+class NodeMessage(SerialMessage):
+    def _wire_address(self):
+        return self.sender
+
+
+class MemoryTransport(object):
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def get_write_buffer_size(self):
+        return 0
+
+
+class CountingHandler(MessageHandler):
+    def __init__(self, reply: bool = False):
+        self.count = 0
+        self.reply = reply
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        self.count += 1
+        if self.reply:
+            writer.put_packet(SerialMessage(0, message.sender, MessageType.pong, None, message.session,
+                                            message.counter + 1, b"\x00\x01"), KEY)
+
+    def on_connect(self, writer: MessageWriter):
+        pass
+
+    def on_disconnect(self):
+        pass
+
+
+def make_messages(count: int) -> List[SerialMessage]:
+    return [NodeMessage(idx % 0xffff, 0, MessageType.reading, None, 0x12, idx % 0xffff, b"\x01\xff\x00\x10")
+            for idx in range(count)]
+
+
+def make_stream(count: int, garbage: bytes = b"") -> bytes:
+    return b"".join(garbage + message.framed(KEY) for message in make_messages(count))
+
+
+def percentile(samples: Sequence[float], fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def report(name: str, frames: int, elapsed: float, samples: List[float], per_sample: int):
+    samples.sort()
+    print("{:<40} {:>12.0f} frames/s  p50 {:>9.2f} us  p99 {:>9.2f} us".format(
+        name, frames / elapsed,
+        percentile(samples, 0.5) / per_sample * 1e6,
+        percentile(samples, 0.99) / per_sample * 1e6))
+
+
+def run(name: str, func: Callable, items: Sequence, per_item: int = 1):
+    """Call ``func`` once for every item, each call handles ``per_item`` frames."""
+    samples = []
+    clock = time.perf_counter
+    start = clock()
+    for item in items:
+        before = clock()
+        func(item)
+        samples.append(clock() - before)
+    elapsed = clock() - start
+    report(name, len(items) * per_item, elapsed, samples, per_item)
+
+
+def bench_message(count: int):
+    messages = make_messages(count)
+    run("message.serialize", lambda msg: msg.serialize(KEY), messages)
+    run("message.framed", lambda msg: msg.framed(KEY), messages)
+
+    encoder = MessageEncoder()
+    batches = [messages[idx:idx + 16] for idx in range(0, count, 16)]
+    run("encoder.encode (16 per batch)", lambda batch: encoder.encode(batch, KEY), batches, 16)
+
+    payloads = [msg.serialize(KEY) for msg in messages]
+    run("message.parse", SerialMessage.parse, payloads)
+
+    parsed = [SerialMessage.parse(payload) for payload in payloads]
+    run("message.verify (received frame)", lambda msg: msg.has_valid_hash(KEY), parsed)
+    run("message.verify (constructed)", lambda msg: msg.has_valid_hash(KEY), messages)
+
+
+def bench_consumer(count: int):
+    streams = (("clean", make_stream(count)),
+               ("garbage", make_stream(count, b"\x00\xaf\x12\xaf\xaf\x03")))
+
+    for name, stream in streams:
+        # Both consumers get the same chunks, so their latencies compare.
+        chunks = [stream[idx:idx + 4096] for idx in range(0, len(stream), 4096)]
+        per_chunk = max(1, count * 4096 // len(stream))
+
+        state_consumer = SerialMessageConsumer()
+
+        def state_machine(data):
+            source = BytesIO(data)
+            while source.tell() < len(data):
+                state_consumer.consume(source, len(data))
+
+        run("state machine consumer, {}, 4k chunks".format(name), state_machine, chunks, per_chunk)
+
+        consumer = BulkMessageConsumer()
+        run("bulk consumer, {}, 4k chunks".format(name), consumer.consume, chunks, per_chunk)
+
+    # Feed a short stream split at every possible position.
+    stream = make_stream(4)
+    splits = [(stream[:idx], stream[idx:]) for idx in range(len(stream))] * max(1, count // (4 * len(stream)))
+
+    def split_consume(parts):
+        consumer = BulkMessageConsumer()
+        for part in parts:
+            consumer.consume(part)
+
+    run("bulk consumer, every split", split_consume, splits, 4)
+
+
+def bench_buffer(count: int):
+    stream = make_stream(count)
+    chunks = [stream[idx:idx + 1024] for idx in range(0, len(stream), 1024)]
+    buff = SerialBuffer()
+
+    def burst(chunk):
+        view = memoryview(chunk)
+        while view:
+            view = view[buff.put(view):]
+            while buff.available():
+                buff.read(64)
+
+    run("serial buffer, 1k bursts", burst, chunks, max(1, count * 1024 // len(stream)))
+
+
+def bench_connection(count: int):
+    stream = make_stream(count)
+    chunks = [stream[idx:idx + 256] for idx in range(0, len(stream), 256)]
+    per_chunk = max(1, count * 256 // len(stream))
+
+    for reply in (False, True):
+        conn = AioSerialConnection()
+        conn.transport = MemoryTransport()
+        handler = CountingHandler(reply)
+        conn.register_handler(handler)
+        run("connection, receive{}".format(" and reply" if reply else ""), conn.data_received, chunks, per_chunk)
+
+
+def bench_dispatch(count: int):
+    messages = make_messages(count)
+    for subscribed in (False, True):
+        dispatcher = Dispatcher()
+        dispatcher.subscribe(CountingHandler())
+        for _ in range(16):
+            if subscribed:
+                dispatcher.subscribe(CountingHandler(), types=[MessageType.pong])
+            else:
+                dispatcher.subscribe(CountingHandler())
+        run("dispatch, 17 handlers{}".format(", 16 subscribed to pong" if subscribed else ""),
+            lambda msg: dispatcher.dispatch(msg, None), messages)
+
+
+BENCHMARKS = {
+    "message": bench_message,
+    "consumer": bench_consumer,
+    "buffer": bench_buffer,
+    "connection": bench_connection,
+    "dispatch": bench_dispatch,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the serial protocol stack")
+    parser.add_argument("--frames", type=int, default=20000, help="Frames per benchmark")
+    parser.add_argument("--filter", default="", help="Only run benchmarks containing this string")
+    args = parser.parse_args()
+
+    for bench_name, bench_func in BENCHMARKS.items():
+        if args.filter in bench_name:
+            bench_func(args.frames)
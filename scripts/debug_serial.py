@@ -1,19 +1,20 @@
 #!/usr/bin/python3
 import asyncio
 import logging
+import random
 import struct
 import subprocess
 import time
 from enum import Enum
 from functools import partial
-from typing import Callable
+from typing import Callable, List
 
 import colorlog
-from serial.aio import create_serial_connection
 
 from meshnet.devices import DeviceType
 from meshnet.serio.connection import MessageHandler, MessageWriter, AioSerialConnection
 from meshnet.serio.messages import MessageType, SerialMessageConsumer, SerialMessage
+from meshnet.serio.verifier import MessageVerifier
 
 logger = logging.getLogger(__name__)
 
@@ -32,13 +33,14 @@ class FakeState(Enum):
 
 
 class FakeDeviceMessage(SerialMessage):
-    def _serio_header(self):
-        return struct.pack(">HB", self.sender, self.msg_type.value)
+    def _wire_address(self):
+        return self.sender
 
 
 class FakeRouter(MessageHandler):
     def __init__(self, key: bytes):
         self.key = key
+        self.verifier = MessageVerifier(key)
         self.consumer = SerialMessageConsumer()
         self.devices = {}
 
@@ -53,8 +55,7 @@ class FakeRouter(MessageHandler):
         sender = message.receiver
         message.receiver = message.sender
         message.sender = sender
-        if not message.verify(KEY):
-            logger.warning("cannot verify checksum")
+        if not self.verifier.verify(message):
             return
 
         if message.receiver not in self.devices:
@@ -73,50 +74,148 @@ class FakeRouter(MessageHandler):
 
 
 class FakeDevice(object):
-    def __init__(self, dev_type):
+    """Model of an item on a node, mirrors the item classes in the firmware."""
+
+    def __init__(self, dev_type: DeviceType, pin: int, name: bytes):
         self.dev_type = dev_type
+        self.pin = pin
+        self.name = name
+        self._changed = False
 
     @classmethod
-    def create(cls, dev_type: DeviceType, config):
-        fake_dev_map = {DeviceType.bin_switch: FakeDevice,
-                        DeviceType.bin_sensor: FakeDevice,
-                        DeviceType.analog_sensor: FakeDevice,
+    def create(cls, dev_type: DeviceType, config: bytes) -> 'FakeDevice':
+        fake_dev_map = {DeviceType.bin_switch: FakeBinSwitch,
+                        DeviceType.bin_sensor: FakeBinSensor,
+                        DeviceType.analog_sensor: FakeAnalogSensor,
                         DeviceType.one_wire: FakeDevice,
-                        DeviceType.rgb_lamp: FakeDevice,
-                        DeviceType.dimmer: FakeDevice,
-                        DeviceType.dht_sensor: FakeDevice, }
+                        DeviceType.rgb_lamp: FakeRGBLamp,
+                        DeviceType.dimmer: FakeDimmer,
+                        DeviceType.dht_sensor: FakeDHTSensor, }
+
+        return fake_dev_map[dev_type].from_config(dev_type, config)
+
+    @classmethod
+    def from_config(cls, dev_type: DeviceType, config: bytes) -> 'FakeDevice':
+        return cls(dev_type, config[0], config[1:])
 
-        return fake_dev_map.get(dev_type)
+    def get_state(self) -> bytes:
+        return b""
 
-    def get_state(self):
+    def set_state(self, state: bytes):
         pass
 
-    def set_state(self, state):
+    def simulate(self):
+        """Let the value of a sensor change."""
         pass
 
-    def has_changed(self):
+    def has_changed(self) -> bool:
+        changed = self._changed
+        self._changed = False
+        return changed
+
+
+class FakeBinSwitch(FakeDevice):
+    def __init__(self, dev_type: DeviceType, pin: int, name: bytes):
+        super().__init__(dev_type, pin, name)
+        self.value = False
+
+    def get_state(self) -> bytes:
+        return b"\xff" if self.value else b"\x00"
+
+    def set_state(self, state: bytes):
+        self.value = state[:1] != b"\x00"
+        self._changed = True
+
+
+class FakeBinSensor(FakeBinSwitch):
+    def set_state(self, state: bytes):
         pass
 
+    def simulate(self):
+        if random.random() < 0.1:
+            self.value = not self.value
+            self._changed = True
+
+
+class FakeAnalogSensor(FakeDevice):
+    def __init__(self, dev_type: DeviceType, pin: int, name: bytes, delta: int = 0):
+        super().__init__(dev_type, pin, name)
+        self.delta = delta
+        self.value = 512
+        self._reported = self.value
+
+    @classmethod
+    def from_config(cls, dev_type: DeviceType, config: bytes) -> 'FakeDevice':
+        pin, delta = struct.unpack(">BH", config[:3])
+        return cls(dev_type, pin, config[3:], delta)
+
+    def get_state(self) -> bytes:
+        self._reported = self.value
+        return struct.pack(">H", self.value)
+
+    def simulate(self):
+        self.value = min(1023, max(0, self.value + random.randint(-8, 8)))
+        if abs(self.value - self._reported) > self.delta:
+            self._changed = True
+
+
+class FakeDimmer(FakeDevice):
+    def __init__(self, dev_type: DeviceType, pin: int, name: bytes):
+        super().__init__(dev_type, pin, name)
+        self.value = 0
+
+    def get_state(self) -> bytes:
+        return struct.pack("B", self.value)
+
+    def set_state(self, state: bytes):
+        self.value = state[0]
+        self._changed = True
+
+
+class FakeRGBLamp(FakeDevice):
+    def __init__(self, dev_type: DeviceType, pins: bytes, name: bytes):
+        super().__init__(dev_type, pins[0], name)
+        self.pins = pins
+        self.value = (0, 0, 0)
+
+    @classmethod
+    def from_config(cls, dev_type: DeviceType, config: bytes) -> 'FakeDevice':
+        return cls(dev_type, config[:3], config[3:])
+
+    def get_state(self) -> bytes:
+        return struct.pack("BBB", *self.value)
+
+    def set_state(self, state: bytes):
+        self.value = struct.unpack("BBB", state[:3])
+        self._changed = True
+
+
+class FakeDHTSensor(FakeDevice):
+    @classmethod
+    def from_config(cls, dev_type: DeviceType, config: bytes) -> 'FakeDevice':
+        # pin, temperature delta, humidity delta, the firmware does not read it yet.
+        return cls(dev_type, config[0], config[5:])
+
 
 class FakeNode(object):
-    def __init__(self, node_id: int):
-        self.state = FakeState.new
+    def __init__(self, node_id: int, items: List[FakeDevice] = None):
+        self.state = FakeState.new if items is None else FakeState.configured
         self.session = 0x12
         self._counter = 0
         self.node_id = node_id
 
-        self.items = []
+        self.items = list(items or [])
 
         self.handlers = {
             MessageType.booted: self._dummy_handler,
             MessageType.configure: self._config_handler,
-            MessageType.configured: self._dummy_handler,
-            MessageType.set_state: self._dummy_handler,
-            MessageType.get_state: self._dummy_handler,
+            MessageType.configured: self._configured_handler,
+            MessageType.set_state: self._set_state_handler,
+            MessageType.get_state: self._get_state_handler,
             MessageType.reading: self._dummy_handler,
-            MessageType.ping: self._dummy_handler,
+            MessageType.ping: self._ping_handler,
             MessageType.pong: self._dummy_handler,
-            MessageType.reset: self._dummy_handler,
+            MessageType.reset: self._reset_handler,
         }
 
     def _dummy_handler(self, message: SerialMessage, write_func: Callable[[SerialMessage], None]):
@@ -134,6 +233,39 @@ class FakeNode(object):
 
         write_func(self.make_packet(MessageType.pong, b'3458'))
 
+    def _configured_handler(self, message: SerialMessage, write_func: Callable[[SerialMessage], None]):
+        self.set_session(struct.unpack(">H", message.payload[:2])[0])
+        self.state = FakeState.configured
+        write_func(self.make_packet(MessageType.pong, b'3458'))
+
+    def _set_state_handler(self, message: SerialMessage, write_func: Callable[[SerialMessage], None]):
+        item_id = message.payload[0]
+        if item_id >= len(self.items):
+            logger.warning("Node %d got an invalid item id: %d", self.node_id, item_id)
+            return
+        self.items[item_id].set_state(message.payload[1:])
+        write_func(self.make_reading(item_id))
+
+    def _get_state_handler(self, message: SerialMessage, write_func: Callable[[SerialMessage], None]):
+        item_id = message.payload[0]
+        if item_id >= len(self.items):
+            logger.warning("Node %d got an invalid item id: %d", self.node_id, item_id)
+            return
+        write_func(self.make_reading(item_id))
+
+    def _ping_handler(self, message: SerialMessage, write_func: Callable[[SerialMessage], None]):
+        new_session, = struct.unpack(">H", message.payload[:2])
+        if new_session != self.session:
+            self.set_session(new_session)
+            write_func(self.make_packet(MessageType.pong, b'3458'))
+
+    def _reset_handler(self, message: SerialMessage, write_func: Callable[[SerialMessage], None]):
+        logger.info("Node %d resets", self.node_id)
+        self.items = []
+        self.state = FakeState.new
+        self.set_session(random.randint(0, 0xffff))
+        self.on_connect(write_func)
+
     def on_message(self, message: SerialMessage, writer: FakeRouter):
         logger.info("Node %d got message %s", self.node_id, message)
 
@@ -143,6 +275,10 @@ class FakeNode(object):
     def on_connect(self, write_func: Callable[[SerialMessage], None]):
         write_func(self.make_packet(MessageType.booted, b'1234'))
 
+    def set_session(self, session: int):
+        self.session = session
+        self._counter = 0
+
     @property
     def counter(self):
         tmp = self._counter
@@ -152,8 +288,22 @@ class FakeNode(object):
     def make_packet(self, msg_type: MessageType, payload: bytes) -> SerialMessage:
         return FakeDeviceMessage(self.node_id, 0, msg_type, counter=self.counter, payload=payload, session=self.session)
 
+    def make_reading(self, item_id: int) -> SerialMessage:
+        return self.make_packet(MessageType.reading, struct.pack("B", item_id) + self.items[item_id].get_state())
+
+    def changed_readings(self) -> List[SerialMessage]:
+        """Simulate all items and return readings for the ones that changed."""
+        readings = []
+        for item_id, item in enumerate(self.items):
+            item.simulate()
+            if item.has_changed():
+                readings.append(self.make_reading(item_id))
+        return readings
+
 
 if __name__ == "__main__":
+    from serial.aio import create_serial_connection
+
     handler = colorlog.StreamHandler()
     handler.setFormatter(colorlog.ColoredFormatter(
         '%(log_color)s%(levelname)s:%(message)s'))
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+"""Replay a capture of a serial link through the host side connection.
+
+Captures are written by setting a ``CaptureWriter`` as trace of a
+connection. Only the received data is replayed. With ``--speed 0`` the
+capture is replayed as fast as possible, which measures the decoding
+throughput on real traffic.
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import time
+
+from meshnet.serio.capture import CaptureReader, ReplayTransport
+from meshnet.serio.connection import AioSerialConnection, MessageHandler, MessageWriter
+from meshnet.serio.messages import SerialMessage
+
+
+class CountingHandler(MessageHandler):
+    def __init__(self):
+        self.types = collections.Counter()
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        self.types[message.msg_type.name] += 1
+
+    def on_connect(self, writer: MessageWriter):
+        pass
+
+    def on_disconnect(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a serial capture")
+    parser.add_argument("capture", help="Capture file")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, 0 for as fast as possible")
+    parser.add_argument("--start", type=float, default=None, help="Start at this timestamp")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.WARNING)
+
+    handler = CountingHandler()
+    connection = AioSerialConnection()
+    connection.register_handler(handler)
+
+    loop = asyncio.get_event_loop()
+    with CaptureReader(args.capture) as reader:
+        transport = ReplayTransport(reader, connection, args.speed or None, args.start)
+        start = time.perf_counter()
+        loop.run_until_complete(transport.replay())
+        wall = time.perf_counter() - start
+    loop.close()
+
+    messages = sum(handler.types.values())
+    print("replayed {} chunks, {} bytes in {:.3f}s: {:.0f} messages/s, {:.0f} bytes/s".format(
+        transport.replayed, transport.replayed_bytes, wall, messages / wall, transport.replayed_bytes / wall))
+    for name, count in sorted(handler.types.items()):
+        print("  {:<12} {}".format(name, count))
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+"""Load test the host service with a simulated mesh.
+
+The nodes from ``debug_serial.py`` run in the same process and are
+connected to the host side through an in memory loopback transport, so no
+PTYs or hardware are needed. Frames from the nodes can be dropped or
+corrupted to simulate a lossy radio. With ``--ramp`` the number of nodes is
+doubled until the host side saturates or the process cannot keep up with
+the schedule of the nodes anymore.
+"""
+import abc
+import argparse
+import asyncio
+import collections
+import heapq
+import logging
+import random
+import time
+from typing import Dict, List, Optional
+
+from debug_serial import FakeDevice, FakeNode, FakeRouter, KEY
+from meshnet.devices import DeviceType
+from meshnet.node import Registry
+from meshnet.serio.connection import AioSerialConnection, MessageHandler, MessageWriter
+from meshnet.serio.messages import SerialMessage
+from meshnet.serio.verifier import MessageVerifier
+
+logger = logging.getLogger(__name__)
+
+
+class LoopbackTransport(asyncio.Transport):
+    """Deliver everything written to the protocol on the other end.
+
+    Every write is handled as one frame that is dropped with the probability
+    ``loss`` or gets one byte flipped with the probability ``corrupt``.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, peer: asyncio.Protocol, loss: float = 0.0,
+                 corrupt: float = 0.0, rng: random.Random = None):
+        super().__init__()
+        self._loop = loop
+        self._peer = peer
+        self._loss = loss
+        self._corrupt = corrupt
+        self._rng = rng or random.Random()
+        self._closing = False
+
+        self.written = 0
+        self.dropped = 0
+        self.corrupted = 0
+
+    def write(self, data):
+        if self._closing:
+            return
+        self.written += 1
+
+        if self._loss and self._rng.random() < self._loss:
+            self.dropped += 1
+            return
+
+        if self._corrupt and self._rng.random() < self._corrupt:
+            data = bytearray(data)
+            data[self._rng.randrange(len(data))] ^= 0xff
+            self.corrupted += 1
+
+        self._loop.call_soon(self._peer.data_received, bytes(data))
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self._loop.call_soon(self._peer.connection_lost, None)
+
+
+class TimedConnection(AioSerialConnection):
+    """Host side connection that measures the time spent decoding."""
+
+    def __init__(self):
+        super().__init__()
+        self.busy = 0.0
+
+    def data_received(self, data):
+        start = time.perf_counter()
+        super().data_received(data)
+        self.busy += time.perf_counter() - start
+
+
+class StatsHandler(MessageHandler):
+    def __init__(self, registry: Registry):
+        self.registry = registry
+        self.verifier = registry.verifier
+        self.received = 0
+        self.accepted = 0
+        self.types = collections.Counter()
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        self.received += 1
+        for valid in self.verifier.verify_batch((message,)):
+            if self.registry.dispatch(valid) is not None:
+                self.accepted += 1
+                self.types[valid.msg_type.name] += 1
+
+    def on_connect(self, writer: MessageWriter):
+        pass
+
+    def on_disconnect(self):
+        pass
+
+
+class Pattern(object, metaclass=abc.ABCMeta):
+    """Decides when a node sends readings and which."""
+
+    def __init__(self, interval: float, rng: random.Random):
+        self.interval = interval
+        self.rng = rng
+
+    def next_delay(self) -> float:
+        return self.interval * self.rng.uniform(0.8, 1.2)
+
+    @abc.abstractmethod
+    def readings(self, node: FakeNode) -> List[SerialMessage]:
+        pass
+
+
+class PeriodicPattern(Pattern):
+    """Report every item in a fixed interval."""
+
+    def readings(self, node: FakeNode) -> List[SerialMessage]:
+        return [node.make_reading(item_id) for item_id in range(len(node.items))]
+
+
+class BurstyPattern(Pattern):
+    """Mostly quiet, then a burst of readings in a row."""
+
+    def __init__(self, interval: float, rng: random.Random, burst: int = 10):
+        super().__init__(interval, rng)
+        self.burst = burst
+
+    def next_delay(self) -> float:
+        return self.rng.expovariate(1.0 / self.interval)
+
+    def readings(self, node: FakeNode) -> List[SerialMessage]:
+        return [node.make_reading(self.rng.randrange(len(node.items))) for _ in range(self.burst)]
+
+
+class ChangePattern(Pattern):
+    """Check the items in a fixed interval and report the changed ones."""
+
+    def readings(self, node: FakeNode) -> List[SerialMessage]:
+        return node.changed_readings()
+
+
+PATTERNS = {"periodic": PeriodicPattern, "bursty": BurstyPattern, "change": ChangePattern}
+
+
+def make_items() -> List[FakeDevice]:
+    return [FakeDevice.create(DeviceType.bin_switch, b"\x03sw"),
+            FakeDevice.create(DeviceType.bin_sensor, b"\x04bs"),
+            FakeDevice.create(DeviceType.analog_sensor, b"\x05\x00\x04as"),
+            FakeDevice.create(DeviceType.rgb_lamp, b"\x06\x07\x08rg")]
+
+
+class MeshSimulator(object):
+    def __init__(self, loop: asyncio.AbstractEventLoop, node_count: int, pattern: Pattern, loss: float = 0.0,
+                 corrupt: float = 0.0, seed: Optional[int] = None):
+        self.loop = loop
+        self.pattern = pattern
+        self.nodes = {}  # type: Dict[int, FakeNode]
+
+        # How late the nodes were scheduled, this grows once the process saturates.
+        self.lag = 0.0
+        self.scheduled = 0
+
+        self.router = FakeRouter(KEY)
+        for node_id in range(1, node_count + 1):
+            node = FakeNode(node_id, make_items())
+            self.nodes[node_id] = node
+            self.router.register_device(node)
+
+        self.fake_conn = AioSerialConnection()
+        self.fake_conn.register_handler(self.router)
+
+        self.registry = Registry(MessageVerifier(KEY, log_interval=60), learn=True)
+        self.stats = StatsHandler(self.registry)
+        self.host_conn = TimedConnection()
+        self.host_conn.register_handler(self.stats)
+
+        self.node_transport = LoopbackTransport(loop, self.host_conn, loss, corrupt, random.Random(seed))
+        self.host_transport = LoopbackTransport(loop, self.fake_conn)
+
+    async def run(self, duration: float):
+        self.host_conn.connection_made(self.host_transport)
+        self.fake_conn.connection_made(self.node_transport)
+
+        now = self.loop.time()
+        schedule = [(now + self.pattern.next_delay(), node_id) for node_id in self.nodes]
+        heapq.heapify(schedule)
+
+        end = now + duration
+        while schedule and schedule[0][0] < end:
+            # Always yield, so the host side gets the frames even if we lag behind.
+            await asyncio.sleep(max(0.0, schedule[0][0] - self.loop.time()))
+
+            now = self.loop.time()
+            while schedule and schedule[0][0] <= now:
+                due, node_id = heapq.heappop(schedule)
+                self.lag += now - due
+                self.scheduled += 1
+                for reading in self.pattern.readings(self.nodes[node_id]):
+                    self.router.write_packet(self.fake_conn, reading)
+                heapq.heappush(schedule, (now + self.pattern.next_delay(), node_id))
+
+        # Let the last frames arrive.
+        await asyncio.sleep(0.01)
+        self.node_transport.close()
+        self.host_transport.close()
+
+    def mean_lag(self) -> float:
+        return self.lag / max(1, self.scheduled)
+
+    def report(self, wall: float):
+        sent = self.node_transport.written
+        print("nodes {:>6}: offered {:>9.0f} frames/s, decoded {:>9.0f} frames/s, accepted {:>9.0f} frames/s, "
+              "host busy {:>5.1%}, lag {:>7.1f} ms (dropped {}, corrupted {}, hash failures {})".format(
+                  len(self.nodes), sent / wall, self.stats.received / wall, self.stats.accepted / wall,
+                  self.host_conn.busy / wall, self.mean_lag() * 1000, self.node_transport.dropped,
+                  self.node_transport.corrupted, sum(self.stats.verifier.failures.values())))
+
+
+def simulate(args, node_count: int) -> bool:
+    """Run one simulation and return if the process was saturated."""
+    loop = asyncio.new_event_loop()
+    rng = random.Random(args.seed)
+    simulator = MeshSimulator(loop, node_count, PATTERNS[args.pattern](args.interval, rng),
+                              args.loss, args.corrupt, args.seed)
+    start = time.perf_counter()
+    loop.run_until_complete(simulator.run(args.duration))
+    wall = time.perf_counter() - start
+    loop.close()
+
+    simulator.report(wall)
+    return simulator.host_conn.busy / wall > 0.9 or simulator.mean_lag() > args.interval / 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a mesh to load test the host service")
+    parser.add_argument("--nodes", type=int, default=100, help="Number of simulated nodes")
+    parser.add_argument("--pattern", choices=sorted(PATTERNS), default="periodic", help="Reading traffic pattern")
+    parser.add_argument("--interval", type=float, default=1.0, help="Mean interval between readings of a node")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to simulate")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability to drop a frame")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="Probability to corrupt a frame")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible runs")
+    parser.add_argument("--ramp", action="store_true", help="Double the nodes until the host saturates")
+    parser.add_argument("--max-nodes", type=int, default=0xffff, help="Upper limit of nodes when ramping")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.WARNING)
+
+    nodes = args.nodes
+    while True:
+        saturated = simulate(args, nodes)
+        if saturated:
+            print("Saturated with {} nodes".format(nodes))
+        if not args.ramp or saturated or nodes >= args.max_nodes:
+            break
+        nodes = min(nodes * 2, args.max_nodes)
@@ -9,6 +9,7 @@ setup(
     author='Jan Losinski',
     author_email='losinskij@gmail.com',
     description='Create a mesh network for IoT',
+    python_requires='>=3.5.4',
     install_requires=[
         "pySerial",
         "pyserial-asyncio",
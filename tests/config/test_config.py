@@ -0,0 +1,119 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import voluptuous as vol
+
+from meshnet.config import cache_version, load_config, schema
+from meshnet.config.watcher import ConfigWatcher
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "contrib", "example-config.yaml")
+
+
+class TestSchema(unittest.TestCase):
+    def test_example(self):
+        config = load_config(EXAMPLE)
+        self.assertEqual(config["nodes"][1]["devices"][1]["name"], "pong")
+        self.assertEqual(len(config["nodes"][2]["devices"]), 1)
+
+    def test_unknown_device_type(self):
+        with self.assertRaises(vol.Invalid) as ctx:
+            schema.validate_config({"nodes": {1: {"name": "n", "devices": [{"type": "nope", "name": "x",
+                                                                             "data": {}}]}}})
+        self.assertIn("unknown device type", str(ctx.exception))
+
+    def test_invalid_device_data(self):
+        with self.assertRaises(vol.Invalid):
+            schema.validate_config({"nodes": {1: {"name": "n", "devices": [{"type": "bin_switch", "name": "x",
+                                                                             "data": {"pin": "ten"}}]}}})
+
+
+class TestConfigCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tmpdir, "config.yaml")
+        self.cache_file = os.path.join(self.tmpdir, "config.cache")
+        shutil.copy(EXAMPLE, self.config_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache(self):
+        config = load_config(self.config_file, self.cache_file)
+        self.assertTrue(os.path.exists(self.cache_file))
+
+        with mock.patch("meshnet.config.yaml.load") as fake_load:
+            self.assertEqual(load_config(self.config_file, self.cache_file), config)
+
+            # Touched but unchanged files are not parsed again.
+            os.utime(self.config_file, ns=(0, 0))
+            self.assertEqual(load_config(self.config_file, self.cache_file), config)
+            fake_load.assert_not_called()
+
+        with open(self.config_file, "a") as fp:
+            fp.write("\n      - type: bin_sensor\n        name: new\n        data:\n          pin: 12\n")
+        self.assertEqual(len(load_config(self.config_file, self.cache_file)["nodes"][2]["devices"]), 2)
+
+    def test_broken_cache(self):
+        with open(self.cache_file, "wb") as fp:
+            fp.write(b"garbage")
+        self.assertIn(1, load_config(self.config_file, self.cache_file)["nodes"])
+
+        # Unpickling a class that does not exist raises ImportError.
+        with open(self.cache_file, "wb") as fp:
+            fp.write(b"cnonexistent_module\nConfig\n.")
+        self.assertIn(1, load_config(self.config_file, self.cache_file)["nodes"])
+
+    def test_stale_cache(self):
+        config = load_config(self.config_file, self.cache_file)
+        with open(self.cache_file, "rb") as fp:
+            cached = pickle.load(fp)
+        self.assertEqual(cached["version"], cache_version())
+
+        cached["version"] = "other schema"
+        cached["config"] = {"nodes": {}}
+        with open(self.cache_file, "wb") as fp:
+            pickle.dump(cached, fp)
+        self.assertEqual(load_config(self.config_file, self.cache_file), config)
+
+
+class TestConfigWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tmpdir, "config.yaml")
+        shutil.copy(EXAMPLE, self.config_file)
+        self.changes = []
+        self.watcher = ConfigWatcher(self.config_file, lambda old, new: self.changes.append((old, new)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, content, mtime):
+        with open(self.config_file, "w") as fp:
+            fp.write(content)
+        os.utime(self.config_file, ns=(mtime, mtime))
+
+    def test_reload(self):
+        self.assertFalse(self.watcher.check())
+
+        with open(EXAMPLE) as fp:
+            content = fp.read()
+        self.write(content, 1)
+        self.assertFalse(self.watcher.check())
+
+        self.write(content.replace("pin: 11", "pin: 12"), 2)
+        self.assertTrue(self.watcher.check())
+        self.assertEqual(len(self.changes), 1)
+        self.assertEqual(self.changes[0][1]["nodes"][1]["devices"][1]["data"]["pin"], 12)
+
+    def test_invalid(self):
+        config = self.watcher.config
+        self.write("nodes: [", 1)
+        self.assertFalse(self.watcher.check())
+        self.write("nodes: {1: {name: x}}", 2)
+        self.assertFalse(self.watcher.check())
+        self.assertIs(self.watcher.config, config)
+        self.assertEqual(self.changes, [])
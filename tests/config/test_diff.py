@@ -0,0 +1,35 @@
+import copy
+import unittest
+
+from meshnet.config.diff import diff_config, diff_devices
+
+CONFIG = {"nodes": {1: {"name": "one", "devices": [{"type": "bin_switch", "name": "a", "data": {"pin": 10}},
+                                                   {"type": "bin_sensor", "name": "b", "data": {"pin": 11}}]},
+                    2: {"name": "two", "devices": [{"type": "bin_switch", "name": "a", "data": {"pin": 10}}]},
+                    3: {"name": "three", "devices": []}}}
+
+
+class TestDiff(unittest.TestCase):
+    def test_unchanged(self):
+        diff = diff_config(CONFIG, copy.deepcopy(CONFIG))
+        self.assertEqual(diff, (set(), set(), {}, set()))
+
+    def test_nodes(self):
+        new = copy.deepcopy(CONFIG)
+        del new["nodes"][3]
+        new["nodes"][4] = {"name": "four", "devices": []}
+        new["nodes"][2]["name"] = "zwei"
+        new["nodes"][1]["devices"][1]["data"]["pin"] = 12
+
+        diff = diff_config(CONFIG, new)
+        self.assertEqual(diff.added, {4})
+        self.assertEqual(diff.removed, {3})
+        self.assertEqual(diff.renamed, {2})
+        self.assertEqual(list(diff.changed), [1])
+        self.assertEqual(diff.changed[1].changed, ["b"])
+
+    def test_devices(self):
+        old = CONFIG["nodes"][1]["devices"]
+        new = [old[1], {"type": "bin_switch", "name": "c", "data": {"pin": 3}}]
+        self.assertEqual(diff_devices(old, new), (["c"], ["a"], [], False))
+        self.assertTrue(diff_devices(old, list(reversed(old))).moved)
@@ -0,0 +1,53 @@
+from typing import List
+
+from meshnet.serio.connection import MessageWriter
+from meshnet.serio.messages import BulkMessageConsumer, SerialMessage
+
+KEY = b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x0c\r\x0e\x0f'
+
+
+def signed(message: SerialMessage, key: bytes = KEY) -> SerialMessage:
+    message.hash_sum = message._compute_hash(key)
+    return message
+
+
+class NodeMessage(SerialMessage):
+    """Message as it arrives from the master, with the sender in the header."""
+
+    def _wire_address(self):
+        return self.sender
+
+
+class ListWriter(MessageWriter):
+    def __init__(self):
+        self.messages = []
+
+    def put_packet(self, packet: SerialMessage, key: bytes):
+        self.messages.append(packet)
+
+
+class FakeTransport(object):
+    """Transport that keeps everything written to it."""
+
+    def __init__(self):
+        self.written = []
+        self.paused = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def is_closing(self):
+        return False
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+    def messages(self) -> List[SerialMessage]:
+        # Frames from the host carry the receiver where the parser expects the sender.
+        return BulkMessageConsumer().consume(b"".join(self.written))
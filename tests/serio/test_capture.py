@@ -0,0 +1,138 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from meshnet.serio.capture import CaptureReader, CaptureWriter, ReplayTransport
+from meshnet.serio.connection import AioSerialConnection, MessageHandler, MessageWriter, OverflowPolicy
+from meshnet.serio.messages import SerialMessage
+from meshnet.serio.trace import TraceDirection
+
+FRAME = b"\xaf\xaf\x02\x14\x00\x00F\t\x00\x0c\x00\x01jsif\x5e\x36\x5b\x9c\xe4\xc7\x03\x38\x03"
+
+
+class CountingHandler(MessageHandler):
+    def __init__(self):
+        self.count = 0
+        self.disconnected = False
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        self.count += 1
+
+    def on_connect(self, writer: MessageWriter):
+        pass
+
+    def on_disconnect(self):
+        self.disconnected = True
+
+
+class TestCapture(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "link.cap")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_capture(self, count):
+        with CaptureWriter(self.filename, index_every=4) as writer:
+            for idx in range(count):
+                writer.record(TraceDirection.received, FRAME[:10], timestamp=idx)
+                writer.record(TraceDirection.received, FRAME[10:], timestamp=idx + 0.1)
+                writer.record(TraceDirection.sent, b"\x01\x02", timestamp=idx + 0.5)
+
+    def test_roundtrip(self):
+        self.write_capture(10)
+        # Appending keeps the file valid.
+        with CaptureWriter(self.filename) as writer:
+            writer.record(TraceDirection.sent, b"end", timestamp=20)
+
+        with CaptureReader(self.filename) as reader:
+            records = [(timestamp, direction, bytes(data)) for timestamp, direction, data in reader]
+            self.assertEqual(len(records), 31)
+            self.assertEqual(records[:3], [(0, TraceDirection.received, FRAME[:10]),
+                                           (0.1, TraceDirection.received, FRAME[10:]),
+                                           (0.5, TraceDirection.sent, b"\x01\x02")])
+            self.assertEqual(records[-1], (20, TraceDirection.sent, b"end"))
+
+            since = [(timestamp, bytes(data)) for timestamp, _, data in reader.since(7.6)]
+            self.assertEqual(since[0], (8, FRAME[:10]))
+            self.assertEqual(len(since), 7)
+            self.assertGreater(reader.offset_at(7.5), reader.offset_at(0))
+
+    def test_truncated(self):
+        self.write_capture(2)
+        with open(self.filename, "ab") as fp:
+            fp.write(b"\x00" * 9 + b"\xff\x00\x00\x00abc")
+        with CaptureReader(self.filename) as reader:
+            self.assertEqual(len(list(reader)), 6)
+
+    def test_not_a_capture(self):
+        with open(self.filename, "wb") as fp:
+            fp.write(b"garbage")
+        with self.assertRaises(ValueError):
+            CaptureReader(self.filename)
+
+    def test_replay(self):
+        self.write_capture(50)
+        handler = CountingHandler()
+        conn = AioSerialConnection()
+        conn.register_handler(handler)
+
+        loop = asyncio.new_event_loop()
+        try:
+            with CaptureReader(self.filename) as reader:
+                transport = ReplayTransport(reader, conn, speed=None, batch=8)
+                loop.run_until_complete(transport.replay())
+                self.assertEqual(handler.count, 50)
+                self.assertEqual(transport.replayed, 100)
+                self.assertTrue(handler.disconnected)
+
+                # Original timing, a thousand times faster.
+                handler.count = 0
+                transport = ReplayTransport(reader, conn, speed=1000, start=45)
+                started = loop.time()
+                loop.run_until_complete(transport.replay())
+                self.assertEqual(handler.count, 5)
+                self.assertGreaterEqual(loop.time() - started, 0.004)
+        finally:
+            loop.close()
+
+    def test_replay_blocking_stream(self):
+        self.write_capture(50)
+        conn = AioSerialConnection()
+        stream = conn.messages(maxsize=4, policy=OverflowPolicy.block)
+        paused = []
+
+        async def consume():
+            count = 0
+            async for _ in stream:
+                paused.append(conn.reading_paused)
+                count += 1
+                await asyncio.sleep(0.001)
+                if count == 50:
+                    return count
+
+        loop = asyncio.new_event_loop()
+        try:
+            with CaptureReader(self.filename) as reader:
+                transport = ReplayTransport(reader, conn, speed=None, batch=8)
+
+                async def run():
+                    return await asyncio.gather(consume(), transport.replay())
+
+                count, _ = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertEqual(count, 50)
+        self.assertEqual(stream.dropped, 0)
+        self.assertIn(True, paused)
+
+    def test_trace(self):
+        conn = AioSerialConnection()
+        with CaptureWriter(self.filename) as writer:
+            conn.trace = writer
+            conn.data_received(FRAME)
+        with CaptureReader(self.filename) as reader:
+            self.assertEqual([bytes(data) for _, _, data in reader], [FRAME])
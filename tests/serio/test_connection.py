@@ -0,0 +1,398 @@
+import asyncio
+import threading
+import unittest
+
+from meshnet.metrics import MetricsRegistry, SerialMetrics
+from meshnet.serio.connection import SerialBuffer, AioSerialConnection, Dispatcher, LegacyConnection, \
+    MessageHandler, MessageWriter, OverflowPolicy
+from meshnet.serio.messages import SerialMessage, MessageType, MAX_FRAME_LEN
+from tests.helpers import KEY, FakeTransport, NodeMessage
+
+
+FRAME = b"\xaf\xaf\x02\x14\x00\x00F\t\x00\x0c\x00\x01jsif\x5e\x36\x5b\x9c\xe4\xc7\x03\x38\x03"
+
+
+class CollectingHandler(MessageHandler):
+    def __init__(self):
+        self.messages = []
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        self.messages.append(message)
+
+    def on_connect(self, writer: MessageWriter):
+        pass
+
+    def on_disconnect(self):
+        pass
+
+
+class TestSerialBuffer(unittest.TestCase):
+    def test_put_read(self):
+        buff = SerialBuffer()
+        self.assertEqual(buff.put(b"abcdef"), 6)
+        buff.put(0x67)
+        self.assertEqual(buff.available(), 7)
+        self.assertEqual(bytes(buff.read(3)), b"abc")
+        self.assertEqual(bytes(buff.read(10)), b"defg")
+        self.assertEqual(buff.available(), 0)
+        self.assertEqual(buff.high_water, 7)
+
+    def test_bounded(self):
+        buff = SerialBuffer(MAX_FRAME_LEN)
+        self.assertEqual(buff.put(bytes(MAX_FRAME_LEN + 10)), MAX_FRAME_LEN)
+        self.assertTrue(buff.is_full())
+        self.assertEqual(buff.put(b"x"), 0)
+
+        buff.consume(5)
+        self.assertEqual(buff.put(b"0123456789"), 5)
+        self.assertEqual(bytes(buff.peek())[-5:], b"01234")
+
+    def test_compaction(self):
+        buff = SerialBuffer(MAX_FRAME_LEN)
+        data = bytes(range(250)) * 4
+        written = 0
+        read = bytearray()
+        while len(read) < len(data):
+            written += buff.put(data[written:written + 100])
+            read.extend(buff.read(60))
+        self.assertEqual(bytes(read), data)
+        self.assertLessEqual(buff.high_water, MAX_FRAME_LEN)
+
+    def test_too_small(self):
+        with self.assertRaises(ValueError):
+            SerialBuffer(MAX_FRAME_LEN - 1)
+
+
+class TestDispatcher(unittest.TestCase):
+    def test_subscriptions(self):
+        dispatcher = Dispatcher()
+        handlers = [CollectingHandler() for _ in range(4)]
+        dispatcher.subscribe(handlers[0])
+        dispatcher.subscribe(handlers[1], types=[MessageType.reading])
+        dispatcher.subscribe(handlers[2], nodes=[2])
+        dispatcher.subscribe(handlers[3], types=[MessageType.pong], nodes=[1, 2])
+        dispatcher.subscribe(handlers[3], types=[MessageType.pong])
+
+        messages = [SerialMessage(sender, 0, msg_type) for sender, msg_type in
+                    ((1, MessageType.reading), (2, MessageType.reading), (1, MessageType.pong),
+                     (2, MessageType.pong), (3, MessageType.pong))]
+        for message in messages:
+            dispatcher.dispatch(message, None)
+
+        self.assertEqual(len(handlers[0].messages), 5)
+        self.assertEqual(handlers[1].messages, messages[:2])
+        self.assertEqual(handlers[2].messages, [messages[1], messages[3]])
+        self.assertEqual(handlers[3].messages, messages[2:])
+        self.assertEqual(dispatcher.handlers, tuple(handlers))
+
+        dispatcher.unsubscribe(handlers[0])
+        dispatcher.unsubscribe(handlers[3])
+        self.assertEqual(dispatcher.lookup(messages[3]), (handlers[2],))
+
+
+class TestAioSerialConnection(unittest.TestCase):
+    def test_burst(self):
+        handler = CollectingHandler()
+        conn = AioSerialConnection(buffer_size=MAX_FRAME_LEN)
+        conn.register_handler(handler)
+
+        conn.data_received(b"garbage" + FRAME * 100)
+        self.assertEqual(len(handler.messages), 100)
+        self.assertLessEqual(conn._buffer.high_water, MAX_FRAME_LEN)
+
+    def test_split(self):
+        handler = CollectingHandler()
+        conn = AioSerialConnection()
+        conn.register_handler(handler)
+
+        for pos in range(len(FRAME)):
+            conn.data_received(FRAME[pos:pos + 1])
+        self.assertEqual(len(handler.messages), 1)
+        self.assertEqual(handler.messages[0].payload, b"jsif")
+
+    def test_metrics(self):
+        conn = AioSerialConnection()
+        conn.metrics = metrics = SerialMetrics(MetricsRegistry())
+        conn.register_handler(CollectingHandler())
+
+        data = b"garbage" + FRAME + FRAME[:-1] + b"\x00" + b"\xaf\xaf\x02\x04\x00\x00\x10\x00\x03"
+        conn.data_received(data)
+        self.assertEqual(metrics.bytes_in.value(), len(data))
+        self.assertEqual(metrics.skipped_bytes.value(), 7)
+        self.assertEqual(metrics.rejected_frames.value(("end",)), 1)
+        self.assertEqual(metrics.rejected_frames.value(("type",)), 1)
+        self.assertEqual(metrics.decoded.value(("booted",)), 1)
+        # Messages are only counted by node after they were verified.
+        self.assertEqual(metrics.messages.total(), 0)
+
+    def test_hold_while_paused(self):
+        conn = AioSerialConnection()
+        conn.connection_made(FakeTransport())
+        message = SerialMessage(0, 1, MessageType.ping, None, 1, 1, b"")
+
+        conn.pause_writing()
+        conn.put_packet(message, KEY)
+        conn.put_packet(message, KEY)
+        self.assertEqual(conn.transport.written, [])
+
+        conn.resume_writing()
+        self.assertEqual(conn.transport.written, [message.framed(KEY) * 2])
+
+
+class TestRequest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.conn = AioSerialConnection()
+        self.conn.transport = FakeTransport()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def reply(self, sender, msg_type, session, counter):
+        self.conn.data_received(NodeMessage(sender, 0, msg_type, None, session, counter, b"12").framed(KEY))
+
+    def test_pipelined(self):
+        async def run():
+            requests = [asyncio.ensure_future(self.conn.request(
+                SerialMessage(0, node, MessageType.ping, None, 5, cnt, b""), KEY, MessageType.pong))
+                for node in (1, 2) for cnt in (1, 2)]
+            await asyncio.sleep(0)
+            self.assertEqual(len(self.conn.transport.written), 4)
+
+            self.reply(2, MessageType.pong, 5, 1)
+            self.reply(1, MessageType.pong, 6, 1)
+            self.reply(1, MessageType.pong, 5, 2)
+            self.reply(2, MessageType.pong, 5, 3)
+            self.reply(1, MessageType.pong, 5, 3)
+            return await asyncio.gather(*requests)
+
+        replies = self.loop.run_until_complete(run())
+        self.assertEqual([(msg.sender, msg.counter) for msg in replies], [(1, 2), (1, 3), (2, 1), (2, 3)])
+        self.assertEqual(len(self.conn._pending), 0)
+
+    def test_invalid_reply(self):
+        async def run():
+            request = asyncio.ensure_future(self.conn.request(
+                SerialMessage(0, 1, MessageType.ping, None, 5, 1, b""), KEY, MessageType.pong))
+            await asyncio.sleep(0)
+            forged = NodeMessage(1, 0, MessageType.pong, None, 5, 1, b"12").framed(b"\xff" * 16)
+            with self.assertLogs("meshnet.serio.pending", "WARNING"):
+                self.conn.data_received(forged)
+            self.assertFalse(request.done())
+            self.reply(1, MessageType.pong, 5, 2)
+            return await request
+
+        self.assertEqual(self.loop.run_until_complete(run()).counter, 2)
+
+    def test_timeout(self):
+        async def run():
+            await self.conn.request(SerialMessage(0, 1, MessageType.ping, None, 5, 1, b""), KEY,
+                                    MessageType.pong, timeout=0.01)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(run())
+        self.assertEqual(len(self.conn._pending), 0)
+
+    def test_connection_lost(self):
+        async def run():
+            request = asyncio.ensure_future(self.conn.request(
+                SerialMessage(0, 1, MessageType.configured, None, 5, 1, b"\x00\x07"), KEY,
+                MessageType.pong, session=7))
+            await asyncio.sleep(0)
+            self.conn.connection_lost(None)
+            await request
+
+        with self.assertRaises(ConnectionResetError):
+            self.loop.run_until_complete(run())
+        self.assertEqual(len(self.conn._pending), 0)
+
+
+class TestMessageStream(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.conn = AioSerialConnection()
+        self.conn.connection_made(FakeTransport())
+
+    def tearDown(self):
+        self.loop.close()
+
+    def send(self, sender, msg_type=MessageType.reading, counter=1, payload=b"12"):
+        self.conn.data_received(NodeMessage(sender, 0, msg_type, None, 5, counter, payload).framed(KEY))
+
+    def drain(self, stream):
+        result = []
+        while len(stream):
+            result.append(stream.get_nowait())
+        return [(msg.sender, msg.counter) for msg in result]
+
+    def test_filter_and_iterate(self):
+        async def run():
+            stream = self.conn.messages(types=[MessageType.reading], nodes=[1])
+            self.send(1, counter=1)
+            self.send(2, counter=2)
+            self.send(1, MessageType.pong, counter=3)
+            self.send(1, counter=4)
+            self.loop.call_soon(stream.close)
+            self.loop.call_soon(self.send, 1)
+            counters = []
+            async for message in stream:
+                counters.append(message.counter)
+            return counters
+
+        self.assertEqual(self.loop.run_until_complete(run()), [1, 4])
+        self.assertEqual(len(self.conn._dispatcher), 0)
+
+    def test_drop(self):
+        oldest = self.conn.messages(maxsize=2, policy=OverflowPolicy.drop_oldest)
+        newest = self.conn.messages(maxsize=2, policy=OverflowPolicy.drop_newest)
+        for counter in range(1, 5):
+            self.send(1, counter=counter)
+        self.assertEqual(self.drain(oldest), [(1, 3), (1, 4)])
+        self.assertEqual(self.drain(newest), [(1, 1), (1, 2)])
+        self.assertEqual((oldest.dropped, newest.dropped), (2, 2))
+
+    def test_coalesce(self):
+        stream = self.conn.messages(maxsize=3, policy=OverflowPolicy.coalesce)
+        # Nothing is merged while there is room.
+        self.send(1, counter=1, payload=b"\x00\x00")
+        self.send(1, counter=2, payload=b"\x00\xff")
+        self.assertEqual(self.drain(stream), [(1, 1), (1, 2)])
+
+        # Readings of two items of one node are kept apart.
+        self.send(1, counter=3, payload=b"\x00\x00")
+        self.send(1, counter=4, payload=b"\x01\x00")
+        self.send(2, counter=5, payload=b"\x00\x00")
+        self.send(1, counter=6, payload=b"\x01\xff")
+        self.send(1, MessageType.pong, counter=7)
+        self.assertEqual(self.drain(stream), [(1, 6), (2, 5), (1, 7)])
+        self.assertEqual(stream.dropped, 2)
+
+    def test_block(self):
+        stream = self.conn.messages(maxsize=4, policy=OverflowPolicy.block)
+        other = self.conn.messages(maxsize=1)
+        for counter in range(6):
+            self.send(1, counter=counter)
+        self.assertTrue(self.conn.transport.paused)
+        self.assertEqual((len(stream), stream.dropped), (6, 0))
+
+        for _ in range(3):
+            stream.get_nowait()
+        self.assertTrue(self.conn.reading_paused)
+        stream.get_nowait()
+        self.assertFalse(self.conn.transport.paused)
+
+        for _ in range(3):
+            self.send(1)
+        self.assertTrue(self.conn.transport.paused)
+        stream.close()
+        self.assertFalse(self.conn.transport.paused)
+        self.assertEqual(other.dropped, 8)
+
+    def test_coroutine_handler(self):
+        received = []
+
+        async def slow(message, writer):
+            await asyncio.sleep(0.01)
+            if message.counter == 2:
+                raise ValueError("failed")
+            received.append(message.counter)
+
+        async def run():
+            task = self.conn.add_coroutine_handler(slow, types=[MessageType.reading], maxsize=8)
+            handler = CollectingHandler()
+            self.conn.register_handler(handler)
+            for counter in range(1, 5):
+                self.send(1, counter=counter)
+            self.assertEqual(len(handler.messages), 4)
+            self.assertEqual(received, [])
+
+            while len(received) < 3:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with self.assertLogs("meshnet.serio.connection", "ERROR"):
+            self.loop.run_until_complete(run())
+        self.assertEqual(received, [1, 3, 4])
+        self.assertEqual(len(self.conn._dispatcher), 1)
+
+
+class FakeSerial(object):
+    """Blocking serial port that returns what was fed into it."""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._cond = threading.Condition()
+        self.written = []
+
+    @property
+    def in_waiting(self):
+        return len(self._data)
+
+    def feed(self, data):
+        with self._cond:
+            self._data.extend(data)
+            self._cond.notify_all()
+
+    def read(self, size):
+        with self._cond:
+            self._cond.wait_for(lambda: self._data, timeout=0.05)
+            data = bytes(self._data[:size])
+            del self._data[:size]
+            return data
+
+    def write(self, data):
+        self.written.append(data)
+
+    def flush(self):
+        pass
+
+
+class TestLegacyConnection(unittest.TestCase):
+    def setUp(self):
+        self.port = FakeSerial()
+        self.conn = LegacyConnection("fake")
+        self.conn._conn = self.port
+
+    def test_read(self):
+        handler = CollectingHandler()
+        self.conn.register_handler(handler)
+        self.assertFalse(self.conn.read())
+        self.port.feed(FRAME * 2)
+        self.assertTrue(self.conn.read())
+        self.assertEqual(len(handler.messages), 2)
+
+    def test_not_started(self):
+        with self.assertRaises(RuntimeError):
+            self.conn.get(0)
+        with self.assertRaises(RuntimeError):
+            self.conn.process(0)
+        with self.assertRaises(RuntimeError):
+            list(self.conn)
+
+    def test_threaded(self):
+        self.port.feed(FRAME * 3)
+        self.conn.start(max_queued=2)
+        try:
+            self.assertEqual(self.conn.get(1).payload, b"jsif")
+            self.assertIsNotNone(self.conn.get(1))
+            self.assertIsNone(self.conn.get(0.01))
+            self.assertEqual(self.conn.dropped, 1)
+
+            handler = CollectingHandler()
+            self.conn.register_handler(handler)
+            self.port.feed(FRAME)
+            self.assertTrue(self.conn.process(1))
+            self.assertEqual(len(handler.messages), 1)
+
+            with self.assertRaises(RuntimeError):
+                self.conn.read()
+
+            message = SerialMessage(0, 1, MessageType.ping, None, 1, 1, b"\x00\x01")
+            self.conn.put_packets([message, message], KEY)
+        finally:
+            self.conn.stop()
+
+        self.assertEqual(b"".join(self.port.written), message.framed(KEY) * 2)
+        self.assertEqual(list(self.conn), [])
@@ -3,7 +3,8 @@ from unittest import mock
 
 from io import BytesIO
 
-from meshnet.serio.messages import SerialMessage, MessageType, SerialMessageConsumer
+from meshnet.serio.messages import SerialMessage, MessageType, SerialMessageConsumer, BulkMessageConsumer, \
+    MessageEncoder
 
 KEY = b'\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x0c\r\x0e\x0f'
 
@@ -19,6 +20,19 @@ class TestSerialMessage(unittest.TestCase):
         self.assertEqual(b"\xaf\xaf\x02\x14\x00\x01F\t\x00\x0c\x00\x01jsif\xae\x9a\xc1S\x88\x9d\xbc\xa4\x03",
                          message.framed(KEY))
 
+    def test_serialize_sets_hash(self):
+        message = SerialMessage(0, 1, MessageType.booted, None, 12, 1, b"jsif")
+        message.serialize(KEY)
+        self.assertEqual(message.hash_sum, b"\xae\x9a\xc1S\x88\x9d\xbc\xa4")
+
+    def test_encoder_batch(self):
+        messages = [SerialMessage(0, 1, MessageType.booted, None, 12, 1, b"jsif"),
+                    SerialMessage(0, 2, MessageType.ping, None, 12, 2, b""),
+                    SerialMessage(0, 1, MessageType.booted, None, 12, 1, b"jsif")]
+        encoder = MessageEncoder(size=10)
+        self.assertEqual(encoder.encode(messages, KEY), b"".join(message.framed(KEY) for message in messages))
+        self.assertEqual(encoder.encode(messages[:1], KEY), messages[0].framed(KEY))
+
     def test_repr(self):
         message = SerialMessage(0, 1, MessageType.booted, None, 12, 1, b"jsif")
         self.assertEqual(repr(message),
@@ -46,6 +60,29 @@ class TestSerialMessage(unittest.TestCase):
         self.assertEqual(message.session, 12)
         self.assertEqual(message.msg_type, MessageType.booted)
 
+    def test_parse_lazy(self):
+        dummy = b"\x00\x05F\t\x00\x0c\x00\x01jsif\x5e\x36\x5b\x9c\xe4\xc7\x03\x38"
+        message = SerialMessage.parse(dummy)
+        self.assertFalse(hasattr(message, "__dict__"))
+        self.assertIs(message.raw, dummy)
+        self.assertEqual(message.sender, 5)
+        self.assertEqual(message.hash_sum, b"\x5e\x36\x5b\x9c\xe4\xc7\x03\x38")
+
+        message.counter = 2
+        self.assertIsNone(message.raw)
+        self.assertEqual(message.counter, 2)
+        self.assertEqual(message.session, 12)
+        self.assertEqual(message.payload, b"jsif")
+        self.assertEqual(message.sender, 5)
+
+        for attribute, value in (("sender", 6), ("hash_sum", b"\x00" * 8)):
+            message = SerialMessage.parse(dummy)
+            setattr(message, attribute, value)
+            self.assertIsNone(message.raw)
+            self.assertEqual(getattr(message, attribute), value)
+            self.assertEqual(message.payload, b"jsif")
+        self.assertEqual(message._hash_data()[:2], b"\x00\x05")
+
     def test_parse_short(self):
         with mock.patch("meshnet.serio.messages.logger") as fake_logger:
             message = SerialMessage.parse(b"123")
@@ -105,3 +142,61 @@ class TestSerialMessageConsumer(unittest.TestCase):
         self.assertIsNotNone(msg)
         self.assertEqual(msg.payload, b"jsif")
         self.assertTrue(msg.verify(KEY))
+
+
+class TestBulkMessageConsumer(unittest.TestCase):
+    FRAME = b"\xaf\xaf\x02\x14\x00\x00F\t\x00\x0c\x00\x01jsif\x5e\x36\x5b\x9c\xe4\xc7\x03\x38\x03"
+
+    def test_easy_parsing(self):
+        consumer = BulkMessageConsumer()
+        messages = consumer.consume(self.FRAME)
+
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].payload, b"jsif")
+        self.assertTrue(messages[0].verify(KEY))
+
+    def test_with_rubbish(self):
+        data = b"\xaffksdfj\03\xab\xaf\xaf" + self.FRAME
+
+        consumer = BulkMessageConsumer()
+        messages = consumer.consume(data)
+
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].payload, b"jsif")
+        self.assertTrue(messages[0].verify(KEY))
+
+    def test_multiple_frames(self):
+        consumer = BulkMessageConsumer()
+        messages = consumer.consume(self.FRAME + b"\x00\x01" + self.FRAME + self.FRAME)
+
+        self.assertEqual(len(messages), 3)
+
+    def test_split_at_every_boundary(self):
+        data = b"rubbish\xaf" + self.FRAME + self.FRAME
+        for split in range(len(data) + 1):
+            consumer = BulkMessageConsumer()
+            messages = consumer.consume(data[:split]) + consumer.consume(memoryview(data[split:]))
+            self.assertEqual(len(messages), 2, "split at {}".format(split))
+
+    def test_byte_by_byte(self):
+        consumer = BulkMessageConsumer()
+        messages = []
+        for idx in range(len(self.FRAME)):
+            messages.extend(consumer.consume(self.FRAME[idx:idx + 1]))
+
+        self.assertEqual(len(messages), 1)
+
+    def test_wrong_end_byte(self):
+        broken = self.FRAME[:-1] + b"\x04"
+
+        consumer = BulkMessageConsumer()
+        messages = consumer.consume(broken + self.FRAME)
+
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(consumer.scan(broken), ([], len(broken)))
+
+    def test_scan_incomplete(self):
+        messages, consumed = BulkMessageConsumer.scan(b"abc" + self.FRAME[:10])
+
+        self.assertEqual(messages, [])
+        self.assertEqual(consumed, 3)
@@ -0,0 +1,46 @@
+import unittest
+
+from meshnet.devices import DeviceType
+from meshnet.serio.payload import StatePayload
+
+TYPES = [DeviceType.bin_switch, DeviceType.analog_sensor, DeviceType.rgb_lamp, DeviceType.dimmer,
+         DeviceType.dht_sensor]
+
+
+class TestStatePayload(unittest.TestCase):
+    def setUp(self):
+        self.codec = StatePayload(TYPES)
+
+    def test_roundtrip(self):
+        states = [(0, True), (1, 0x1234), (2, (1, 2, 3)), (3, 0x80), (4, None)]
+        payloads = self.codec.encode(states, batch=True)
+        self.assertEqual(payloads, [b"\x00\xff\x01\x12\x34\x02\x01\x02\x03\x03\x80\x04"])
+        self.assertEqual(self.codec.decode(payloads[0]), states)
+
+        # The firmware only reads the first item of set_state.
+        self.assertEqual(self.codec.encode(states[:2]), [b"\x00\xff", b"\x01\x12\x34"])
+
+    def test_single_reading(self):
+        # What the firmware sends today.
+        self.assertEqual(self.codec.decode(b"\x00\x00"), [(0, False)])
+        self.assertEqual(self.codec.decode(b"\x01\x00\x10"), [(1, 0x10)])
+
+    def test_split(self):
+        codec = StatePayload([DeviceType.rgb_lamp] * 16)
+        payloads = codec.encode(((item_id, (item_id, 0, 0)) for item_id in range(16)), batch=True)
+        self.assertEqual([len(payload) for payload in payloads], [28, 28, 8])
+        self.assertEqual([state for payload in payloads for state in codec.decode(payload)],
+                         [(item_id, (item_id, 0, 0)) for item_id in range(16)])
+
+    def test_request(self):
+        self.assertEqual(self.codec.encode_request(iter([0, 3])), [b"\x00", b"\x03"])
+        self.assertEqual(self.codec.encode_request(iter([0, 3]), batch=True), [b"\x00\x03"])
+        self.assertEqual(self.codec.decode_request(b"\x00\x03"), [0, 3])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.codec.decode(b"\x05\x00")
+        with self.assertRaises(ValueError):
+            self.codec.decode(b"\x00\xff\x01\x00")
+        with self.assertRaises(ValueError):
+            self.codec.encode([(7, True)])
@@ -0,0 +1,142 @@
+import asyncio
+import unittest
+
+from meshnet.serio.connection import AioSerialConnection
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.scheduler import WriteScheduler
+from tests.helpers import KEY, FakeTransport
+
+
+
+def message(receiver, msg_type, counter=1):
+    return SerialMessage(0, receiver, msg_type, None, 1, counter, b"")
+
+
+def written_messages(transport):
+    return [(msg.sender, msg.msg_type) for msg in transport.messages()]
+
+
+class TestWriteScheduler(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.conn = AioSerialConnection()
+        self.conn.transport = FakeTransport()
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_scheduler(self, scheduler, delay=0.05):
+        async def run():
+            scheduler.start()
+            await asyncio.sleep(delay)
+            scheduler.stop()
+
+        self.loop.run_until_complete(run())
+
+    def test_priority_and_fairness(self):
+        scheduler = WriteScheduler(self.conn, rate=1e6, max_write=1)
+        for cnt in range(3):
+            scheduler.put_packet(message(1, MessageType.configure, cnt), KEY)
+        scheduler.put_packet(message(2, MessageType.configure), KEY)
+        scheduler.put_packet(message(3, MessageType.set_state), KEY)
+
+        self.run_scheduler(scheduler)
+        self.assertEqual(written_messages(self.conn.transport),
+                         [(3, MessageType.set_state), (1, MessageType.configure), (2, MessageType.configure),
+                          (1, MessageType.configure), (1, MessageType.configure)])
+        self.assertEqual(scheduler.writes, 5)
+
+    def test_node_order(self):
+        scheduler = WriteScheduler(self.conn, rate=1e6, max_write=1)
+        for cnt, msg_type in enumerate((MessageType.configure, MessageType.configured, MessageType.set_state)):
+            scheduler.put_packet(message(1, msg_type, cnt), KEY)
+        scheduler.put_packet(message(2, MessageType.ping), KEY)
+        scheduler.put_packet(message(3, MessageType.configure), KEY)
+
+        self.run_scheduler(scheduler)
+        self.assertEqual(written_messages(self.conn.transport),
+                         [(2, MessageType.ping), (1, MessageType.configure), (1, MessageType.configured),
+                          (1, MessageType.set_state), (3, MessageType.configure)])
+        counters = [msg.counter for msg in self.conn.transport.messages() if msg.sender == 1]
+        self.assertEqual(counters, [0, 1, 2])
+
+    def test_stop_cancels_senders(self):
+        scheduler = WriteScheduler(self.conn, rate=1e6, max_queued=1)
+
+        async def run():
+            scheduler.put_packet(message(1, MessageType.ping), KEY)
+            sender = asyncio.ensure_future(scheduler.send(message(1, MessageType.ping, 2), KEY))
+            await asyncio.sleep(0.01)
+            scheduler.stop()
+            await sender
+
+        with self.assertRaises(asyncio.CancelledError):
+            self.loop.run_until_complete(run())
+
+    def test_coalescing(self):
+        scheduler = WriteScheduler(self.conn, rate=1e6, max_write=100)
+        for node in range(10):
+            scheduler.put_packet(message(node, MessageType.ping), KEY)
+
+        self.run_scheduler(scheduler)
+        self.assertEqual(len(written_messages(self.conn.transport)), 10)
+        self.assertEqual([len(data) for data in self.conn.transport.written], [84, 84, 42])
+
+    def test_pacing(self):
+        scheduler = WriteScheduler(self.conn, rate=21 * 10, max_write=21)
+        for node in range(10):
+            scheduler.put_packet(message(node, MessageType.ping), KEY)
+
+        self.run_scheduler(scheduler, delay=0.25)
+        self.assertLess(len(self.conn.transport.written), 5)
+
+    def test_pause_blocks_senders(self):
+        scheduler = WriteScheduler(self.conn, rate=1e6, max_queued=2)
+
+        async def run():
+            self.conn.pause_writing()
+            scheduler.start()
+            sender = asyncio.ensure_future(asyncio.gather(*[scheduler.send(message(1, MessageType.ping, cnt), KEY)
+                                                            for cnt in range(4)]))
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.conn.transport.written, [])
+            self.assertFalse(sender.done())
+            with self.assertRaises(asyncio.QueueFull):
+                scheduler.put_packet(message(1, MessageType.ping), KEY)
+
+            self.conn.resume_writing()
+            await asyncio.wait_for(sender, 1)
+            await asyncio.sleep(0.01)
+            scheduler.stop()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(len(written_messages(self.conn.transport)), 4)
+        self.assertEqual(len(scheduler), 0)
+
+    def test_connection_writes_through_scheduler(self):
+        self.conn.scheduler = WriteScheduler(self.conn, rate=1e6)
+
+        async def run():
+            self.conn.put_packet(message(1, MessageType.configure), KEY)
+            await self.conn.send(message(2, MessageType.set_state), KEY)
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.conn.transport.written, [])
+
+            self.conn.connection_made(self.conn.transport)
+            await asyncio.sleep(0.01)
+            self.assertEqual(written_messages(self.conn.transport),
+                             [(2, MessageType.set_state), (1, MessageType.configure)])
+
+            # Frames queued while the link is down are written after the reconnect.
+            self.conn.connection_lost(None)
+            self.conn.put_packet(message(3, MessageType.ping), KEY)
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(self.conn.scheduler), 1)
+            self.conn.connection_made(self.conn.transport)
+            await asyncio.sleep(0.01)
+            self.conn.scheduler.stop()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(written_messages(self.conn.transport)[-1], (3, MessageType.ping))
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+
+from meshnet.serio.connection import AioSerialConnection
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.supervisor import SupervisedConnection
+from tests.helpers import KEY, FakeTransport
+
+
+
+class FakePort(object):
+    """Connects the transport, failing as often as told to."""
+
+    def __init__(self, connection: AioSerialConnection, failures: int = 0):
+        self.connection = connection
+        self.failures = failures
+        self.attempts = 0
+        self.transports = []
+
+    async def connect(self):
+        self.attempts += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError("no such device")
+        transport = FakeTransport()
+        self.transports.append(transport)
+        self.connection.connection_made(transport)
+
+
+def counters(transport: FakeTransport):
+    return [msg.counter for msg in transport.messages()]
+
+
+def message(counter):
+    return SerialMessage(0, 1, MessageType.set_state, None, 1, counter, b"\x00\xff")
+
+
+class TestSupervisedConnection(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.conn = AioSerialConnection()
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_backoff_and_queue(self):
+        port = FakePort(self.conn, failures=3)
+        supervisor = SupervisedConnection(self.conn, port.connect, min_delay=0.01, max_delay=0.02)
+
+        async def run():
+            supervisor.put_packet(message(1), KEY)
+            supervisor.put_packet(message(2), KEY, ttl=0)
+            supervisor.start()
+            await asyncio.sleep(0.2)
+            supervisor.put_packet(message(3), KEY)
+            supervisor.stop()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(port.attempts, 4)
+        self.assertTrue(supervisor.connected)
+        self.assertEqual(counters(port.transports[0]), [1, 3])
+        self.assertEqual(supervisor.expired, 1)
+
+    def test_reconnect(self):
+        port = FakePort(self.conn)
+        supervisor = SupervisedConnection(self.conn, port.connect, min_delay=0.01)
+
+        async def run():
+            supervisor.start()
+            await asyncio.sleep(0.01)
+            self.conn.connection_lost(None)
+            self.assertFalse(supervisor.connected)
+            supervisor.put_packet(message(4), KEY)
+            await asyncio.sleep(0.05)
+            supervisor.stop()
+
+        self.loop.run_until_complete(run())
+        self.assertEqual(supervisor.reconnects, 1)
+        self.assertEqual(len(port.transports), 2)
+        self.assertEqual(counters(port.transports[1]), [4])
+
+    def test_bounded_queue(self):
+        supervisor = SupervisedConnection(self.conn, FakePort(self.conn).connect, max_queued=2)
+        for cnt in range(5):
+            supervisor.put_packet(message(cnt), KEY)
+        self.assertEqual(len(supervisor), 2)
+        self.assertEqual(supervisor.dropped, 3)
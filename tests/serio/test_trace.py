@@ -0,0 +1,39 @@
+import io
+import unittest
+
+from meshnet.serio.connection import AioSerialConnection
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.trace import FrameTrace, TraceDirection
+from tests.helpers import KEY, FakeTransport
+
+
+
+class TestFrameTrace(unittest.TestCase):
+    def test_ring(self):
+        trace = FrameTrace(size=2)
+        for data in (b"\x01", b"\x02", b"\x03"):
+            trace.record(TraceDirection.received, data)
+        self.assertEqual([entry[2] for entry in trace], [b"\x02", b"\x03"])
+
+    def test_disarmed(self):
+        trace = FrameTrace(armed=False)
+        trace.record(TraceDirection.sent, b"\x01")
+        self.assertEqual(len(trace), 0)
+
+    def test_connection(self):
+        conn = AioSerialConnection()
+        conn.transport = FakeTransport()
+        conn.trace = FrameTrace()
+
+        conn.data_received(b"\xaf\x01")
+        conn.put_packet(SerialMessage(0, 1, MessageType.ping, None, 1, 1, b""), KEY)
+
+        directions = [entry[1] for entry in conn.trace]
+        self.assertEqual(directions, [TraceDirection.received, TraceDirection.sent])
+
+        out = io.StringIO()
+        conn.trace.dump(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith(" < af 01"))
+        self.assertEqual(conn.trace.format(), out.getvalue().rstrip("\n"))
@@ -1,6 +1,6 @@
 import unittest
 
-from meshnet.serio.util import to_hex
+from meshnet.serio.util import to_hex, LazyHex
 
 
 class TestUtil(unittest.TestCase):
@@ -8,3 +8,7 @@ class TestUtil(unittest.TestCase):
         data = b"heuhfsdowofurhfualdgf"
         self.assertEqual("68 65 75 68 66 73 64 6f 77 6f 66 75 72 68 66 75 61 6c 64 67 66",
                          to_hex(data))
+
+    def test_lazy_hex(self):
+        self.assertEqual(str(LazyHex(b"\x01\xab")), "01 ab")
+        self.assertEqual("{}".format(LazyHex(b"\x01\xab", True)), "{0x01, 0xab}")
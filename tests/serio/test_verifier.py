@@ -0,0 +1,63 @@
+import unittest
+from unittest import mock
+
+from meshnet.metrics import MetricsRegistry, SerialMetrics
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.verifier import MessageVerifier
+from tests.helpers import KEY
+
+OTHER_KEY = b'\x0f\x0e\x0d\x0c\x0b\x0a\x09\x08\x07\x06\x05\x04\x03\x02\x01\x00'
+
+VALID = b"\x00\x00F\t\x00\x0c\x00\x01jsif\x5e\x36\x5b\x9c\xe4\xc7\x03\x38"
+INVALID = b"\x00\x00F\t\x00\x0c\x00\x01jsif\x5e\x36\x5b\x9c\xe4\xc7\x03\x39"
+
+
+class TestMessageVerifier(unittest.TestCase):
+    def test_verify(self):
+        verifier = MessageVerifier(KEY)
+        self.assertTrue(verifier.verify(SerialMessage.parse(VALID)))
+        self.assertFalse(verifier.verify(SerialMessage.parse(INVALID)))
+        self.assertEqual(verifier.verified, 1)
+        self.assertEqual(verifier.failures[0], 1)
+
+    def test_metrics_labels(self):
+        verifier = MessageVerifier(KEY)
+        verifier.metrics = metrics = SerialMetrics(MetricsRegistry())
+        verifier.verify(SerialMessage.parse(INVALID))
+        verifier.verify(SerialMessage.parse(b"\x12\x34" + INVALID[2:]))
+        self.assertEqual(metrics.hash_failures.value(("unknown",)), 2)
+
+        verifier.verify(SerialMessage.parse(VALID))
+        verifier.verify(SerialMessage.parse(INVALID))
+        self.assertEqual(metrics.hash_failures.value(("0",)), 1)
+        self.assertEqual(metrics.rejected_frames.value(("hash",)), 3)
+        self.assertEqual(metrics.messages.value(("booted", "0")), 1)
+        self.assertEqual(metrics.messages.total(), 1)
+
+    def test_raw_and_packed_hash_match(self):
+        message = SerialMessage.parse(VALID)
+        self.assertIsNotNone(message.raw)
+        self.assertEqual(message._compute_hash(KEY),
+                         SerialMessage(0, 0, MessageType.booted, None, 12, 1, b"jsif")._compute_hash(KEY))
+
+    def test_node_keys(self):
+        verifier = MessageVerifier(OTHER_KEY, {0: KEY})
+        self.assertTrue(verifier.verify(SerialMessage.parse(VALID)))
+
+        verifier = MessageVerifier(node_keys={1: KEY})
+        self.assertFalse(verifier.verify(SerialMessage.parse(VALID)))
+
+    def test_batch(self):
+        verifier = MessageVerifier(KEY)
+        messages = [SerialMessage.parse(data) for data in (VALID, INVALID, VALID)]
+        valid = verifier.verify_batch(messages)
+        self.assertEqual(valid, [messages[0], messages[2]])
+        self.assertEqual(verifier.verified, 2)
+        self.assertEqual(verifier.failures[0], 1)
+
+    def test_rate_limited_logging(self):
+        verifier = MessageVerifier(KEY, log_interval=60)
+        with mock.patch("meshnet.serio.verifier.logger") as fake_logger:
+            verifier.verify_batch([SerialMessage.parse(INVALID)] * 50)
+            self.assertEqual(fake_logger.warning.call_count, 1)
+        self.assertEqual(verifier.failures[0], 50)
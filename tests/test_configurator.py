@@ -0,0 +1,91 @@
+import copy
+import random
+import unittest
+
+from meshnet.configurator import Configurator
+from meshnet.node import Registry
+from meshnet.serio.connection import AioSerialConnection
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.verifier import MessageVerifier
+from tests.helpers import KEY, FakeTransport, ListWriter, signed
+
+CONFIG = {"nodes": {1: {"name": "one", "devices": [{"type": "bin_switch", "name": "a", "data": {"pin": 10}},
+                                                   {"type": "bin_sensor", "name": "b", "data": {"pin": 11}}]},
+                    2: {"name": "two", "devices": [{"type": "bin_switch", "name": "a", "data": {"pin": 10}}]}}}
+
+
+class TestConfigurator(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry.from_config(CONFIG, MessageVerifier(KEY), learn=True)
+        self.configurator = Configurator(self.registry, KEY, CONFIG, random.Random(1))
+        self.writer = ListWriter()
+
+    def boot(self, node_id, session=0x10):
+        message = SerialMessage(node_id, 0, MessageType.booted, None, session, 0, b"")
+        self.registry.on_message(signed(message), self.writer)
+
+    def test_configure_on_boot(self):
+        self.boot(1)
+        self.assertEqual([msg.msg_type for msg in self.writer.messages],
+                         [MessageType.configure, MessageType.configure, MessageType.configured])
+        self.assertEqual(self.writer.messages[0].payload, b"\x00\x0aa\0")
+        self.assertEqual(self.writer.messages[1].payload, b"\x01\x0bb\0")
+        self.assertEqual([msg.session for msg in self.writer.messages], [0x10] * 3)
+        self.assertEqual([msg.counter for msg in self.writer.messages], [1, 2, 3])
+
+        node = self.registry.get(1)
+        self.assertEqual(self.writer.messages[2].payload, node.session.to_bytes(2, "big"))
+        self.assertEqual(node.next_counter(), 1)
+
+    def test_reconnect(self):
+        self.boot(1)
+        self.boot(2, session=0x20)
+        node = self.registry.get(2)
+        self.registry.on_message(signed(SerialMessage(2, 0, MessageType.pong, None, node.session, 0, b"")),
+                                 self.writer)
+        self.assertEqual(self.configurator.unconfirmed(), [1])
+
+        # Node 1 may have missed its configuration while the link was down.
+        connection = AioSerialConnection()
+        connection.subscribe(self.configurator, types=())
+        connection.connection_made(FakeTransport())
+        self.assertEqual([(msg.sender, msg.msg_type, msg.session, msg.counter)
+                          for msg in connection.transport.messages()], [(1, MessageType.reset, 0x10, 4)])
+
+        # It boots again and is configured from scratch.
+        self.writer.messages.clear()
+        self.boot(1, session=0x11)
+        self.assertEqual([msg.msg_type for msg in self.writer.messages],
+                         [MessageType.configure, MessageType.configure, MessageType.configured])
+        node = self.registry.get(1)
+        self.registry.on_message(signed(SerialMessage(1, 0, MessageType.pong, None, node.session, 0, b"")),
+                                 self.writer)
+        self.assertEqual(self.configurator.unconfirmed(), [])
+
+    def test_apply(self):
+        self.boot(1)
+        self.boot(2)
+        self.boot(5)
+        self.writer.messages.clear()
+        sessions = {node.node_id: node.session for node in self.registry}
+
+        new = copy.deepcopy(CONFIG)
+        new["nodes"][1]["name"] = "eins"
+        new["nodes"][2]["devices"][0]["data"]["pin"] = 9
+        new["nodes"][3] = {"name": "three", "devices": []}
+        new["nodes"][5] = {"name": "five", "devices": []}
+        self.configurator.apply(new, self.writer)
+
+        self.assertEqual([(msg.receiver, msg.msg_type, msg.session) for msg in self.writer.messages],
+                         [(5, MessageType.reset, sessions[5]), (2, MessageType.reset, sessions[2])])
+        self.assertEqual(self.registry.get(1).name, "eins")
+        self.assertEqual(self.registry.get(2).devices[0]["data"]["pin"], 9)
+        self.assertEqual(self.registry.get(5).name, "five")
+        self.assertIsNone(self.registry.get(3).session)
+
+        new = copy.deepcopy(new)
+        del new["nodes"][3]
+        self.writer.messages.clear()
+        self.configurator.apply(new, self.writer)
+        self.assertNotIn(3, self.registry)
+        self.assertEqual(self.writer.messages, [])
@@ -0,0 +1,104 @@
+import random
+import time
+import unittest
+
+from meshnet.liveness import LivenessMonitor, TimerWheel
+from meshnet.node import Registry
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.verifier import MessageVerifier
+from tests.helpers import KEY, ListWriter, signed
+
+CONFIG = {"nodes": {1: {"name": "one", "devices": []}, 2: {"name": "two", "devices": []}}}
+
+
+class TestTimerWheel(unittest.TestCase):
+    def test_expire(self):
+        wheel = TimerWheel(1.0, 4)
+        wheel.schedule(1, 1.5)
+        wheel.schedule(2, 2.5)
+        wheel.schedule(3, 9.5)
+        wheel.schedule(4, 2.0)
+        wheel.cancel(4)
+
+        self.assertEqual(wheel.advance(1.4), [])
+        self.assertEqual(wheel.advance(2.6), [1, 2])
+        # Same slot as 1.5, but two rotations later.
+        self.assertEqual(wheel.advance(9.0), [])
+        self.assertEqual(wheel.advance(20.0), [3])
+        self.assertEqual(len(wheel), 0)
+
+    def test_past(self):
+        wheel = TimerWheel(1.0, 4, now=10.0)
+        wheel.schedule(1, 3.0)
+        wheel.schedule(1, 5.0)
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(wheel.advance(10.1), [1])
+
+
+class TestLivenessMonitor(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry.from_config(CONFIG, MessageVerifier(KEY))
+        self.monitor = LivenessMonitor(self.registry, KEY, silence=10, timeout=1, max_missed=2, jitter=0,
+                                       rng=random.Random(1))
+        self.changes = []
+        self.monitor.add_listener(lambda node, online: self.changes.append((node.node_id, online)))
+        self.writer = ListWriter()
+
+    def receive(self, msg_type, session, counter):
+        self.registry.on_message(signed(SerialMessage(1, 0, msg_type, None, session, counter, b"")), None)
+
+    def test_ping(self):
+        now = time.monotonic()
+        self.receive(MessageType.booted, 7, 0)
+        self.monitor.watch_all(now)
+        self.assertEqual(self.changes, [(1, True)])
+
+        # Node 1 was heard recently and node 2 never booted.
+        self.assertEqual(self.monitor.check(self.writer, now + 5), 0)
+
+        self.assertEqual(self.monitor.check(self.writer, now + 10.5), 1)
+        ping = self.writer.messages[0]
+        self.assertEqual((ping.receiver, ping.msg_type, ping.session), (1, MessageType.ping, 7))
+        node = self.registry.get(1)
+        self.assertEqual(ping.payload, node.pending_session.to_bytes(2, "big"))
+
+        # The pong comes in the new session.
+        self.receive(MessageType.pong, node.pending_session, 1)
+        self.assertEqual(node.session, int.from_bytes(ping.payload, "big"))
+        node.last_seen = now + 11
+        self.assertEqual(self.monitor.check(self.writer, now + 11.5), 0)
+
+    def test_lost_pong(self):
+        now = time.monotonic()
+        self.receive(MessageType.booted, 7, 0)
+        node = self.registry.get(1)
+        node.last_seen = now
+        self.assertEqual(self.monitor.check(self.writer, now + 10.5), 1)
+        proposed = node.pending_session
+
+        # The node switched to the proposed session, but its pong was lost.
+        self.assertEqual(self.monitor.check(self.writer, now + 12), 1)
+        self.assertEqual([ping.payload for ping in self.writer.messages], [proposed.to_bytes(2, "big")] * 2)
+        self.assertEqual(node.pending_session, proposed)
+
+        # The next pong the node sends on its own is accepted.
+        self.receive(MessageType.pong, proposed, 1)
+        self.assertEqual(node.session, proposed)
+        self.assertEqual(node.rejected, 0)
+        self.assertTrue(self.monitor.is_online(1))
+
+    def test_offline(self):
+        now = time.monotonic()
+        self.receive(MessageType.booted, 7, 0)
+        self.assertEqual(self.monitor.check(self.writer, now + 10.5), 1)
+        self.assertEqual(self.monitor.check(self.writer, now + 12), 1)
+        self.assertEqual(self.monitor.check(self.writer, now + 13.5), 1)
+        self.assertEqual(self.monitor.offline(), {1})
+        self.assertEqual(self.changes, [(1, True), (1, False)])
+
+        # Offline nodes are only pinged every silence interval.
+        self.assertEqual(self.monitor.check(self.writer, now + 15), 0)
+        self.assertEqual(self.monitor.check(self.writer, now + 24), 1)
+
+        self.receive(MessageType.booted, 8, 0)
+        self.assertTrue(self.monitor.is_online(1))
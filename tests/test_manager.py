@@ -0,0 +1,121 @@
+import asyncio
+import unittest
+
+from meshnet.manager import ConnectionManager
+from meshnet.node import Registry
+from meshnet.serio.connection import MessageHandler, MessageWriter, OverflowPolicy
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.verifier import MessageVerifier
+from tests.helpers import KEY, FakeTransport, NodeMessage
+
+
+class ReplyHandler(MessageHandler):
+    def __init__(self):
+        self.connected = 0
+        self.disconnected = 0
+
+    def on_message(self, message: SerialMessage, writer: MessageWriter):
+        writer.put_packet(SerialMessage(0, message.sender, MessageType.pong, None, 1, 1, b""), KEY)
+
+    def on_connect(self, writer: MessageWriter):
+        self.connected += 1
+
+    def on_disconnect(self):
+        self.disconnected += 1
+
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.verifier = MessageVerifier(KEY)
+        self.registry = Registry(self.verifier, learn=True)
+        self.manager = ConnectionManager(self.verifier, self.registry)
+        self.handler = ReplyHandler()
+        self.manager.register_handler(self.handler)
+
+        self.transports = {}
+        self.connections = {}
+        for name in ("a", "b"):
+            self.transports[name] = FakeTransport()
+            self.connections[name] = self.manager.add_link(name)
+            self.connections[name].connection_made(self.transports[name])
+
+    def receive(self, link, sender):
+        frame = NodeMessage(sender, 0, MessageType.booted, None, 1, 0, b"").framed(KEY)
+        self.connections[link].data_received(frame)
+
+    def tearDown(self):
+        for link in self.manager.links():
+            self.manager._links[link].connection.scheduler.stop()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def receivers(self, link):
+        # Let the schedulers write what is queued.
+        self.loop.run_until_complete(asyncio.sleep(0.02))
+        return [msg.sender for msg in self.transports[link].messages()]
+
+    def test_invalid_hash(self):
+        self.receive("a", 1)
+        frame = bytearray(NodeMessage(1, 0, MessageType.booted, None, 2, 0, b"").framed(KEY))
+        frame[-2] ^= 0xff
+        self.connections["b"].data_received(bytes(frame))
+
+        self.assertEqual(self.manager.route(1), "a")
+        self.assertEqual(self.registry.get(1).session, 1)
+        self.assertEqual(self.verifier.failures[1], 1)
+
+    def test_routing(self):
+        self.assertEqual(self.handler.connected, 1)
+
+        self.receive("a", 1)
+        self.receive("b", 2)
+        self.assertEqual(self.receivers("a"), [1])
+        self.assertEqual(self.receivers("b"), [2])
+        self.assertEqual(len(self.registry), 2)
+        self.assertEqual(self.manager.route(1), "a")
+
+        # Node moved to the other master.
+        self.receive("b", 1)
+        self.assertEqual(self.manager.route(1), "b")
+
+        self.manager.put_packet(SerialMessage(0, 3, MessageType.ping, None, 1, 1, b""), KEY)
+        self.assertEqual(self.receivers("a"), [1, 3])
+        self.assertEqual(self.receivers("b"), [2, 1, 3])
+
+    def test_stats(self):
+        self.receive("a", 1)
+        self.receive("a", 2)
+        stats = self.manager.stats()
+        self.assertEqual(stats["a"].frames_in, 2)
+        self.assertEqual(stats["a"].frames_out, 2)
+        self.assertEqual(stats["b"].frames_in, 0)
+        self.assertEqual(self.manager.total_stats().bytes_in, 2 * 21)
+        self.assertGreater(stats["a"].rates()["frames_in"], 0)
+
+    def test_disconnect(self):
+        self.receive("a", 1)
+        self.connections["a"].connection_lost(None)
+        self.assertIsNone(self.manager.route(1))
+        self.assertEqual(self.handler.disconnected, 0)
+
+        self.connections["b"].connection_lost(None)
+        self.assertEqual(self.handler.disconnected, 1)
+
+    def test_blocking_stream(self):
+        stream = self.manager.messages(types=[MessageType.booted], maxsize=2, policy=OverflowPolicy.block)
+        self.receive("a", 1)
+        self.receive("b", 2)
+        self.assertFalse(self.transports["a"].paused)
+        self.receive("b", 3)
+        self.assertTrue(all(transport.paused for transport in self.transports.values()))
+
+        self.manager.add_link("c").connection_made(FakeTransport())
+        self.assertTrue(self.manager._links["c"].connection.reading_paused)
+
+        self.assertEqual(stream.get_nowait().sender, 1)
+        self.assertEqual(stream.get_nowait().sender, 2)
+        self.assertFalse(any(transport.paused for transport in self.transports.values()))
+        self.assertFalse(self.manager._links["c"].connection.reading_paused)
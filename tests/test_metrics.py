@@ -0,0 +1,74 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from meshnet.metrics import MetricsRegistry, MetricsServer, SerialMetrics
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter("frames_total", "Frames", ("type",))
+        counter.inc(("ping",))
+        counter.inc(("ping",), 2)
+        counter.inc(("pong",))
+        self.assertIs(self.registry.counter("frames_total", "Frames", ("type",)), counter)
+        with self.assertRaises(ValueError):
+            self.registry.histogram("frames_total", "Frames")
+
+        self.assertEqual(self.registry.render(),
+                         '# HELP frames_total Frames\n'
+                         '# TYPE frames_total counter\n'
+                         'frames_total{type="ping"} 3\n'
+                         'frames_total{type="pong"} 1\n')
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("size", "Sizes", (10, 100))
+        for value in (1, 10, 50, 500):
+            histogram.observe(value)
+        self.assertEqual(histogram.render(),
+                         ['size_bucket{le="10"} 2', 'size_bucket{le="100"} 3', 'size_bucket{le="+Inf"} 4',
+                          'size_sum 561', 'size_count 4'])
+
+    def test_dump(self):
+        SerialMetrics(self.registry, per_node=False).hash_failure(3)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "meshnet.prom")
+            self.registry.dump(filename)
+            with open(filename) as fp:
+                self.assertIn("meshnet_serial_hash_failures_total 1\n", fp.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestMetricsServer(unittest.TestCase):
+    def test_scrape(self):
+        registry = MetricsRegistry()
+        SerialMetrics(registry).received(10)
+        server = MetricsServer(registry, port=0)
+
+        async def get(path):
+            await server.start()
+            try:
+                port = server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write("GET {} HTTP/1.0\r\nHost: localhost\r\n\r\n".format(path).encode())
+                response = await reader.read()
+                writer.close()
+                return response
+            finally:
+                await server.stop()
+
+        loop = asyncio.new_event_loop()
+        try:
+            response = loop.run_until_complete(get("/metrics"))
+            self.assertTrue(response.startswith(b"HTTP/1.0 200 OK"))
+            self.assertIn(b"meshnet_serial_received_bytes_total 10\n", response)
+            self.assertTrue(loop.run_until_complete(get("/other")).startswith(b"HTTP/1.0 404"))
+        finally:
+            loop.close()
@@ -0,0 +1,138 @@
+import random
+import unittest
+
+from meshnet.node import Node, Registry, MAX_COUNTER, RENEW_COUNTER
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.verifier import MessageVerifier
+from tests.helpers import KEY, ListWriter, signed
+
+
+CONFIG = {"nodes": {1: {"name": "testnode 01",
+                        "devices": [{"type": "bin_switch", "name": "peng", "data": {"pin": 10}}]},
+                    0xffff: {"name": "last", "devices": []}}}
+
+
+def message(sender, msg_type, session, counter):
+    return signed(SerialMessage(sender, 0, msg_type, None, session, counter, b""))
+
+
+class TestNode(unittest.TestCase):
+    def test_counter(self):
+        node = Node(1)
+        self.assertEqual([node.next_counter() for _ in range(3)], [1, 2, 3])
+        node.set_session(5)
+        self.assertEqual(node.next_counter(), 1)
+
+    def test_counter_limit(self):
+        node = Node(1)
+        node._counter = RENEW_COUNTER - 1
+        self.assertFalse(node.needs_session)
+        node._counter = RENEW_COUNTER
+        self.assertTrue(node.needs_session)
+
+        node._counter = MAX_COUNTER - 1
+        with self.assertLogs("meshnet.node", "WARNING"):
+            self.assertEqual(node.next_counter(), MAX_COUNTER)
+        # The counter does not wrap to values the node rejects.
+        self.assertEqual(node.next_counter(), MAX_COUNTER)
+
+    def test_invalid_id(self):
+        with self.assertRaises(ValueError):
+            Node(0x10000)
+
+    def test_replay(self):
+        node = Node(1)
+        self.assertFalse(node.accept(message(1, MessageType.pong, 0x12, 1)))
+        # Only the registry takes a boot as reset, as a message of the node it is in the wrong session.
+        self.assertFalse(node.accept(message(1, MessageType.booted, 0x12, 0)))
+        self.assertTrue(node.boot(message(1, MessageType.booted, 0x12, 0), now=10))
+        self.assertEqual(node.session, 0x12)
+        self.assertEqual(node.last_seen, 10)
+
+        self.assertTrue(node.accept(message(1, MessageType.pong, 0x12, 1)))
+        self.assertFalse(node.accept(message(1, MessageType.pong, 0x12, 1)))
+        self.assertFalse(node.accept(message(1, MessageType.pong, 0x13, 2)))
+        with self.assertLogs("meshnet.node", "WARNING"):
+            self.assertFalse(node.boot(message(1, MessageType.booted, 0x12, 0)))
+        self.assertEqual(node.last_counter, 1)
+        self.assertEqual(node.rejected, 5)
+
+        node.set_session(0x13)
+        self.assertTrue(node.accept(message(1, MessageType.pong, 0x13, 0)))
+
+
+class TestRegistry(unittest.TestCase):
+    def test_from_config(self):
+        registry = Registry.from_config(CONFIG, MessageVerifier(KEY))
+        self.assertEqual(len(registry), 2)
+        self.assertEqual(registry.get(1).name, "testnode 01")
+        self.assertEqual(registry.get(1).devices[0]["name"], "peng")
+        self.assertIn(0xffff, registry)
+        self.assertIsNone(registry.get(2))
+
+    def test_dispatch(self):
+        registry = Registry.from_config(CONFIG, MessageVerifier(KEY))
+        received = []
+        registry.add_listener(lambda node, msg, writer: received.append((node.node_id, msg.msg_type)))
+
+        registry.on_message(message(1, MessageType.booted, 7, 0), None)
+        registry.on_message(message(1, MessageType.reading, 7, 0), None)
+        registry.on_message(message(2, MessageType.booted, 7, 0), None)
+
+        self.assertEqual(received, [(1, MessageType.booted)])
+        self.assertEqual(registry.unknown, 1)
+
+    def test_invalid_hash(self):
+        registry = Registry.from_config(CONFIG, MessageVerifier(KEY))
+        registry.on_message(message(1, MessageType.booted, 7, 0), None)
+
+        corrupt = message(1, MessageType.pong, 7, 0xfff0)
+        corrupt.hash_sum = b"\x00" * 8
+        registry.on_message(corrupt, None)
+        self.assertEqual(registry.get(1).last_counter, 0)
+        self.assertEqual(registry.verifier.failures[1], 1)
+
+        registry.on_message(message(1, MessageType.pong, 7, 1), None)
+        self.assertEqual(registry.get(1).last_counter, 1)
+
+    def test_renew_session(self):
+        registry = Registry.from_config(CONFIG, MessageVerifier(KEY), rng=random.Random(1))
+        writer = ListWriter()
+        registry.on_message(message(1, MessageType.booted, 7, 0), writer)
+        node = registry.get(1)
+
+        # The node's counter is about to wrap, it gets a new session with every message until it switched.
+        registry.on_message(message(1, MessageType.pong, 7, RENEW_COUNTER), writer)
+        registry.on_message(message(1, MessageType.pong, 7, RENEW_COUNTER + 1), writer)
+        session = node.pending_session
+        self.assertEqual([(msg.msg_type, msg.session, msg.payload) for msg in writer.messages],
+                         [(MessageType.ping, 7, session.to_bytes(2, "big"))] * 2)
+
+        registry.on_message(message(1, MessageType.pong, session, 0), writer)
+        self.assertEqual((node.session, node.last_counter), (session, 0))
+        self.assertEqual(len(writer.messages), 2)
+
+        # The same for the counter of the host.
+        node._counter = RENEW_COUNTER
+        registry.on_message(message(1, MessageType.pong, session, 1), writer)
+        self.assertEqual(writer.messages[-1].msg_type, MessageType.ping)
+        self.assertEqual(writer.messages[-1].counter, RENEW_COUNTER + 1)
+        registry.on_message(message(1, MessageType.pong, node.pending_session, 0), writer)
+        self.assertEqual(node.next_counter(), 1)
+
+    def test_learn(self):
+        registry = Registry(MessageVerifier(KEY), learn=True)
+        self.assertIsNone(registry.dispatch(message(3, MessageType.pong, 7, 1)))
+        self.assertEqual(registry.dispatch(message(3, MessageType.booted, 7, 0)).node_id, 3)
+        self.assertIn(3, registry)
+
+    def test_state_messages(self):
+        node = Registry.from_config(CONFIG, MessageVerifier(KEY)).get(1)
+        node.set_session(7)
+        messages = node.state_messages([(0, True)])
+        self.assertEqual([(msg.receiver, msg.msg_type, msg.session, msg.counter, msg.payload) for msg in messages],
+                         [(1, MessageType.set_state, 7, 1, b"\x00\xff")])
+        self.assertEqual(node.state_messages([0], MessageType.get_state)[0].payload, b"\x00")
+
+        node.devices = node.devices + [{"type": "dimmer", "name": "dim", "data": {"pin": 3}}]
+        self.assertEqual(node.state_payload.decode(b"\x01\x20"), [(1, 0x20)])
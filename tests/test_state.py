@@ -0,0 +1,75 @@
+import unittest
+
+from meshnet.node import Registry
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.verifier import MessageVerifier
+from meshnet.state import StateCache
+from tests.helpers import KEY, ListWriter, signed
+
+CONFIG = {"nodes": {1: {"name": "one", "devices": [{"type": "bin_switch", "name": "sw", "data": {"pin": 10}},
+                                                   {"type": "dimmer", "name": "dim", "data": {"pin": 11}}]},
+                    2: {"name": "two", "devices": [{"type": "bin_sensor", "name": "bs", "data": {"pin": 10}}]}}}
+
+
+class TestStateCache(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry.from_config(CONFIG, MessageVerifier(KEY))
+        self.cache = StateCache(self.registry, KEY, max_age=10)
+        self.writer = ListWriter()
+        self.counter = 0
+        self.session = 7
+        self.receive(MessageType.booted, b"")
+
+    def receive(self, msg_type, payload):
+        message = SerialMessage(1, 0, msg_type, None, self.session, self.counter, payload)
+        self.registry.on_message(signed(message), None)
+        self.counter += 1
+
+    def test_readings(self):
+        self.assertIsNone(self.cache.get(1, "sw"))
+        self.receive(MessageType.reading, b"\x00\xff\x01\x20")
+        self.assertTrue(self.cache.get(1, "sw"))
+        self.assertEqual(self.cache.get(1, 1), 0x20)
+        self.assertTrue(self.cache.item(1, "dim").confirmed)
+
+        self.session = 8
+        self.receive(MessageType.booted, b"")
+        self.assertIsNone(self.cache.get(1, "sw"))
+
+        self.receive(MessageType.reading, b"\x00\xff")
+        with self.assertRaises(KeyError):
+            self.cache.get(1, "nope")
+
+    def test_suppress(self):
+        self.receive(MessageType.reading, b"\x00\xff")
+        self.assertEqual(self.cache.set_state(1, [("sw", True)], self.writer), 0)
+        self.assertEqual(self.cache.suppressed, 1)
+        self.assertEqual(self.cache.set_state(1, [("sw", True)], self.writer, force=True), 1)
+
+        self.assertEqual(self.cache.set_state(1, [("sw", False), ("dim", 3)], self.writer), 2)
+        self.assertEqual([msg.payload for msg in self.writer.messages[-2:]], [b"\x00\x00", b"\x01\x03"])
+        self.assertFalse(self.cache.item(1, "sw").confirmed)
+
+        # Just requested, the node did not confirm it yet.
+        self.assertEqual(self.cache.set_state(1, [("dim", 3)], self.writer), 0)
+
+        # Not confirmed within the resend window, the frame may have been lost.
+        self.cache.item(1, "dim").updated -= 6
+        self.assertEqual(self.cache.set_state(1, [("dim", 3)], self.writer), 1)
+
+        self.receive(MessageType.reading, b"\x01\x03")
+        self.cache.item(1, "dim").updated -= 6
+        self.assertEqual(self.cache.set_state(1, [("dim", 3)], self.writer), 0)
+        self.cache.item(1, "dim").updated -= 5
+        self.assertEqual(self.cache.set_state(1, [("dim", 3)], self.writer), 1)
+
+    def test_refresh(self):
+        self.receive(MessageType.reading, b"\x00\xff")
+        self.assertEqual(self.cache.stale(), [(1, 1), (2, 0)])
+
+        # Node 2 did not boot yet.
+        self.assertEqual(self.cache.refresh(self.writer), 1)
+        self.assertEqual([(msg.receiver, msg.msg_type, msg.payload) for msg in self.writer.messages],
+                         [(1, MessageType.get_state, b"\x01")])
+        with self.assertRaises(ValueError):
+            self.cache.set_state(2, [(0, True)], self.writer)
@@ -0,0 +1,136 @@
+import io
+import unittest
+
+from meshnet.node import Registry
+from meshnet.serio.messages import SerialMessage, MessageType
+from meshnet.serio.verifier import MessageVerifier
+from meshnet.storage import Ring, ReadingStore, Series, read_spill
+from tests.helpers import KEY, signed
+
+CONFIG = {"nodes": {1: {"name": "one", "devices": [{"type": "bin_switch", "name": "sw", "data": {"pin": 10}},
+                                                   {"type": "rgb_lamp", "name": "rgb",
+                                                    "data": {"red_pin": 1, "green_pin": 2, "blue_pin": 3}}]}}}
+
+
+class TestRing(unittest.TestCase):
+    def test_wrap(self):
+        ring = Ring("dL", 3)
+        self.assertIsNone(ring.append(1.0, 10))
+        ring.append(2.0, 20)
+        ring.append(3.0, 30)
+        self.assertEqual(ring.append(4.0, 40), (1.0, 10))
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(list(ring.column(0)), [2.0, 3.0, 4.0])
+        self.assertEqual(list(ring.column(1, 1)), [30, 40])
+        self.assertEqual(ring.bisect(0, 3.5), 2)
+        self.assertEqual(ring.bisect(0, 0), 0)
+        self.assertEqual(ring.bisect(0, 5), 3)
+
+
+class TestSeries(unittest.TestCase):
+    def test_samples(self):
+        series = Series(capacity=10)
+        for second in range(5):
+            series.add(second, second * 2)
+        times, values = series.samples(1, 3)
+        self.assertEqual(list(times), [1, 2])
+        self.assertEqual(list(values), [2, 4])
+        self.assertEqual(series.latest(), (4, 8))
+        self.assertEqual(series.aggregate(), (0, 8, 4, 5))
+        self.assertIsNone(series.aggregate(10, 20))
+
+    def test_downsampling(self):
+        series = Series(capacity=10, resolution=10, history=1)
+        for second in range(40):
+            series.add(second, second)
+
+        self.assertEqual(len(series), 10)
+        self.assertEqual(list(series.samples()[0]), list(range(30, 40)))
+        # The oldest bucket is dropped, the last one is still open.
+        self.assertEqual(series.downsampled(), [(10, (10, 19, 14.5, 10)), (20, (20, 29, 24.5, 10))])
+        self.assertEqual(series.aggregate(20), (20, 39, 29.5, 20))
+
+    def test_downsampling_by_age(self):
+        series = Series(capacity=100, resolution=10, max_age=15)
+        for second in range(40):
+            series.add(second, second)
+
+        self.assertEqual(list(series.samples()[0]), list(range(24, 40)))
+        self.assertEqual(series.downsampled(), [(0, (0, 9, 4.5, 10)), (10, (10, 19, 14.5, 10)),
+                                                (20, (20, 23, 21.5, 4))])
+        self.assertEqual(series.aggregate(), (0, 39, 19.5, 40))
+
+
+class FailingFile(io.BytesIO):
+    """Fails all writes after the first ``writes``."""
+
+    def __init__(self, writes):
+        super().__init__()
+        self.writes = writes
+
+    def write(self, data):
+        if self.writes <= 0:
+            raise OSError("disk full")
+        self.writes -= 1
+        return super().write(data)
+
+
+class TestReadingStore(unittest.TestCase):
+    def test_readings(self):
+        registry = Registry.from_config(CONFIG, MessageVerifier(KEY))
+        store = ReadingStore()
+        registry.add_listener(store.on_node_message)
+
+        for msg_type, counter, payload in ((MessageType.booted, 0, b""),
+                                           (MessageType.reading, 1, b"\x00\xff\x01\x01\x02\x03"),
+                                           (MessageType.reading, 2, b"\x07\xff")):
+            registry.on_message(signed(SerialMessage(1, 0, msg_type, None, 7, counter, payload)), None)
+
+        self.assertEqual(sorted(store), [(1, "rgb"), (1, "sw")])
+        self.assertEqual(store.get(1, "sw").latest()[1], 1.0)
+        self.assertEqual(store.get(1, "rgb").latest()[1], 0x010203)
+
+    def test_spill(self):
+        store = ReadingStore(capacity=4)
+        for second in range(3):
+            store.add(1, "a", second, second)
+        fp = io.BytesIO()
+        self.assertEqual(store.spill(fp), 3)
+        self.assertEqual(store.spill(fp), 0)
+
+        for second in range(3, 10):
+            store.add(1, "a", second, second)
+        self.assertEqual(store.spill(fp), 4)
+        self.assertEqual(store.lost, 3)
+
+        fp.seek(0)
+        records = [(node_id, name, list(times), list(values)) for node_id, name, times, values in read_spill(fp)]
+        self.assertEqual(records, [(1, "a", [0, 1, 2], [0, 1, 2]), (1, "a", [6, 7, 8, 9], [6, 7, 8, 9])])
+
+    def test_spill_failure(self):
+        store = ReadingStore()
+        for second in range(3):
+            store.add(1, "a", second, second)
+            store.add(2, "b", second, second)
+        fp = FailingFile(1)
+        with self.assertRaises(OSError):
+            store.spill(fp)
+
+        # The samples that were not written go with the next spill.
+        fp.writes = 1
+        self.assertEqual(store.spill(fp), 3)
+        self.assertEqual(store.lost, 0)
+        fp.seek(0)
+        self.assertEqual(sorted((node_id, name, list(values)) for node_id, name, _, values in read_spill(fp)),
+                         [(1, "a", [0, 1, 2]), (2, "b", [0, 1, 2])])
+
+    def test_spill_long_name(self):
+        store = ReadingStore()
+        store.add(1, "x" * 300, 0, 1)
+        store.add(1, "y" * 0x10000, 0, 1)
+        fp = io.BytesIO()
+        with self.assertLogs("meshnet.storage", "ERROR"):
+            self.assertEqual(store.spill(fp), 1)
+        self.assertEqual(store.lost, 1)
+        fp.seek(0)
+        self.assertEqual([name for _, name, _, _ in read_spill(fp)], ["x" * 300])